@@ -1,8 +1,12 @@
 import logging
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple, Type, AsyncIterator
 import json
+import hashlib
+import asyncio
 from fastapi import APIRouter, HTTPException, Depends, Query
-from pydantic import BaseModel
+from app.core.sse import SSEStreamingResponse, encode_event
+from app.core.json_stream import IncrementalJSONExtractor, StructuredOutputError
+from pydantic import BaseModel, field_validator
 import traceback
 from datetime import datetime, timedelta
 
@@ -12,12 +16,27 @@ from app.core.prompt_templates import (
     VULNERABILITY_RISK_ASSESSMENT_PROMPT,
     VULNERABILITY_ANALYSIS_PROMPT,
     VULNERABILITY_REMEDIATION_PROMPT,
-    DATA_CHART_GENERATION_PROMPT
+    DATA_CHART_GENERATION_PROMPT,
+    CHART_SPEC_PLANNER_PROMPT
 )
 from app.api.deps import get_dify_service
 from app.core.config import settings
 from app.api.endpoints.vulnerabilities import mock_vulnerabilities, get_vulnerabilities
 from app.api.endpoints.assets import mock_assets, get_assets
+from app.services.asset_risk import asset_risk_index
+from app.services.response_cache import ai_response_cache
+from app.services.data_version import data_version
+from app.services.vpr_scoring import vpr_scoring_engine
+from app.services.dify_scheduler import set_request_priority, PRIORITY_ANALYSIS, PRIORITY_BATCH
+from app.exceptions.dify_error import DifyOverloadedError, DifyCircuitOpenError
+from app.services.vulnerability_query import vulnerability_query_engine, QUERY_FIELDS
+from app.services.enrichment_jobs import enrichment_job_manager
+from app.services.job_store import job_event_bus, JOB_FINAL_STATUSES
+from app.services.job_queue import ai_job_queue
+from app.services.chart_summary import (
+    summarize_vulnerabilities, summarize_assets, apply_filter_conditions, compact_json
+)
+from app.services.chart_spec import normalize_description, validate_spec, execute_spec, build_chart_config
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -35,6 +54,14 @@ class VulnerabilityAutoCompleteResponse(BaseModel):
     impact_details: Optional[str] = None
     affected_components: Optional[str] = None
 
+    @field_validator("remediation_steps", mode="before")
+    @classmethod
+    def join_remediation_steps(cls, value):
+        # AI有时以列表形式返回修复步骤
+        if isinstance(value, list):
+            return "\n".join(str(step) for step in value)
+        return value
+
 class DataAnalysisRequest(BaseModel):
     """数据分析请求模型"""
     time_range: Optional[str] = "all"  # all, last_week, last_month, last_year, custom
@@ -45,6 +72,21 @@ class DataAnalysisRequest(BaseModel):
     filter_conditions: Optional[Dict[str, Any]] = None
     user_description: str
     use_advanced_analysis: Optional[bool] = False  # 是否使用高级分析
+    # generate: AI根据汇总数据生成图表数据；planner: AI只生成查询规格，图表数据由后端在本地计算
+    mode: Optional[str] = "generate"
+
+class VPRBatchScoreRequest(BaseModel):
+    """批量本地VPR评分请求模型"""
+    vulnerability_ids: Optional[List[int]] = None  # 为空时评分全部漏洞
+    apply: bool = False  # 是否将评分结果写回漏洞记录
+
+class EnrichmentJobRequest(BaseModel):
+    """批量AI补全任务请求模型"""
+    vulnerability_ids: Optional[List[int]] = None
+    filter: Optional[Dict[str, Any]] = None  # 与 /vulnerabilities/query 相同的查询表达式
+    tasks: List[str] = ["risk_assessment", "analysis", "remediation"]
+    concurrency: Optional[int] = None  # 为空时使用默认并发数
+    force: bool = False  # 是否忽略已保存的结果强制重新生成
 
 class ChartData(BaseModel):
     """图表数据模型"""
@@ -55,6 +97,190 @@ class ChartData(BaseModel):
     config: Dict[str, Any]
     category: str
     applied_filters: str
+    spec: Optional[Dict[str, Any]] = None  # 规划模式下的查询规格，可保存后重新计算图表数据
+
+def compute_prompt_fingerprint(template: str, prompt_inputs: Dict[str, Any]) -> str:
+    """
+    计算提示词输入字段的指纹，字段值或模板内容变化时指纹随之变化
+    """
+    payload = json.dumps(
+        {"template": hashlib.sha256(template.encode("utf-8")).hexdigest(), "inputs": prompt_inputs},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def analysis_prompt_inputs(source: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    漏洞分析提示词的输入字段
+    """
+    return {
+        "name": source.get("name", "未知漏洞"),
+        "cve_id": source.get("cve_id", "无CVE编号"),
+        "vulnerability_type": source.get("vulnerability_type", "未知"),
+        "risk_level": source.get("risk_level", "未知"),
+        "description": source.get("description", "无描述"),
+        "impact_details": source.get("impact_details", "无危害信息"),
+        "affected_components": source.get("affected_components", "无影响组件信息"),
+        "discovery_date": source.get("discovery_date", "未知"),
+        "status": source.get("status", "未知")
+    }
+
+def remediation_prompt_inputs(source: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    修复建议提示词的输入字段
+    """
+    return {
+        "name": source.get("name", "未知漏洞"),
+        "cve_id": source.get("cve_id", "无CVE编号"),
+        "vulnerability_type": source.get("vulnerability_type", "未知"),
+        "risk_level": source.get("risk_level", "未知"),
+        "description": source.get("description", "无描述"),
+        "affected_components": source.get("affected_components", "无影响组件信息"),
+        "status": source.get("status", "未知")
+    }
+
+def find_vulnerability_record(vulnerability_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    根据请求数据中的ID查找漏洞记录
+    """
+    vulnerability_id = vulnerability_data.get("id")
+    if vulnerability_id is None:
+        return None
+    for vuln in mock_vulnerabilities:
+        if vuln["id"] == vulnerability_id:
+            return vuln
+    return None
+
+def get_stored_insight(record: Optional[Dict[str, Any]], field: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    """
+    获取漏洞记录上保存的AI生成结果，指纹不一致时视为已失效
+    """
+    if not record:
+        return None
+    stored = record.get(field)
+    if stored and stored.get("fingerprint") == fingerprint:
+        return stored
+    return None
+
+def store_insight(
+    record: Optional[Dict[str, Any]],
+    field: str,
+    content: str,
+    fingerprint: str,
+    conversation_id: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    """
+    将AI生成结果及输入指纹保存到漏洞记录上
+    """
+    if not record:
+        return None
+    stored = {
+        "content": content,
+        "fingerprint": fingerprint,
+        "generated_at": datetime.now().isoformat(),
+        "conversation_id": conversation_id
+    }
+    record[field] = stored
+    logger.info(f"已保存AI生成结果 - 漏洞ID: {record['id']}, 字段: {field}")
+    return stored
+
+async def generate_with_cache(
+    dify_service: DifyService,
+    endpoint: str,
+    template_name: str,
+    prompt: str,
+    refresh: bool = False
+) -> Dict[str, Any]:
+    """
+    调用AI生成回答，渲染后的提示词与已缓存的完全一致时直接返回缓存结果
+    
+    refresh为True时跳过缓存读取，重新生成后覆盖缓存。
+    """
+    use_cache = ai_response_cache.is_enabled_for(endpoint)
+    if use_cache:
+        cache_key = ai_response_cache.make_key(template_name, prompt, dify_service.app_fingerprint)
+    if use_cache and not refresh:
+        cached = await ai_response_cache.get(cache_key, template_name)
+        if cached is not None:
+            logger.info(f"AI响应缓存命中 - 端点: {endpoint}, 缓存键: {cache_key[:12]}")
+            return cached
+    
+    # 内部调用使用固定的服务用户，相同提示词的并发请求合并为一次上游调用
+    response = await dify_service.send_first_message(
+        message=prompt,
+        user_id=settings.DIFY_INTERNAL_USER_ID
+    )
+    
+    # 只缓存有效回答
+    if use_cache and response and response.get("answer"):
+        await ai_response_cache.set(cache_key, template_name, response)
+    return response
+
+async def stream_structured(
+    dify_service: DifyService,
+    endpoint: Optional[str],
+    template_name: str,
+    prompt: str,
+    model: Optional[Type[BaseModel]] = None,
+    refresh: bool = False
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    流式调用AI并增量解析回答中的JSON对象
+    
+    每个顶层字段完成时产生field事件，最后产生result事件（包含JSON对象和截至对象结束的回答文本）。
+    对象闭合后立即停止读取上游并通知Dify停止生成，不等待对象后的说明文字；指定model时字段完成即校验，
+    不符合的候选对象被丢弃并继续查找，回答结束仍没有符合的对象时抛出StructuredOutputError。
+    endpoint为空时不使用响应缓存。
+    """
+    completed: List[Tuple[str, Any]] = []
+    extractor = IncrementalJSONExtractor(model, on_field=lambda name, value: completed.append((name, value)))
+    use_cache = endpoint is not None and ai_response_cache.is_enabled_for(endpoint)
+    cached = None
+    if use_cache:
+        cache_key = ai_response_cache.make_key(template_name, prompt, dify_service.app_fingerprint)
+        if not refresh:
+            cached = await ai_response_cache.get(cache_key, template_name)
+    
+    if cached is not None and cached.get("answer"):
+        logger.info(f"AI响应缓存命中 - 端点: {endpoint}, 缓存键: {cache_key[:12]}")
+        extractor.feed(cached["answer"])
+    else:
+        chunks = dify_service.stream_answer(prompt, settings.DIFY_INTERNAL_USER_ID)
+        try:
+            async for chunk in chunks:
+                closed = extractor.feed(chunk)
+                for name, value in completed:
+                    yield {"event": "field", "name": name, "value": value}
+                completed.clear()
+                if closed:
+                    logger.info(f"JSON对象已完整，停止读取AI回答 - 模板: {template_name}")
+                    break
+        finally:
+            await chunks.aclose()
+        # 只缓存包含完整JSON对象的回答
+        if use_cache and extractor.done:
+            await ai_response_cache.set(cache_key, template_name, {"answer": extractor.text})
+    
+    for name, value in completed:
+        yield {"event": "field", "name": name, "value": value}
+    yield {"event": "result", "result": extractor.finish(), "answer": extractor.text}
+
+async def generate_structured(
+    dify_service: DifyService,
+    endpoint: Optional[str],
+    template_name: str,
+    prompt: str,
+    model: Optional[Type[BaseModel]] = None,
+    refresh: bool = False
+) -> Tuple[Dict[str, Any], str]:
+    """
+    调用AI生成JSON回答，返回(JSON对象, 截至对象结束的回答文本)，解析失败时抛出StructuredOutputError
+    """
+    result = None
+    async for event in stream_structured(dify_service, endpoint, template_name, prompt, model, refresh):
+        if event["event"] == "result":
+            result = event
+    return result["result"], result["answer"]
 
 @router.post("/autocomplete/vulnerability", response_model=VulnerabilityAutoCompleteResponse)
 async def autocomplete_vulnerability(
@@ -65,6 +291,7 @@ async def autocomplete_vulnerability(
     使用AI自动补全漏洞详情
     """
     logger.info(f"收到漏洞自动补全请求: {request.vulnerability_name}, CVE: {request.cve_id}")
+    set_request_priority(PRIORITY_ANALYSIS)
     
     try:
         # 准备提示词
@@ -75,81 +302,102 @@ async def autocomplete_vulnerability(
         
         logger.debug(f"构造的提示词: {prompt[:100]}...")
         
-        # 发送首条消息并创建新对话
+        # 流式读取回答，JSON对象完整后即停止，字段按响应模型校验
         try:
-            response = await dify_service.send_first_message(
-                message=prompt
+            result, ai_message = await generate_structured(
+                dify_service, "autocomplete_vulnerability", "VULNERABILITY_AUTOCOMPLETE_PROMPT", prompt,
+                model=VulnerabilityAutoCompleteResponse
             )
-            logger.debug(f"得到AI响应: {response}")
+        except StructuredOutputError as e:
+            logger.error(f"解析AI响应失败: {e}, 原始响应: {e.text}")
+            raise HTTPException(status_code=500, detail=f"无法解析AI响应: {str(e)}")
+        except DifyOverloadedError:
+            raise
         except Exception as e:
-            logger.error(f"调用DifyService.send_first_message失败: {str(e)}")
+            logger.error(f"调用AI服务失败: {str(e)}")
             logger.error(traceback.format_exc())
             raise HTTPException(status_code=500, detail=f"AI服务调用失败: {str(e)}")
         
-        # 解析响应内容
-        ai_message = response.get("answer", "")
         logger.debug(f"AI原始回答: {ai_message}")
-        
-        # 提取JSON部分
-        try:
-            # 尝试找到JSON部分并解析
-            json_start = ai_message.find("{")
-            json_end = ai_message.rfind("}") + 1
-            
-            if json_start >= 0 and json_end > json_start:
-                json_str = ai_message[json_start:json_end]
-                logger.debug(f"提取的JSON字符串: {json_str}")
-                
-                try:
-                    result = json.loads(json_str)
-                    
-                    # 处理remediation_steps列表转字符串问题
-                    if 'remediation_steps' in result and isinstance(result['remediation_steps'], list):
-                        logger.info(f"将remediation_steps从列表转换为字符串: {result['remediation_steps']}")
-                        result['remediation_steps'] = "\n".join(result['remediation_steps'])
-                    
-                    # 转换为响应模型
-                    return VulnerabilityAutoCompleteResponse(**result)
-                except json.JSONDecodeError as je:
-                    logger.error(f"JSON解析错误: {str(je)}, JSON字符串: {json_str}")
-                    # 尝试修复可能的JSON格式问题
-                    fixed_json_str = json_str.replace("\n", "").replace("  ", " ")
-                    try:
-                        result = json.loads(fixed_json_str)
-                        
-                        # 处理remediation_steps列表转字符串问题
-                        if 'remediation_steps' in result and isinstance(result['remediation_steps'], list):
-                            logger.info(f"将remediation_steps从列表转换为字符串: {result['remediation_steps']}")
-                            result['remediation_steps'] = "\n".join(result['remediation_steps'])
-                        
-                        return VulnerabilityAutoCompleteResponse(**result)
-                    except Exception as fix_e:
-                        logger.error(f"修复JSON后仍然解析失败: {str(fix_e)}")
-                        raise HTTPException(status_code=500, detail="无法解析AI响应为有效的JSON格式")
-            else:
-                # 如果没有找到JSON结构，返回错误
-                logger.error(f"AI响应中未找到JSON结构: {ai_message}")
-                raise ValueError("AI响应中未找到JSON结构")
-        except (ValueError, Exception) as e:
-            logger.error(f"解析AI响应失败: {e}, 原始响应: {ai_message}")
-            logger.error(traceback.format_exc())
-            raise HTTPException(status_code=500, detail=f"无法解析AI响应: {str(e)}")
+        return VulnerabilityAutoCompleteResponse(**result)
     
+    except (DifyOverloadedError, HTTPException):
+        raise
     except Exception as e:
         logger.error(f"AI漏洞补全过程发生错误: {e}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"AI补全失败: {str(e)}")
 
+@router.post("/autocomplete/vulnerability/stream")
+async def stream_autocomplete_vulnerability(
+    request: VulnerabilityAutoCompleteRequest,
+    dify_service: DifyService = Depends(get_dify_service)
+):
+    """
+    以SSE方式返回漏洞自动补全结果，每个字段生成完成即推送field事件，最后推送result事件
+    """
+    logger.info(f"收到流式漏洞自动补全请求: {request.vulnerability_name}, CVE: {request.cve_id}")
+    # 流式响应开始后无法再返回503，因此在建立流之前检查是否会被拒绝
+    set_request_priority(PRIORITY_ANALYSIS)
+    if dify_service.scheduler.would_shed(PRIORITY_ANALYSIS):
+        raise DifyOverloadedError("AI服务繁忙（排队已满），请稍后重试", retry_after=dify_service.scheduler.retry_after)
+    if settings.DIFY_BREAKER_ENABLED and not dify_service.circuit_breaker.allows_request():
+        retry_after = dify_service.circuit_breaker.retry_after()
+        raise DifyCircuitOpenError(f"AI服务暂时不可用（熔断中），请{retry_after}秒后重试", retry_after=retry_after)
+    
+    prompt = VULNERABILITY_AUTOCOMPLETE_PROMPT.format(
+        vulnerability_name=request.vulnerability_name,
+        cve_id=request.cve_id or "无"
+    )
+    
+    async def event_generator():
+        try:
+            async for event in stream_structured(
+                dify_service, "autocomplete_vulnerability", "VULNERABILITY_AUTOCOMPLETE_PROMPT", prompt,
+                model=VulnerabilityAutoCompleteResponse
+            ):
+                if event["event"] == "result":
+                    result = VulnerabilityAutoCompleteResponse(**event["result"])
+                    yield encode_event({"event": "result", "result": result.dict()})
+                elif event["name"] in VulnerabilityAutoCompleteResponse.model_fields:
+                    yield encode_event(event)
+        except Exception as e:
+            logger.error(f"流式漏洞自动补全失败: {str(e)}")
+            yield encode_event({"event": "error", "error": f"AI补全失败: {str(e)}"})
+    
+    return SSEStreamingResponse(
+        event_generator(),
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
+    )
+
 @router.post("/vulnerabilities/risk-assessment")
 async def assess_vulnerability_risk(
     vulnerability_data: Dict[str, Any],
+    use_llm: bool = Query(False, description="是否调用AI补充评估说明，VPR评分和优先级始终由本地规则计算"),
     dify_service: DifyService = Depends(get_dify_service)
 ):
     """
-    使用AI评估漏洞风险并生成VPR评分和优先级
+    评估漏洞风险，生成VPR评分和优先级
+    
+    VPR评分和优先级由本地规则引擎计算（微秒级）；use_llm为true时再调用AI生成评估说明，
+    只作为附加的解释文字，不改变评分和优先级。
     """
+    set_request_priority(PRIORITY_BATCH)
     try:
-        logger.info(f"收到漏洞风险评估请求: {vulnerability_data.get('name', '未知漏洞')}")
+        logger.info(f"收到漏洞风险评估请求: {vulnerability_data.get('name', '未知漏洞')}, use_llm={use_llm}")
+        
+        # 本地规则评分
+        local_assessment = vpr_scoring_engine.score(
+            vulnerability_data, {asset["id"]: asset for asset in mock_assets}
+        )
+        logger.info(f"本地规则评分: VPR评分 = {local_assessment['vpr_score']}, 优先级 = {local_assessment['priority']}")
+        
+        if not use_llm:
+            return {
+                "success": True,
+                "result": local_assessment,
+                "engine": "local"
+            }
         
         # 准备资产信息
         asset_info = "无关联资产"
@@ -221,152 +469,140 @@ async def assess_vulnerability_risk(
         
         logger.debug(f"构造的风险评估提示词: {prompt[:500]}...")
         
-        # 发送到AI服务获取评估结果
-        response = await dify_service.send_first_message(
-            message=prompt
-        )
-        
-        # 解析JSON响应
-        if response and response.get("answer"):
-            content = response.get("answer")
-            # 提取JSON部分
-            try:
-                json_start = content.find('```json') + 7
-                json_end = content.rfind('```')
-                if json_start > 6 and json_end > json_start:
-                    json_str = content[json_start:json_end].strip()
-                    logger.debug(f"提取的JSON字符串: {json_str}")
-                    assessment_result = json.loads(json_str)
-                    
-                    # 记录完整的结果
-                    logger.info(f"风险评估结果: {assessment_result}")
-                    
-                    # 确保VPR评分和优先级一致
-                    if 'vpr_score' in assessment_result:
-                        vpr_score = assessment_result['vpr_score']
-                        
-                        # 使用配置文件中的VPR优先级映射关系
-                        correct_priority = None
-                        for priority, score_range in settings.VPR_PRIORITY_MAPPING.items():
-                            min_score, max_score = score_range
-                            if min_score <= vpr_score <= max_score:
-                                correct_priority = priority
-                                break
-                        
-                        # 如果找到正确的优先级，且与AI返回的不同，则进行调整
-                        if correct_priority:
-                            if 'priority' not in assessment_result or assessment_result['priority'] != correct_priority:
-                                original_priority = assessment_result.get('priority', '未知')
-                                logger.warning(f"调整优先级: 原始={original_priority}, VPR={vpr_score}, 正确优先级={correct_priority}")
-                                assessment_result['priority'] = correct_priority
-                                
-                                # 在评估理由中添加说明
-                                if 'assessment_reasoning' in assessment_result:
-                                    assessment_result['assessment_reasoning'] += f"\n\n注意: 根据VPR评分 {vpr_score} 和系统配置，优先级已自动调整为 {correct_priority}。"
-                        else:
-                            logger.error(f"无法为VPR评分 {vpr_score} 找到匹配的优先级")
-                    
-                    logger.info(f"最终风险评估结果: VPR评分 = {assessment_result.get('vpr_score')}, 优先级 = {assessment_result.get('priority')}")
-                    
-                    # 检查是否包含资产评估信息
-                    if 'asset_assessment' in assessment_result:
-                        logger.info(f"资产评估信息: {assessment_result['asset_assessment']}")
-                    else:
-                        logger.warning("评估结果中缺少资产评估信息")
-                    
-                    return {
-                        "success": True,
-                        "result": assessment_result,
-                        "raw_response": content
-                    }
-                else:
-                    # 尝试直接解析整个响应
-                    assessment_result = json.loads(content)
-                    
-                    # 同样确保VPR评分和优先级一致
-                    if 'vpr_score' in assessment_result:
-                        vpr_score = assessment_result['vpr_score']
-                        
-                        # 使用配置文件中的VPR优先级映射关系
-                        correct_priority = None
-                        for priority, score_range in settings.VPR_PRIORITY_MAPPING.items():
-                            min_score, max_score = score_range
-                            if min_score <= vpr_score <= max_score:
-                                correct_priority = priority
-                                break
-                        
-                        # 如果找到正确的优先级，且与AI返回的不同，则进行调整
-                        if correct_priority:
-                            if 'priority' not in assessment_result or assessment_result['priority'] != correct_priority:
-                                original_priority = assessment_result.get('priority', '未知')
-                                logger.warning(f"调整优先级: 原始={original_priority}, VPR={vpr_score}, 正确优先级={correct_priority}")
-                                assessment_result['priority'] = correct_priority
-                        else:
-                            logger.error(f"无法为VPR评分 {vpr_score} 找到匹配的优先级")
-                    
-                    logger.info(f"风险评估结果(直接解析): {assessment_result}")
-                    
-                    return {
-                        "success": True,
-                        "result": assessment_result,
-                        "raw_response": content
-                    }
-            except Exception as e:
-                logger.error(f"解析AI评估结果失败: {str(e)}")
-                logger.error(f"响应内容: {content}")
-                return {
-                    "success": False,
-                    "error": "解析评估结果失败",
-                    "raw_response": content
-                }
-        else:
-            logger.error("AI评估服务未返回有效响应")
+        # 发送到AI服务获取评估说明，JSON对象完整后即停止读取
+        try:
+            llm_assessment, content = await generate_structured(
+                dify_service, "assess_vulnerability_risk", "VULNERABILITY_RISK_ASSESSMENT_PROMPT", prompt
+            )
+        except StructuredOutputError as e:
+            # 评估说明是可选的，解析失败时仍返回本地评分
+            logger.error(f"解析AI评估说明失败: {str(e)}")
+            logger.error(f"响应内容: {e.text}")
             return {
-                "success": False,
-                "error": "未获得有效的评估结果"
+                "success": True,
+                "result": local_assessment,
+                "engine": "local",
+                "explanation_error": "解析AI评估说明失败" if e.text else "未获得AI评估说明",
+                "raw_response": e.text
             }
+        
+        # AI给出的评分只用于记录差异，结果以本地评分为准
+        if llm_assessment.get("vpr_score") is not None and llm_assessment.get("vpr_score") != local_assessment["vpr_score"]:
+            logger.info(f"AI评估的VPR评分与本地评分不同: AI={llm_assessment.get('vpr_score')}, 本地={local_assessment['vpr_score']}")
+        
+        result = dict(local_assessment)
+        if llm_assessment.get("assessment_reasoning"):
+            result["ai_explanation"] = llm_assessment["assessment_reasoning"]
+        
+        return {
+            "success": True,
+            "result": result,
+            "engine": "local",
+            # AI评估中的说明性内容，不包含评分和优先级
+            "llm_explanation": {
+                key: value for key, value in llm_assessment.items() if key not in ("vpr_score", "priority")
+            },
+            "raw_response": content
+        }
+    except DifyOverloadedError:
+        raise
     except Exception as e:
         logger.exception(f"执行漏洞风险评估时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"评估过程中发生错误: {str(e)}")
 
+@router.post("/vulnerabilities/risk-score/batch")
+async def batch_score_vulnerabilities(request: VPRBatchScoreRequest):
+    """
+    使用本地规则引擎批量计算漏洞VPR评分和优先级，可选写回漏洞记录
+    """
+    if request.vulnerability_ids:
+        id_set = set(request.vulnerability_ids)
+        targets = [v for v in mock_vulnerabilities if v.get("id") in id_set]
+    else:
+        targets = mock_vulnerabilities
+    logger.info(f"收到批量VPR评分请求: 漏洞数={len(targets)}, 写回={request.apply}")
+    
+    scores = vpr_scoring_engine.score_batch(targets, {asset["id"]: asset for asset in mock_assets})
+    
+    results = []
+    for vuln, (vpr_score, priority) in zip(targets, scores):
+        results.append({
+            "id": vuln.get("id"),
+            "name": vuln.get("name"),
+            "vpr_score": vpr_score,
+            "priority": priority,
+            "previous_vpr_score": vuln.get("vpr_score"),
+            "previous_priority": vuln.get("priority")
+        })
+        if request.apply:
+            vuln["vpr_score"] = vpr_score
+            vuln["priority"] = priority
+            asset_risk_index.upsert_vulnerability(vuln)
+    
+    if request.apply and targets:
+        data_version.bump("vulnerabilities")
+        logger.info(f"已将 {len(targets)} 条漏洞的本地VPR评分写回记录")
+    
+    return {
+        "success": True,
+        "total": len(results),
+        "applied": request.apply,
+        "results": results
+    }
+
 @router.post("/vulnerabilities/analysis")
 async def analyze_vulnerability(
     vulnerability_data: Dict[str, Any],
+    force: bool = Query(False, description="是否忽略已保存的分析结果强制重新生成"),
     dify_service: DifyService = Depends(get_dify_service)
 ):
     """
     使用AI对漏洞进行深入分析
+    
+    分析结果保存在漏洞记录上，提示词相关字段未变化时直接返回已保存的结果。
     """
+    set_request_priority(PRIORITY_ANALYSIS)
     try:
-        logger.info(f"收到漏洞分析请求: {vulnerability_data.get('name', '未知漏洞')}")
+        logger.info(f"收到漏洞分析请求: {vulnerability_data.get('name', '未知漏洞')}, force={force}")
+        
+        # 有对应的漏洞记录时以记录为准，记录变化后已保存的结果随之失效
+        record = find_vulnerability_record(vulnerability_data)
+        source = record or vulnerability_data
         
         # 构建提示词
-        prompt = VULNERABILITY_ANALYSIS_PROMPT.format(
-            name=vulnerability_data.get("name", "未知漏洞"),
-            cve_id=vulnerability_data.get("cve_id", "无CVE编号"),
-            vulnerability_type=vulnerability_data.get("vulnerability_type", "未知"),
-            risk_level=vulnerability_data.get("risk_level", "未知"),
-            description=vulnerability_data.get("description", "无描述"),
-            impact_details=vulnerability_data.get("impact_details", "无危害信息"),
-            affected_components=vulnerability_data.get("affected_components", "无影响组件信息"),
-            discovery_date=vulnerability_data.get("discovery_date", "未知"),
-            status=vulnerability_data.get("status", "未知")
-        )
+        prompt_inputs = analysis_prompt_inputs(source)
+        prompt = VULNERABILITY_ANALYSIS_PROMPT.format(**prompt_inputs)
+        
+        # 检查漏洞记录上已保存的分析结果
+        fingerprint = compute_prompt_fingerprint(VULNERABILITY_ANALYSIS_PROMPT, prompt_inputs)
+        stored = get_stored_insight(record, "ai_analysis", fingerprint) if not force else None
+        if stored:
+            logger.info(f"返回已保存的漏洞分析结果 - 漏洞ID: {record['id']}, 生成时间: {stored['generated_at']}")
+            return {
+                "success": True,
+                "result": stored["content"],
+                "conversation_id": stored.get("conversation_id"),
+                "stored": True,
+                "generated_at": stored["generated_at"]
+            }
         
         logger.debug(f"构造的漏洞分析提示词: {prompt[:200]}...")
         
         # 发送到AI服务获取分析结果
-        response = await dify_service.send_first_message(
-            message=prompt
+        response = await generate_with_cache(
+            dify_service, "analyze_vulnerability", "VULNERABILITY_ANALYSIS_PROMPT", prompt, refresh=force
         )
         
         # 处理响应
         if response and response.get("answer"):
             content = response.get("answer")
+            stored = store_insight(record, "ai_analysis", content, fingerprint, response.get("conversation_id"))
             return {
                 "success": True,
                 "result": content,
-                "conversation_id": response.get("conversation_id")
+                "conversation_id": response.get("conversation_id"),
+                "stored": False,
+                "generated_at": stored["generated_at"] if stored else None
             }
         else:
             logger.error("AI分析服务未返回有效响应")
@@ -374,6 +610,8 @@ async def analyze_vulnerability(
                 "success": False,
                 "error": "未获得有效的分析结果"
             }
+    except DifyOverloadedError:
+        raise
     except Exception as e:
         logger.exception(f"执行漏洞分析时出错: {str(e)}")
         return {
@@ -384,39 +622,56 @@ async def analyze_vulnerability(
 @router.post("/vulnerabilities/remediation")
 async def get_vulnerability_remediation(
     vulnerability_data: Dict[str, Any],
+    force: bool = Query(False, description="是否忽略已保存的修复建议强制重新生成"),
     dify_service: DifyService = Depends(get_dify_service)
 ):
     """
     使用AI获取漏洞的修复建议
+    
+    修复建议保存在漏洞记录上，提示词相关字段未变化时直接返回已保存的结果。
     """
+    set_request_priority(PRIORITY_ANALYSIS)
     try:
-        logger.info(f"收到漏洞修复建议请求: {vulnerability_data.get('name', '未知漏洞')}")
+        logger.info(f"收到漏洞修复建议请求: {vulnerability_data.get('name', '未知漏洞')}, force={force}")
+        
+        # 有对应的漏洞记录时以记录为准，记录变化后已保存的结果随之失效
+        record = find_vulnerability_record(vulnerability_data)
+        source = record or vulnerability_data
         
         # 构建提示词
-        prompt = VULNERABILITY_REMEDIATION_PROMPT.format(
-            name=vulnerability_data.get("name", "未知漏洞"),
-            cve_id=vulnerability_data.get("cve_id", "无CVE编号"),
-            vulnerability_type=vulnerability_data.get("vulnerability_type", "未知"),
-            risk_level=vulnerability_data.get("risk_level", "未知"),
-            description=vulnerability_data.get("description", "无描述"),
-            affected_components=vulnerability_data.get("affected_components", "无影响组件信息"),
-            status=vulnerability_data.get("status", "未知")
-        )
+        prompt_inputs = remediation_prompt_inputs(source)
+        prompt = VULNERABILITY_REMEDIATION_PROMPT.format(**prompt_inputs)
+        
+        # 检查漏洞记录上已保存的修复建议
+        fingerprint = compute_prompt_fingerprint(VULNERABILITY_REMEDIATION_PROMPT, prompt_inputs)
+        stored = get_stored_insight(record, "ai_remediation", fingerprint) if not force else None
+        if stored:
+            logger.info(f"返回已保存的修复建议 - 漏洞ID: {record['id']}, 生成时间: {stored['generated_at']}")
+            return {
+                "success": True,
+                "result": stored["content"],
+                "conversation_id": stored.get("conversation_id"),
+                "stored": True,
+                "generated_at": stored["generated_at"]
+            }
         
         logger.debug(f"构造的漏洞修复建议提示词: {prompt[:200]}...")
         
         # 发送到AI服务获取修复建议
-        response = await dify_service.send_first_message(
-            message=prompt
+        response = await generate_with_cache(
+            dify_service, "get_vulnerability_remediation", "VULNERABILITY_REMEDIATION_PROMPT", prompt, refresh=force
         )
         
         # 处理响应
         if response and response.get("answer"):
             content = response.get("answer")
+            stored = store_insight(record, "ai_remediation", content, fingerprint, response.get("conversation_id"))
             return {
                 "success": True,
                 "result": content,
-                "conversation_id": response.get("conversation_id")
+                "conversation_id": response.get("conversation_id"),
+                "stored": False,
+                "generated_at": stored["generated_at"] if stored else None
             }
         else:
             logger.error("AI修复建议服务未返回有效响应")
@@ -424,6 +679,8 @@ async def get_vulnerability_remediation(
                 "success": False,
                 "error": "未获得有效的修复建议"
             }
+    except DifyOverloadedError:
+        raise
     except Exception as e:
         logger.exception(f"获取漏洞修复建议时出错: {str(e)}")
         return {
@@ -439,6 +696,7 @@ async def generate_chart(
     """
     根据用户描述和数据范围生成图表
     """
+    set_request_priority(PRIORITY_BATCH)
     try:
         logger.info(f"收到数据分析请求: 描述={request.user_description}, 时间范围={request.time_range}, 高级分析={request.use_advanced_analysis}")
         
@@ -460,6 +718,13 @@ async def generate_chart(
             # 否则获取所有资产
             assets = mock_assets
         
+        # 请求限定的数据范围，规划模式下并入查询规格，保存的规格重新计算时得到相同范围的数据
+        scope_filters: Dict[str, List[Dict[str, Any]]] = {"vulnerabilities": [], "assets": []}
+        if request.vulnerability_ids:
+            scope_filters["vulnerabilities"].append({"field": "id", "op": "in", "value": list(request.vulnerability_ids)})
+        if request.asset_ids:
+            scope_filters["assets"].append({"field": "id", "op": "in", "value": list(request.asset_ids)})
+        
         # 处理时间范围
         time_range_str = "所有时间"
         if request.time_range != "all":
@@ -483,21 +748,39 @@ async def generate_chart(
                     logger.error(f"日期格式错误: start_date={request.start_date}, end_date={request.end_date}")
                     raise HTTPException(status_code=400, detail="日期格式错误，请使用ISO格式，例如: 2023-01-01")
             
-            # 如果设置了时间范围，过滤漏洞数据
+            # 如果设置了时间范围，过滤漏洞数据；相对时间范围按本次请求的时间换算为固定日期
+            scope_filters["vulnerabilities"].append({"field": "discovery_date", "op": "gte", "value": start_date.isoformat()})
             if request.time_range != "custom":
                 vulnerabilities = [v for v in vulnerabilities if datetime.fromisoformat(v.get("discovery_date").replace('Z', '+00:00')) >= start_date]
             else:
+                scope_filters["vulnerabilities"].append({"field": "discovery_date", "op": "lte", "value": end_date.isoformat()})
                 vulnerabilities = [
                     v for v in vulnerabilities 
                     if datetime.fromisoformat(v.get("discovery_date").replace('Z', '+00:00')) >= start_date
                     and datetime.fromisoformat(v.get("discovery_date").replace('Z', '+00:00')) <= end_date
                 ]
         
-        # 应用其他过滤条件
+        # 应用其他过滤条件：漏洞或资产上存在的字段在本地按等值筛选，其余条件交给AI理解
         filter_conditions_str = "无额外筛选条件"
         if request.filter_conditions:
             filter_conditions_str = ", ".join([f"{k}={v}" for k, v in request.filter_conditions.items()])
-            # 这里可以实现更复杂的过滤逻辑
+            vulnerabilities, vulnerability_filters = apply_filter_conditions(vulnerabilities, request.filter_conditions)
+            assets, asset_filters = apply_filter_conditions(assets, request.filter_conditions)
+            for source, fields in (("vulnerabilities", vulnerability_filters), ("assets", asset_filters)):
+                for field in fields:
+                    expected = request.filter_conditions[field]
+                    if isinstance(expected, (list, tuple, set)):
+                        scope_filters[source].append({"field": field, "op": "in", "value": list(expected)})
+                    else:
+                        scope_filters[source].append({"field": field, "op": "eq", "value": expected})
+            applied = set(vulnerability_filters) | set(asset_filters)
+            if applied:
+                filter_conditions_str += f"（已在本地应用: {', '.join(sorted(applied))}）"
+        
+        if request.mode == "planner":
+            return await generate_chart_from_spec(
+                request, dify_service, vulnerabilities, assets, time_range_str, filter_conditions_str, scope_filters
+            )
         
         # 准备高级分析说明
         advanced_analysis_instructions = ""
@@ -520,10 +803,16 @@ async def generate_chart(
                - 提供基于数据的优化建议
             """
         
+        # 在本地对筛选后的全部数据做聚合，提示词中只放汇总表，图表结果与数据量无关
+        vulnerability_summary = compact_json(await asyncio.to_thread(summarize_vulnerabilities, vulnerabilities))
+        asset_summary = compact_json(await asyncio.to_thread(summarize_assets, assets))
+        logger.info(f"图表数据汇总完成 - 漏洞: {len(vulnerabilities)}条, 资产: {len(assets)}条, "
+                    f"汇总长度: {len(vulnerability_summary) + len(asset_summary)}字符")
+        
         # 准备提示词
         prompt = DATA_CHART_GENERATION_PROMPT.format(
-            vulnerability_data=json.dumps(vulnerabilities[:10], ensure_ascii=False),  # 限制数据量
-            asset_data=json.dumps(assets[:10], ensure_ascii=False),  # 限制数据量
+            vulnerability_data=vulnerability_summary,
+            asset_data=asset_summary,
             time_range=time_range_str,
             filter_conditions=filter_conditions_str,
             user_description=request.user_description,
@@ -533,48 +822,361 @@ async def generate_chart(
         
         logger.debug(f"构造的数据分析提示词: {prompt[:200]}...")
         
-        # 发送到AI服务获取图表配置
-        response = await dify_service.send_first_message(
-            message=prompt
-        )
+        # 发送到AI服务获取图表配置，JSON对象完整后即停止读取；提示词包含实时数据汇总，不使用响应缓存
+        try:
+            chart_config, _ = await generate_structured(
+                dify_service, None, "DATA_CHART_GENERATION_PROMPT", prompt
+            )
+        except StructuredOutputError as e:
+            logger.error(f"解析AI生成的图表配置失败: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"解析图表配置失败: {str(e)}")
         
-        # 解析响应
-        if response and response.get("answer"):
-            content = response.get("answer")
-            
-            # 提取JSON部分
-            try:
-                json_start = content.find('```json') + 7
-                json_end = content.rfind('```')
-                
-                if json_start > 6 and json_end > json_start:
-                    json_str = content[json_start:json_end].strip()
-                    logger.debug(f"提取的JSON字符串: {json_str[:200]}...")
-                    
-                    chart_config = json.loads(json_str)
-                    
-                    # 确保数据字段完整
-                    required_fields = ["chart_type", "title", "description", "data", "config", "category", "applied_filters"]
-                    for field in required_fields:
-                        if field not in chart_config:
-                            chart_config[field] = "" if field != "data" and field != "config" else {}
-                    
-                    return chart_config
-                else:
-                    # 尝试整体解析
-                    logger.warning("未找到JSON标记，尝试直接解析整个响应")
-                    try:
-                        chart_config = json.loads(content)
-                        return chart_config
-                    except:
-                        raise ValueError("响应中未找到有效的JSON结构，无法解析图表配置")
-            except Exception as e:
-                logger.error(f"解析AI生成的图表配置失败: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"解析图表配置失败: {str(e)}")
-        else:
-            logger.error("AI服务未返回有效响应")
-            raise HTTPException(status_code=500, detail="未获得有效的图表配置")
+        # 确保数据字段完整
+        required_fields = ["chart_type", "title", "description", "data", "config", "category", "applied_filters"]
+        for field in required_fields:
+            if field not in chart_config:
+                chart_config[field] = "" if field != "data" and field != "config" else {}
+        
+        return chart_config
     
+    except (DifyOverloadedError, HTTPException):
+        raise
     except Exception as e:
         logger.exception(f"生成图表配置时出错: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"生成图表配置失败: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"生成图表配置失败: {str(e)}") 
+
+async def plan_chart_spec(dify_service: DifyService, user_description: str) -> Dict[str, Any]:
+    """
+    由AI把图表描述翻译为查询规格；提示词只包含规范化后的描述，相同描述直接命中响应缓存
+    
+    缓存的回答无法解析为有效规格时重新生成一次。
+    """
+    prompt = CHART_SPEC_PLANNER_PROMPT.format(user_description=normalize_description(user_description))
+    for refresh in (False, True):
+        try:
+            spec, _ = await generate_structured(
+                dify_service, "generate_chart", "CHART_SPEC_PLANNER_PROMPT", prompt, refresh=refresh
+            )
+            return validate_spec(spec)
+        except ValueError as e:
+            if refresh:
+                raise
+            logger.warning(f"图表规格无效，重新生成: {str(e)}")
+
+async def generate_chart_from_spec(
+    request: DataAnalysisRequest,
+    dify_service: DifyService,
+    vulnerabilities: List[Dict[str, Any]],
+    assets: List[Dict[str, Any]],
+    time_range_str: str,
+    filter_conditions_str: str,
+    scope_filters: Dict[str, List[Dict[str, Any]]]
+) -> Dict[str, Any]:
+    """
+    规划模式：AI只生成查询规格，在时间范围和筛选条件限定的完整数据上本地执行
+    
+    请求的时间范围、ID范围和已在本地应用的筛选条件以and并入规格的筛选条件，
+    返回的规格保存后重新计算，得到的是用户当时看到的图表范围。
+    """
+    try:
+        spec = await plan_chart_spec(dify_service, request.user_description)
+    except ValueError as e:
+        logger.error(f"生成图表规格失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"生成图表规格失败: {str(e)}")
+    
+    planner_filter = spec["filter"]
+    scope = scope_filters.get(spec["source"], [])
+    if spec["source"] == "vulnerabilities":
+        records, scoped = mock_vulnerabilities, vulnerabilities
+        # 查询引擎不支持的字段无法写入规格，只能按本次筛选结果限定
+        unexpressed = [node["field"] for node in scope if node["field"] not in QUERY_FIELDS]
+        scope = [node for node in scope if node["field"] in QUERY_FIELDS]
+    else:
+        records, scoped = mock_assets, assets
+        unexpressed = []
+    if scope:
+        spec = {**spec, "filter": {"and": scope + ([planner_filter] if planner_filter else [])}}
+    # 规格的筛选在完整数据上执行（复用漏洞索引）
+    allowed_ids = None
+    if unexpressed:
+        logger.warning(f"筛选条件无法写入图表规格，保存的图表重新计算时不包含这些条件: {', '.join(unexpressed)}")
+        allowed_ids = {record.get("id") for record in scoped}
+    try:
+        rows = await asyncio.to_thread(execute_spec, spec, records, allowed_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"图表规格无法执行: {str(e)}")
+    logger.info(f"本地执行图表规格 - 数据源: {spec['source']}, 分组: {spec['group_by']}, 结果行数: {len(rows)}")
+    
+    applied_filters = f"时间范围: {time_range_str}; 筛选条件: {filter_conditions_str}"
+    if planner_filter:
+        applied_filters += f"; 规格筛选: {compact_json(planner_filter)}"
+    title = spec["title"] or request.user_description
+    return {
+        "chart_type": spec["chart_type"],
+        "title": title,
+        "description": spec["description"],
+        "data": rows,
+        "config": build_chart_config({**spec, "title": title}, rows),
+        "category": spec["category"],
+        "applied_filters": applied_filters,
+        "spec": spec
+    }
+
+def get_vulnerability_or_raise(vulnerability_id: int) -> Dict[str, Any]:
+    """
+    根据ID获取漏洞记录，不存在时抛出异常
+    """
+    record = find_vulnerability_record({"id": vulnerability_id})
+    if record is None:
+        raise ValueError(f"漏洞不存在: {vulnerability_id}")
+    return record
+
+async def enrich_risk_assessment(vulnerability_id: int, force: bool):
+    """
+    批量补全：风险评估，VPR评分和优先级写回漏洞记录
+    
+    评分由本地规则引擎计算，不调用AI。记录已有VPR评分和优先级时跳过，force为True时重新计算；
+    未得到评分时不覆盖已有结果。
+    """
+    record = get_vulnerability_or_raise(vulnerability_id)
+    if not force and record.get("vpr_score") is not None and record.get("priority"):
+        logger.info(f"漏洞已有VPR评分，跳过风险评估 - 漏洞ID: {vulnerability_id}")
+        return
+    response = await assess_vulnerability_risk(dict(record), use_llm=False, dify_service=get_dify_service())
+    if not response.get("success"):
+        raise ValueError(response.get("error") or "风险评估失败")
+    result = response["result"]
+    if result.get("vpr_score") is None:
+        raise ValueError("风险评估未返回VPR评分")
+    record["vpr_score"] = result["vpr_score"]
+    record["priority"] = result.get("priority") or record.get("priority")
+    asset_risk_index.upsert_vulnerability(record)
+    data_version.bump("vulnerabilities")
+
+async def enrich_analysis(vulnerability_id: int, force: bool):
+    """
+    批量补全：AI漏洞分析，结果由分析端点保存到漏洞记录
+    """
+    record = get_vulnerability_or_raise(vulnerability_id)
+    response = await analyze_vulnerability(dict(record), force=force, dify_service=get_dify_service())
+    if not response.get("success"):
+        raise ValueError(response.get("error") or "漏洞分析失败")
+
+async def enrich_remediation(vulnerability_id: int, force: bool):
+    """
+    批量补全：AI修复建议，结果由修复建议端点保存到漏洞记录
+    """
+    record = get_vulnerability_or_raise(vulnerability_id)
+    response = await get_vulnerability_remediation(dict(record), force=force, dify_service=get_dify_service())
+    if not response.get("success"):
+        raise ValueError(response.get("error") or "获取修复建议失败")
+
+def has_risk_assessment(vulnerability_id: int) -> bool:
+    """
+    漏洞记录上的VPR评分和优先级是否与本地规则引擎的当前结果一致
+    """
+    record = get_vulnerability_or_raise(vulnerability_id)
+    assessment = vpr_scoring_engine.score(record, {asset["id"]: asset for asset in mock_assets})
+    return record.get("vpr_score") == assessment["vpr_score"] and record.get("priority") == assessment["priority"]
+
+def has_analysis(vulnerability_id: int) -> bool:
+    """
+    漏洞记录上是否有与当前字段匹配的分析结果
+    """
+    record = get_vulnerability_or_raise(vulnerability_id)
+    fingerprint = compute_prompt_fingerprint(VULNERABILITY_ANALYSIS_PROMPT, analysis_prompt_inputs(record))
+    return get_stored_insight(record, "ai_analysis", fingerprint) is not None
+
+def has_remediation(vulnerability_id: int) -> bool:
+    """
+    漏洞记录上是否有与当前字段匹配的修复建议
+    """
+    record = get_vulnerability_or_raise(vulnerability_id)
+    fingerprint = compute_prompt_fingerprint(VULNERABILITY_REMEDIATION_PROMPT, remediation_prompt_inputs(record))
+    return get_stored_insight(record, "ai_remediation", fingerprint) is not None
+
+enrichment_job_manager.register_handler("risk_assessment", enrich_risk_assessment, has_risk_assessment)
+enrichment_job_manager.register_handler("analysis", enrich_analysis, has_analysis)
+enrichment_job_manager.register_handler("remediation", enrich_remediation, has_remediation)
+
+@router.post("/enrichment/jobs", status_code=202)
+async def create_enrichment_job(request: EnrichmentJobRequest):
+    """
+    创建批量AI补全任务，按漏洞ID列表或查询表达式选择漏洞，后台并发执行并写回漏洞记录
+    """
+    if request.vulnerability_ids:
+        existing_ids = {v["id"] for v in mock_vulnerabilities}
+        vulnerability_ids = [vid for vid in dict.fromkeys(request.vulnerability_ids) if vid in existing_ids]
+    elif request.filter:
+        try:
+            matched, _ = vulnerability_query_engine.execute(request.filter, mock_vulnerabilities)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"查询表达式无效: {str(e)}")
+        vulnerability_ids = [v["id"] for v in matched]
+    else:
+        raise HTTPException(status_code=400, detail="需要提供vulnerability_ids或filter")
+    
+    if not vulnerability_ids:
+        raise HTTPException(status_code=400, detail="没有匹配的漏洞")
+    
+    try:
+        job = await enrichment_job_manager.submit(
+            vulnerability_ids,
+            list(dict.fromkeys(request.tasks)),
+            request.concurrency or settings.AI_ENRICHMENT_DEFAULT_CONCURRENCY,
+            request.force
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job
+
+@router.get("/enrichment/jobs")
+async def list_enrichment_jobs(limit: int = Query(50, ge=1, le=1000)):
+    """
+    列出最近的批量AI补全任务
+    """
+    return await enrichment_job_manager.list(limit)
+
+@router.get("/enrichment/jobs/{job_id}")
+async def get_enrichment_job(job_id: str):
+    """
+    获取批量AI补全任务的进度
+    """
+    job = await enrichment_job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+@router.post("/enrichment/jobs/{job_id}/cancel")
+async def cancel_enrichment_job(job_id: str):
+    """
+    取消批量AI补全任务，已完成的子项结果保留
+    """
+    job = await enrichment_job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+def job_event_response(job_id: str, get_job) -> SSEStreamingResponse:
+    """
+    以SSE方式推送后台任务的状态变化，任务结束后关闭连接
+    """
+    async def event_generator():
+        # 先订阅再读取快照，避免遗漏两者之间发生的事件
+        queue = job_event_bus.subscribe(job_id)
+        try:
+            snapshot = await get_job(job_id)
+            yield encode_event({"event": "progress", "job": snapshot})
+            if snapshot["status"] in JOB_FINAL_STATUSES:
+                yield encode_event({"event": "end", "job": snapshot})
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # 保持连接的注释行
+                    yield ": keepalive\n\n"
+                    continue
+                yield encode_event(event)
+                if event["event"] == "end":
+                    return
+        finally:
+            job_event_bus.unsubscribe(job_id, queue)
+    
+    return SSEStreamingResponse(
+        event_generator(),
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
+    )
+
+@router.get("/enrichment/jobs/{job_id}/events")
+async def stream_enrichment_job_events(job_id: str):
+    """
+    以SSE方式推送批量AI补全任务的进度，任务结束后关闭连接
+    """
+    job = await enrichment_job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job_event_response(job_id, enrichment_job_manager.get)
+
+async def run_chart_job(params: Dict[str, Any]) -> Any:
+    """
+    后台任务：生成图表配置
+    """
+    return await generate_chart(DataAnalysisRequest(**params), dify_service=get_dify_service())
+
+async def run_risk_assessment_job(params: Dict[str, Any]) -> Any:
+    """
+    后台任务：漏洞风险评估
+    """
+    return await assess_vulnerability_risk(
+        params["vulnerability_data"], use_llm=params.get("use_llm", False), dify_service=get_dify_service()
+    )
+
+async def run_analysis_job(params: Dict[str, Any]) -> Any:
+    """
+    后台任务：漏洞分析
+    """
+    return await analyze_vulnerability(
+        params["vulnerability_data"], force=params.get("force", False), dify_service=get_dify_service()
+    )
+
+ai_job_queue.register_handler("chart", run_chart_job)
+ai_job_queue.register_handler("risk_assessment", run_risk_assessment_job)
+ai_job_queue.register_handler("analysis", run_analysis_job)
+
+@router.post("/data-analysis/chart/jobs", status_code=202)
+async def submit_chart_job(request: DataAnalysisRequest):
+    """
+    提交后台图表生成任务，立即返回任务ID
+    """
+    return await ai_job_queue.submit("chart", request.dict())
+
+@router.post("/vulnerabilities/risk-assessment/jobs", status_code=202)
+async def submit_risk_assessment_job(
+    vulnerability_data: Dict[str, Any],
+    use_llm: bool = Query(False, description="是否调用AI补充评估说明，VPR评分和优先级始终由本地规则计算")
+):
+    """
+    提交后台漏洞风险评估任务，立即返回任务ID
+    """
+    return await ai_job_queue.submit("risk_assessment", {"vulnerability_data": vulnerability_data, "use_llm": use_llm})
+
+@router.post("/vulnerabilities/analysis/jobs", status_code=202)
+async def submit_analysis_job(
+    vulnerability_data: Dict[str, Any],
+    force: bool = Query(False, description="是否忽略已保存的分析结果强制重新生成")
+):
+    """
+    提交后台漏洞分析任务，立即返回任务ID
+    """
+    return await ai_job_queue.submit("analysis", {"vulnerability_data": vulnerability_data, "force": force})
+
+@router.get("/jobs/{job_id}")
+async def get_ai_job(job_id: str):
+    """
+    获取后台AI任务的状态和结果
+    """
+    job = await ai_job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+@router.get("/jobs/{job_id}/events")
+async def stream_ai_job_events(job_id: str):
+    """
+    以SSE方式推送后台AI任务的状态变化，任务结束后关闭连接
+    """
+    job = await ai_job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job_event_response(job_id, ai_job_queue.get)
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_ai_job(job_id: str):
+    """
+    取消后台AI任务，执行中的任务会中断上游调用
+    """
+    job = await ai_job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
@@ -4,7 +4,9 @@ from fastapi import APIRouter, HTTPException, Query
 from datetime import datetime
 import urllib.parse
 
-from app.models.asset import Asset, AssetCreate, AssetUpdate, AssetComponent, AssetPort
+from app.models.asset import Asset, AssetCreate, AssetUpdate, AssetComponent, AssetPort, AssetRiskScore
+from app.services.asset_risk import asset_risk_index
+from app.services.data_version import data_version
 
 # 创建路由
 router = APIRouter()
@@ -156,6 +158,14 @@ async def get_assets(
     logger.info(f"找到 {len(filtered_assets)} 个资产")
     return filtered_assets
 
+@router.get("/top-risk", response_model=List[AssetRiskScore])
+async def get_top_risk_assets(k: int = Query(10, ge=1, le=1000, description="返回风险最高的资产数量")):
+    """
+    获取风险分最高的K个资产，评分由资产风险索引增量维护
+    """
+    logger.info(f"获取高风险资产排行请求，k={k}")
+    return asset_risk_index.top(k)
+
 @router.get("/{asset_id}", response_model=Asset)
 async def get_asset(asset_id: int):
     """
@@ -206,6 +216,8 @@ async def create_asset(asset: AssetCreate):
     
     # 添加到模拟数据库
     mock_assets.append(new_asset)
+    data_version.bump("assets")
+    asset_risk_index.upsert_asset(new_asset)
     
     logger.info(f"资产创建成功，ID: {new_id}")
     return new_asset
@@ -232,6 +244,8 @@ async def update_asset(asset_id: int, asset_update: AssetUpdate):
             # 更新资产
             mock_assets[i].update(update_data)
             mock_assets[i]["update_date"] = datetime.now().isoformat()
+            data_version.bump("assets")
+            asset_risk_index.upsert_asset(mock_assets[i])
             
             logger.info(f"资产更新成功，ID: {asset_id}")
             return mock_assets[i]
@@ -252,6 +266,8 @@ async def delete_asset(asset_id: int):
         if asset["id"] == asset_id:
             # 从模拟数据库中删除
             del mock_assets[i]
+            data_version.bump("assets")
+            asset_risk_index.remove_asset(asset_id)
             
             logger.info(f"资产删除成功，ID: {asset_id}")
             return {"message": f"已删除ID为 {asset_id} 的资产"}
@@ -1,9 +1,14 @@
+import asyncio
 import logging
 from typing import List, Dict, Any, Optional
 from fastapi import APIRouter, HTTPException, Query
 from datetime import datetime
 
 from app.models.dashboard import DashboardChart, DashboardChartCreate, DashboardChartUpdate
+from app.api.endpoints.vulnerabilities import mock_vulnerabilities
+from app.api.endpoints.assets import mock_assets
+from app.services.chart_spec import validate_spec, build_chart_config
+from app.services.chart_results import chart_result_cache
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -13,13 +18,47 @@ router = APIRouter()
 # 模拟数据库
 mock_dashboard_charts = []
 
+# 查询规格的数据源
+SPEC_SOURCES = {
+    "vulnerabilities": mock_vulnerabilities,
+    "assets": mock_assets
+}
+
+def dump_chart_config(chart_config) -> Dict[str, Any]:
+    """转换图表配置为字典，包含查询规格时校验并规范化"""
+    config = chart_config.dict()
+    if config.get("spec") is not None:
+        try:
+            config["spec"] = validate_spec(config["spec"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"图表查询规格无效: {str(e)}")
+    return config
+
+async def render_chart(chart: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    包含查询规格的图表按当前数据重新计算data和config，结果按(规格, 数据版本)缓存；
+    计算失败时返回保存时的数据
+    """
+    spec = chart["chart_config"].get("spec")
+    if not spec:
+        return chart
+    try:
+        rows = await chart_result_cache.evaluate(spec, SPEC_SOURCES[spec["source"]])
+    except Exception as e:
+        logger.warning(f"重新计算图表数据失败，使用保存的数据，ID: {chart['id']}: {str(e)}")
+        return chart
+    chart_config = chart["chart_config"]
+    config = build_chart_config({**spec, "title": spec["title"] or chart_config["title"]}, rows)
+    return {**chart, "chart_config": {**chart_config, "data": rows, "config": config}}
+
 @router.get("/charts", response_model=List[DashboardChart])
 async def get_dashboard_charts():
     """
     获取所有仪表盘图表
     """
     logger.info("获取所有仪表盘图表")
-    return mock_dashboard_charts
+    # 各图表并发计算
+    return await asyncio.gather(*(render_chart(chart) for chart in list(mock_dashboard_charts)))
 
 @router.post("/charts", response_model=DashboardChart)
 async def create_dashboard_chart(chart: DashboardChartCreate):
@@ -39,7 +78,7 @@ async def create_dashboard_chart(chart: DashboardChartCreate):
         "id": new_id,
         "name": chart.name,
         "description": chart.description,
-        "chart_config": chart.chart_config.dict(),
+        "chart_config": dump_chart_config(chart.chart_config),
         "created_at": now.isoformat(),
         "updated_at": now.isoformat(),
         "position": chart.position or {"x": 0, "y": 0, "w": 6, "h": 4},
@@ -50,7 +89,7 @@ async def create_dashboard_chart(chart: DashboardChartCreate):
     mock_dashboard_charts.append(new_chart)
     
     logger.info(f"图表创建成功，ID: {new_id}")
-    return new_chart
+    return await render_chart(new_chart)
 
 @router.get("/charts/{chart_id}", response_model=DashboardChart)
 async def get_dashboard_chart(chart_id: int):
@@ -62,7 +101,7 @@ async def get_dashboard_chart(chart_id: int):
     # 查找图表
     for chart in mock_dashboard_charts:
         if chart["id"] == chart_id:
-            return chart
+            return await render_chart(chart)
     
     # 未找到图表
     logger.warning(f"未找到ID为 {chart_id} 的图表")
@@ -83,14 +122,14 @@ async def update_dashboard_chart(chart_id: int, chart_update: DashboardChartUpda
             
             # 如果更新了chart_config字段，需要转换为字典
             if "chart_config" in update_data:
-                update_data["chart_config"] = chart_update.chart_config.dict()
+                update_data["chart_config"] = dump_chart_config(chart_update.chart_config)
             
             # 更新图表
             mock_dashboard_charts[i].update(update_data)
             mock_dashboard_charts[i]["updated_at"] = datetime.now().isoformat()
             
             logger.info(f"图表更新成功，ID: {chart_id}")
-            return mock_dashboard_charts[i]
+            return await render_chart(mock_dashboard_charts[i])
     
     # 未找到图表
     logger.warning(f"未找到ID为 {chart_id} 的图表")
@@ -4,18 +4,35 @@ from app.services.dify_service import dify_service
 from app.models.vulnerability import Vulnerability
 from pydantic import BaseModel, Field
 import logging
-from app.models.dify import DifyRequestModel
+from app.models.dify import DifyRequestModel, DifyStopRequest
 import json
-from fastapi.responses import StreamingResponse
+from app.core.sse import SSEStreamingResponse, SSEEncoder, coalesce_messages
 import asyncio
 import traceback
 from app.core.prompt_templates import VULNERABILITY_ANALYSIS_PROMPT, VULNERABILITY_REMEDIATION_PROMPT
+from app.services.dify_scheduler import set_request_priority, PRIORITY_INTERACTIVE
+from app.services.stream_registry import resumable_streams
+from app.services.conversation_history import conversation_history
+from app.services.single_flight import make_flight_key
+from app.exceptions.dify_error import DifyOverloadedError, DifyCircuitOpenError
+from app.core.config import settings
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 流式响应的公共响应头
+SSE_RESPONSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    'Content-Type': 'text/event-stream',
+    'Access-Control-Allow-Origin': '*',
+}
+
+# 广播流的生成属于服务用户而非任何订阅者，帧中不带会话和任务标识，订阅者无法续聊或停止他人共享的生成
+BROADCAST_DROPPED_FIELDS = ("conversation_id", "user_id", "task_id", "is_new_conversation")
+
 class VulnerabilityAdviceRequest(BaseModel):
     """用于请求漏洞建议的数据模型"""
     name: str = Field(..., description="漏洞名称")
@@ -27,6 +44,18 @@ class VulnerabilityAdviceRequest(BaseModel):
     discovery_date: Optional[str] = None
     remediation_steps: Optional[str] = None
 
+def coalesce_stream(events):
+    """按配置合并流中的小消息事件"""
+    return coalesce_messages(
+        events,
+        interval=settings.SSE_COALESCE_INTERVAL_MS / 1000,
+        max_bytes=settings.SSE_COALESCE_MAX_BYTES
+    )
+
+def build_vulnerability_stream_prompt(vulnerability_data: Dict[str, Any]) -> str:
+    """构建流式漏洞分析的提示词"""
+    return f"请分析以下漏洞信息并给出建议：\n\n{json.dumps(vulnerability_data, ensure_ascii=False, indent=2)}"
+
 @router.post("/get-vulnerability-advice", response_model=Dict[str, Any])
 async def get_vulnerability_advice(
     request: VulnerabilityAdviceRequest
@@ -76,6 +105,7 @@ async def get_vulnerability_advice(
 
 @router.post("/chat")
 async def chat_with_ai(request: DifyRequestModel = Body(...)):
+    set_request_priority(PRIORITY_INTERACTIVE)
     try:
         message = request.message
         conversation_id = request.conversation_id
@@ -134,6 +164,8 @@ async def chat_with_ai(request: DifyRequestModel = Body(...)):
                 "is_new_conversation": is_new_conversation
             }
             
+    except DifyOverloadedError:
+        raise
     except Exception as e:
         error_message = f"与AI聊天时出错: {str(e)}"
         logger.error(error_message)
@@ -144,11 +176,32 @@ async def chat_with_ai(request: DifyRequestModel = Body(...)):
 
 @router.post("/chat/stream")
 async def stream_chat_with_ai(request: Request):
-    """流式聊天接口"""
+    """流式聊天接口
+    
+    逐事件模式的帧带事件ID，断线后可凭Last-Event-ID续传；透传模式（passthrough）直接转发上游字节，
+    帧不带事件ID，不支持续传。请求携带Last-Event-ID或resumable为true时不使用透传，显式要求透传则返回400。
+    """
     logger.info("收到流式聊天请求")
     logger.debug(f"请求URL: {request.url}")
     logger.debug(f"请求方法: {request.method}")
     logger.debug(f"请求头: {request.headers}")
+    
+    # 断线重连：Last-Event-ID对应的流仍在缓冲中时，从断点继续输出，不重新生成
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    resume = resumable_streams.resolve(last_event_id)
+    if resume is not None:
+        return SSEStreamingResponse(
+            resumable_streams.serve(*resume),
+            headers=SSE_RESPONSE_HEADERS
+        )
+    
+    # 流式响应开始后无法再返回503，因此在建立流之前检查是否会被拒绝
+    set_request_priority(PRIORITY_INTERACTIVE)
+    if dify_service.scheduler.would_shed(PRIORITY_INTERACTIVE):
+        raise DifyOverloadedError("AI服务繁忙（排队已满），请稍后重试", retry_after=dify_service.scheduler.retry_after)
+    if settings.DIFY_BREAKER_ENABLED and not dify_service.circuit_breaker.allows_request():
+        retry_after = dify_service.circuit_breaker.retry_after()
+        raise DifyCircuitOpenError(f"AI服务暂时不可用（熔断中），请{retry_after}秒后重试", retry_after=retry_after)
         
     try:
         # 解析请求体
@@ -167,22 +220,45 @@ async def stream_chat_with_ai(request: Request):
         logger.info(f"流式聊天 - 消息: '{message[:30]}...', 会话ID: {conversation_id}, 用户ID: {user_id}")
         logger.info(f"是否包含漏洞数据: {vulnerability_data is not None}")
         
+        # 只有会凭Last-Event-ID重连的客户端才需要在断开后保留上游，其余断开即取消
+        resumable = bool(last_event_id) or body.get("resumable", settings.SSE_RESUMABLE_DEFAULT)
+        
+        # 普通聊天可使用透传模式：直接转发上游SSE字节，不做逐事件解析和重新序列化。
+        # 透传的帧没有事件ID，也不进入续传缓冲，需要续传的请求使用逐事件模式
+        if resumable and not vulnerability_data and body.get("passthrough"):
+            raise HTTPException(status_code=400, detail="透传模式不支持断点续传（Last-Event-ID/resumable）")
+        if not vulnerability_data and not resumable and body.get("passthrough", settings.DIFY_STREAM_PASSTHROUGH):
+            async def passthrough_generator():
+                set_request_priority(PRIORITY_INTERACTIVE)
+                async for chunk in dify_service.stream_passthrough(conversation_id, message, user_id, inputs):
+                    yield chunk
+
+            return SSEStreamingResponse(
+                passthrough_generator(),
+                headers=SSE_RESPONSE_HEADERS
+            )
+        
         # 创建一个异步生成器来产生SSE事件
         async def event_generator():
+            sse = SSEEncoder(drop_fields=BROADCAST_DROPPED_FIELDS if share_key else ())
             try:
                 # 确保在函数内部可以访问外部的变量
                 nonlocal conversation_id, user_id, message, vulnerability_data, inputs
+                set_request_priority(PRIORITY_INTERACTIVE)
+                if share_key:
+                    # 广播流以服务用户身份生成，不属于发起请求的用户
+                    user_id = settings.DIFY_INTERNAL_USER_ID
                 
                 # 初始化标记，用于跟踪漏洞数据是否已处理
                 vulnerability_processed = False
                 
                 # 首先发送一个简短的初始消息事件
-                start_event = "data: " + json.dumps({
+                start_event = sse.event({
                     "event": "message",
                     "answer": "正在分析...\n\n",  # 使用更简短的消息
                     "conversation_id": conversation_id,
                     "user_id": user_id
-                }) + "\n\n"
+                })
                 logger.info("发送简短初始message事件")
                 yield start_event
                 
@@ -196,21 +272,21 @@ async def stream_chat_with_ai(request: Request):
                     
                     try:
                         # 构建漏洞分析提示
-                        prompt = f"请分析以下漏洞信息并给出建议：\n\n{json.dumps(vulnerability_data, ensure_ascii=False, indent=2)}"
+                        prompt = build_vulnerability_stream_prompt(vulnerability_data)
                         logger.info(f"准备发送漏洞分析请求，提示长度: {len(prompt)}")
                         
                         # 发送初始分析消息
-                        start_analysis_msg = "data: " + json.dumps({
+                        start_analysis_msg = sse.event({
                             "event": "message",
                             "answer": "正在分析漏洞数据...  \n  \n",  # 使用markdown格式的换行
                             "conversation_id": conversation_id,
                             "user_id": user_id
-                        }) + "\n\n"
+                        })
                         yield start_analysis_msg
                         
                         # 使用stream_chat方法发送请求并获取响应
                         try:
-                            async for chunk in dify_service.stream_chat(conversation_id, prompt, user_id):
+                            async for chunk in coalesce_stream(dify_service.stream_chat(conversation_id, prompt, user_id)):
                                 # 调试信息：记录收到的原始数据
                                 logger.info(f"原始响应数据: 类型={type(chunk)}, 内容摘要={str(chunk)[:50]}...")
                                 
@@ -218,7 +294,7 @@ async def stream_chat_with_ai(request: Request):
                                     # 检查chunk是否为字典类型（stream_chat方法的直接返回）
                                     if isinstance(chunk, dict):
                                         # 转换为SSE数据格式
-                                        chunk_event = "data: " + json.dumps(chunk) + "\n\n"
+                                        chunk_event = sse.event(chunk)
                                         yield chunk_event
                                     else:
                                         # 直接传递已经是SSE格式的数据
@@ -228,19 +304,13 @@ async def stream_chat_with_ai(request: Request):
                                     logger.error(f"处理单个数据块时出错: {str(chunk_error)}")
                                     logger.error(traceback.format_exc())
                                     # 发送错误消息
-                                    error_event = "data: " + json.dumps({
-                                        "event": "error",
-                                        "error": f"处理响应出错: {str(chunk_error)}"
-                                    }) + "\n\n"
+                                    error_event = sse.error(f"处理响应出错: {str(chunk_error)}")
                                     yield error_event
                         except Exception as stream_error:
                             logger.error(f"漏洞分析请求出错: {str(stream_error)}")
                             logger.error(traceback.format_exc())
                             # 发送错误消息
-                            error_event = "data: " + json.dumps({
-                                "event": "error",
-                                "error": f"漏洞分析请求失败: {str(stream_error)}"
-                        }) + "\n\n"
+                            error_event = sse.error(f"漏洞分析请求失败: {str(stream_error)}")
                             yield error_event
                     
                     except Exception as e:
@@ -248,10 +318,7 @@ async def stream_chat_with_ai(request: Request):
                         error_message = f"漏洞分析处理出错: {str(e)}"
                         logger.error(error_message)
                         logger.error(traceback.format_exc())
-                        error_event = "data: " + json.dumps({
-                            "event": "error",
-                            "error": error_message
-                        }) + "\n\n"
+                        error_event = sse.error(error_message)
                         yield error_event
                 
                     # 设置一个标志，以防止普通消息处理逻辑重复运行
@@ -291,13 +358,13 @@ async def stream_chat_with_ai(request: Request):
                 last_error = None  # 记录最后发生的错误
                 
                 try:
-                    async for chunk in dify_service.stream_chat(conversation_id, stream_message, user_id, inputs):
+                    async for chunk in coalesce_stream(dify_service.stream_chat(conversation_id, stream_message, user_id, inputs)):
                         received_any_chunk = True  # 标记已收到chunk
                         # 检查chunk是否为字典类型（stream_chat方法的直接返回）
                         if isinstance(chunk, dict):
                             # 处理事件类型，可能来自type字段或event字段
                             chunk_type = chunk.get("type") or chunk.get("event")
-                            logger.info(f"收到流事件: 类型={chunk_type}")
+                            logger.debug(f"收到流事件: 类型={chunk_type}")
                     
                             # 处理元数据
                             if chunk_type == "metadata":
@@ -307,13 +374,13 @@ async def stream_chat_with_ai(request: Request):
                                     conversation_id = chunk.get("conversation_id")
                                     user_id = chunk.get("user_id")
                                     # 发送会话更新通知
-                                    notification_event = "data: " + json.dumps({
+                                    notification_event = sse.event({
                                         "event": "notification",
                                         "message": "会话已更新",
                                         "conversation_id": conversation_id,
                                         "user_id": user_id,
                                         "is_new_conversation": True
-                                    }) + "\n\n"
+                                    })
                                     logger.info("发送notification事件")
                                     yield notification_event
                     
@@ -335,21 +402,21 @@ async def stream_chat_with_ai(request: Request):
                                 full_answer += content
                         
                                 # 发送调试日志
-                                logger.info(f"准备发送message事件 #{chunk_count}: 内容长度={content_length}, 累计长度={total_content_length}, 内容前30个字符: {content[:30]}")
+                                logger.debug(f"准备发送message事件 #{chunk_count}: 内容长度={content_length}, 累计长度={total_content_length}, 内容前30个字符: {content[:30]}")
                         
                                 # 构造符合Dify API的message事件
-                                chunk_event = "data: " + json.dumps({
-                                    "event": "message",
-                                    "answer": content,  # 只发送增量内容
-                                    "conversation_id": chunk.get("conversation_id") or conversation_id,
-                                    "user_id": chunk.get("user_id") or user_id,
-                                    "message_id": chunk.get("message_id")
-                                }) + "\n\n"
+                                chunk_event = sse.message(
+                                    content,  # 只发送增量内容
+                                    conversation_id=chunk.get("conversation_id") or conversation_id,
+                                    user_id=chunk.get("user_id") or user_id,
+                                    message_id=chunk.get("message_id"),
+                                    task_id=chunk.get("task_id")
+                                )
                         
                                 # 发送事件
-                                logger.info(f"发送message事件 #{chunk_count}")
+                                logger.debug(f"发送message事件 #{chunk_count}")
                                 yield chunk_event
-                                logger.info(f"已发送message事件 #{chunk_count}")
+                                logger.debug(f"已发送message事件 #{chunk_count}")
                     
                             # 处理结束标记
                             elif chunk_type in ["end", "message_end", "done"]:
@@ -366,13 +433,14 @@ async def stream_chat_with_ai(request: Request):
                                     full_answer = "AI生成的响应为空。请尝试使用更清晰的描述或者提供更详细的信息。"
                                     
                                 # 发送最终消息，使用message_end事件类型，但不重复发送完整内容
-                                message_event = "data: " + json.dumps({
-                                    "event": "message_end",
-                                    "answer": "",  # 不再重复发送完整内容
-                                    "conversation_id": conversation_id,
-                                    "user_id": user_id,
-                                    "message_id": chunk.get("message_id")
-                                }) + "\n\n"
+                                message_event = sse.end(
+                                    "",  # 不再重复发送完整内容
+                                    conversation_id=conversation_id,
+                                    user_id=user_id,
+                                    message_id=chunk.get("message_id"),
+                                    task_id=chunk.get("task_id"),
+                                    stopped=chunk.get("stopped", False)
+                                )
                                 logger.info("发送message_end事件（无内容）")
                                 yield message_event
                     
@@ -381,10 +449,7 @@ async def stream_chat_with_ai(request: Request):
                                 error_message = chunk.get("error", "未知错误")
                                 last_error = error_message  # 记录错误信息
                                 logger.error(f"流式聊天错误: {error_message}")
-                                error_event = "data: " + json.dumps({
-                                    "event": "error",
-                                    "error": error_message
-                                }) + "\n\n"
+                                error_event = sse.error(error_message)
                                 logger.info("发送error事件")
                                 yield error_event
                         # 如果已经是SSE格式的字符串，直接传递
@@ -424,21 +489,21 @@ async def stream_chat_with_ai(request: Request):
                             logger.info(f"重试成功，通过非流式API获取响应: {answer[:50]}...")
                             
                             # 发送内容
-                            content_event = "data: " + json.dumps({
+                            content_event = sse.event({
                                 "event": "message",
                                 "answer": answer,
                                 "conversation_id": result.get("conversation_id", conversation_id),
                                 "user_id": result.get("user_id", user_id)
-                            }) + "\n\n"
+                            })
                             yield content_event
                             
                             # 发送结束消息
-                            end_event = "data: " + json.dumps({
+                            end_event = sse.event({
                                 "event": "message_end",
                                 "answer": answer,
                                 "conversation_id": result.get("conversation_id", conversation_id),
                                 "user_id": result.get("user_id", user_id)
-                            }) + "\n\n"
+                            })
                             yield end_event
                             return  # 提前返回
                     except Exception as fallback_error:
@@ -447,41 +512,41 @@ async def stream_chat_with_ai(request: Request):
                         
                         # 如果重试失败，发送备用消息
                         logger.warning("重试失败，发送备用错误消息")
-                        msg = "data: " + json.dumps({
+                        msg = sse.event({
                             "event": "message",
                             "answer": "服务器连接成功，但未收到数据响应。请检查网络连接后重试。",
                             "conversation_id": conversation_id,
                             "user_id": user_id
-                        }) + "\n\n"
+                        })
                         yield msg
                         
-                        end_msg = "data: " + json.dumps({
+                        end_msg = sse.event({
                             "event": "message_end",
                             "answer": f"服务器未能提供有效响应。{f'错误信息: {last_error}' if last_error else '请稍后重试。'}",
                             "conversation_id": conversation_id,
                             "user_id": user_id
-                        }) + "\n\n"
+                        })
                         yield end_msg
                 elif not received_any_content:
                     # 收到了chunk但没有有效内容
                     logger.warning(f"收到了{chunk_count}个chunk，但没有有效内容")
                     
                     # 发送提示消息
-                    empty_message = "data: " + json.dumps({
+                    empty_message = sse.event({
                         "event": "message",
                         "answer": "服务器返回了空响应。请尝试重新提问或更改问题表述。",
                         "conversation_id": conversation_id,
                         "user_id": user_id
-                    }) + "\n\n"
+                    })
                     yield empty_message
                     
                     # 发送结束消息
-                    end_message = "data: " + json.dumps({
+                    end_message = sse.event({
                         "event": "message_end",
                         "answer": "服务器返回了空响应。请尝试重新提问或更改问题表述。",
                         "conversation_id": conversation_id,
                         "user_id": user_id
-                    }) + "\n\n"
+                    })
                     yield end_message
             
             except Exception as e:
@@ -489,24 +554,25 @@ async def stream_chat_with_ai(request: Request):
                 error_message = f"流式聊天出错: {str(e)}"
                 logger.error(error_message)
                 logger.error(traceback.format_exc())
-                error_event = "data: " + json.dumps({
-                    "event": "error",
-                    "error": error_message
-                }) + "\n\n"
+                error_event = sse.error(error_message)
                 yield error_event
         
-        # 返回流式响应
-        return StreamingResponse(
-            event_generator(),
-            media_type="text/event-stream",
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Content-Type': 'text/event-stream',
-                'Access-Control-Allow-Origin': '*',
-            }
+        # 返回流式响应，输出帧带事件ID并缓冲，断线后可凭Last-Event-ID续传
+        # 新会话的同一漏洞分析由多人同时打开时共享一次生成，后加入者先重放再接收实时事件；
+        # 共享的生成以服务用户身份进行，帧中去掉会话ID、用户ID等身份信息
+        share_key = None
+        if vulnerability_data and not conversation_id and settings.SSE_BROADCAST_ENABLED:
+            vulnerability_ref = vulnerability_data.get("id") or vulnerability_data.get("cve_id") or vulnerability_data.get("name")
+            share_key = make_flight_key("vulnerability_stream", vulnerability_ref,
+                                        build_vulnerability_stream_prompt(vulnerability_data))
+        stream_id = resumable_streams.open(event_generator, share_key, resumable=resumable)
+        return SSEStreamingResponse(
+            resumable_streams.serve(stream_id),
+            headers=SSE_RESPONSE_HEADERS
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         error_message = f"处理流式聊天请求时出错: {str(e)}"
         logger.error(error_message)
@@ -515,12 +581,37 @@ async def stream_chat_with_ai(request: Request):
             "error": error_message
         }
 
+@router.post("/chat/{task_id}/stop")
+async def stop_chat_generation(task_id: str, request: Optional[DifyStopRequest] = Body(None)):
+    """停止正在进行的生成任务（聊天和漏洞分析流），task_id来自流式事件中的task_id字段"""
+    user_id = request.user_id if request else None
+    try:
+        result = await dify_service.stop_stream(task_id, user_id)
+    except Exception as e:
+        error_message = f"停止生成失败: {str(e)}"
+        logger.error(error_message)
+        return {"success": False, "error": error_message}
+    if not result["found"]:
+        raise HTTPException(status_code=404, detail="未找到正在进行的生成任务，请提供user_id")
+    return {"success": result["upstream_stopped"] or result["stream_closed"], **result}
+
 @router.get("/conversations")
-async def get_conversations():
-    """获取所有会话列表"""
+async def get_conversations(
+    user_id: str = Query(..., min_length=1, description="用户ID，只返回该用户的会话，首次访问时先从Dify同步"),
+    limit: int = Query(20, ge=1, le=100, description="每页条数"),
+    cursor: Optional[str] = Query(None, description="上一页返回的next_cursor")
+):
+    """获取用户的会话列表，按更新时间倒序分页，从本地会话存储读取"""
     try:
-        conversations = await dify_service.get_conversations()
-        return {"success": True, "conversations": conversations}
+        conversations, next_cursor = await conversation_history.list_conversations(user_id, limit, cursor)
+        return {
+            "success": True,
+            "conversations": conversations,
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         error_message = f"获取会话列表失败: {str(e)}"
         logger.error(error_message)
@@ -528,21 +619,41 @@ async def get_conversations():
 
 @router.get("/conversation/{conversation_id}")
 async def get_conversation(conversation_id: str):
-    """获取特定会话详情"""
+    """获取特定会话详情，本地没有时查询Dify"""
     try:
-        conversation = await dify_service.get_conversation(conversation_id)
+        conversation = await conversation_history.get_conversation(conversation_id)
+        if conversation is None:
+            conversation = await dify_service.get_conversation(conversation_id)
         return {"success": True, "conversation": conversation}
+    except DifyOverloadedError:
+        raise
     except Exception as e:
         error_message = f"获取会话详情失败: {str(e)}"
         logger.error(error_message)
         return {"success": False, "error": error_message}
 
 @router.get("/conversation/{conversation_id}/messages")
-async def get_conversation_messages(conversation_id: str):
-    """获取特定会话的所有消息"""
+async def get_conversation_messages(
+    conversation_id: str,
+    user_id: Optional[str] = Query(None, description="会话所属的用户ID，未指定时使用本地记录"),
+    limit: Optional[int] = Query(None, ge=1, le=100, description="每页条数，未指定时返回全部消息"),
+    cursor: Optional[str] = Query(None, description="上一页返回的next_cursor，用于加载更早的消息")
+):
+    """获取会话消息，按时间正序，从本地会话存储读取
+    
+    未指定limit时与以往一致返回全部消息；指定limit时先返回最新的一页，页内按时间正序，
+    has_more和next_cursor用于加载更早的消息。
+    """
     try:
-        messages = await dify_service.get_conversation_messages(conversation_id)
-        return {"success": True, "messages": messages}
+        messages, next_cursor = await conversation_history.list_messages(conversation_id, user_id, limit, cursor)
+        return {
+            "success": True,
+            "messages": messages,
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         error_message = f"获取会话消息失败: {str(e)}"
         logger.error(error_message)
@@ -0,0 +1,36 @@
+import logging
+from typing import Dict, Any
+from fastapi import APIRouter
+
+from app.core.sse import get_coalesce_metrics
+from app.services.dify_service import dify_service
+from app.services.response_cache import ai_response_cache
+from app.services.job_queue import ai_job_queue
+from app.services.stream_registry import resumable_streams
+from app.services.conversation_history import conversation_history
+from app.services.chart_results import chart_result_cache
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get("/", response_model=Dict[str, Any])
+async def get_metrics():
+    """
+    获取服务运行指标
+    """
+    return {
+        "dify_http_pool": dify_service.get_pool_metrics(),
+        "dify_single_flight": dify_service.get_single_flight_metrics(),
+        "dify_scheduler": dify_service.scheduler.get_metrics(),
+        "dify_circuit_breaker": dify_service.circuit_breaker.get_metrics(),
+        "dify_retries": dify_service.get_retry_metrics(),
+        "dify_streams": dify_service.get_stream_metrics(),
+        "dify_sessions": dify_service.get_session_cache_metrics(),
+        "dify_history": conversation_history.get_metrics(),
+        "sse_coalescing": get_coalesce_metrics(),
+        "sse_resume": resumable_streams.get_metrics(),
+        "ai_response_cache": ai_response_cache.get_metrics(),
+        "ai_job_queue": ai_job_queue.get_metrics(),
+        "dashboard_chart_cache": chart_result_cache.get_metrics()
+    }
@@ -1,12 +1,18 @@
 from fastapi import APIRouter, HTTPException, Query, Depends
 from typing import List, Optional, Dict, Any
-from app.models.vulnerability import Vulnerability, VulnerabilityCreate, VulnerabilityUpdate
+from app.models.vulnerability import (
+    Vulnerability, VulnerabilityCreate, VulnerabilityUpdate,
+    VulnerabilityQueryRequest, VulnerabilityQueryResponse
+)
 import datetime
 import logging
 import urllib.parse
 
 from app.api.endpoints.assets import find_asset_by_address, mock_assets, create_asset
 from app.models.asset import AssetCreate
+from app.services.asset_risk import asset_risk_index
+from app.services.data_version import data_version
+from app.services.vulnerability_query import vulnerability_query_engine
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -107,9 +113,14 @@ mock_vulnerabilities = [
     }
 ]
 
+# 初始化资产风险索引，之后随漏洞和资产的变化增量更新
+asset_risk_index.rebuild(mock_assets, mock_vulnerabilities)
+
 # 更新资产的漏洞统计信息
 def update_asset_vulnerability_summary():
-    """更新所有资产的漏洞统计信息"""
+    """更新所有资产的漏洞统计信息，统计有变化时递增资产数据版本"""
+    previous = [asset.get("vulnerabilities_summary") for asset in mock_assets]
+    
     # 初始化所有资产的漏洞统计
     for asset in mock_assets:
         asset["vulnerabilities_summary"] = {"高": 0, "中": 0, "低": 0}
@@ -124,6 +135,10 @@ def update_asset_vulnerability_summary():
             for asset in mock_assets:
                 if asset["id"] == asset_id and risk_level in ["高", "中", "低"]:
                     asset["vulnerabilities_summary"][risk_level] += 1
+    
+    # 列表查询也会调用这里，统计不变时不递增版本，避免资产图表缓存无谓失效
+    if previous != [asset["vulnerabilities_summary"] for asset in mock_assets]:
+        data_version.bump("assets")
 
 # 自动查找或创建与漏洞URL关联的资产
 async def find_or_create_asset_for_vulnerability(vulnerability_url: str) -> Optional[Dict[str, Any]]:
@@ -280,6 +295,21 @@ async def get_vulnerabilities(
     logger.info(f"返回 {len(results)} 条漏洞记录")
     return results
 
+@router.post("/query", response_model=VulnerabilityQueryResponse)
+async def query_vulnerabilities(request: VulnerabilityQueryRequest):
+    """使用布尔表达式树查询漏洞，表达式编译后按哈希缓存并使用内存索引执行"""
+    logger.info(f"漏洞表达式查询请求，explain={request.explain}")
+    try:
+        results, explain = vulnerability_query_engine.execute(
+            request.expression, mock_vulnerabilities, explain=request.explain
+        )
+    except ValueError as e:
+        logger.warning(f"查询表达式无效: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"查询表达式无效: {str(e)}")
+    
+    logger.info(f"表达式查询返回 {len(results)} 条漏洞记录")
+    return {"total": len(results), "items": results, "explain": explain}
+
 @router.get("/{vulnerability_id}", response_model=Vulnerability)
 async def get_vulnerability(vulnerability_id: int):
     """获取单个漏洞的详细信息"""
@@ -359,6 +389,8 @@ async def create_vulnerability(vulnerability: VulnerabilityCreate):
     }
     
     mock_vulnerabilities.append(new_vulnerability)
+    data_version.bump("vulnerabilities")
+    asset_risk_index.upsert_vulnerability(new_vulnerability)
     
     # 更新资产的漏洞统计信息
     update_asset_vulnerability_summary()
@@ -422,6 +454,8 @@ async def update_vulnerability(vulnerability_id: int, vulnerability: Vulnerabili
             for field, value in update_data.items():
                 if value is not None:
                     mock_vulnerabilities[i][field] = value
+            data_version.bump("vulnerabilities")
+            asset_risk_index.upsert_vulnerability(mock_vulnerabilities[i])
             
             # 更新资产的漏洞统计信息
             update_asset_vulnerability_summary()
@@ -439,6 +473,8 @@ async def delete_vulnerability(vulnerability_id: int):
     for i, vuln in enumerate(mock_vulnerabilities):
         if vuln["id"] == vulnerability_id:
             del mock_vulnerabilities[i]
+            data_version.bump("vulnerabilities")
+            asset_risk_index.remove_vulnerability(vulnerability_id)
             
             # 更新资产的漏洞统计信息
             update_asset_vulnerability_summary()
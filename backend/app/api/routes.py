@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.endpoints import vulnerabilities, assets, dify, ai, dashboard
+from app.api.endpoints import vulnerabilities, assets, dify, ai, dashboard, metrics
 
 api_router = APIRouter()
 
@@ -8,4 +8,5 @@ api_router.include_router(vulnerabilities.router, prefix="/vulnerabilities", tag
 api_router.include_router(assets.router, prefix="/assets", tags=["assets"])
 api_router.include_router(dify.router, prefix="/dify", tags=["dify"])
 api_router.include_router(ai.router, prefix="/ai", tags=["ai"])
-api_router.include_router(dashboard.router, prefix="/dashboard", tags=["dashboard"])
\ No newline at end of file
+api_router.include_router(dashboard.router, prefix="/dashboard", tags=["dashboard"])
+api_router.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
\ No newline at end of file
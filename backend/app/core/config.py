@@ -30,6 +30,90 @@ class Settings(BaseSettings):
     DIFY_API_URL: str = os.getenv("DIFY_API_URL", "https://api.dify.ai/v1")
     DIFY_API_KEY: str = os.getenv("DIFY_API_KEY", "")
     
+    # Dify HTTP连接池配置
+    DIFY_HTTP_MAX_CONNECTIONS: int = int(os.getenv("DIFY_HTTP_MAX_CONNECTIONS", "100"))
+    DIFY_HTTP_MAX_CONNECTIONS_PER_HOST: int = int(os.getenv("DIFY_HTTP_MAX_CONNECTIONS_PER_HOST", "50"))
+    DIFY_HTTP_KEEPALIVE_TIMEOUT: float = float(os.getenv("DIFY_HTTP_KEEPALIVE_TIMEOUT", "30"))
+    DIFY_HTTP_DNS_CACHE_TTL: int = int(os.getenv("DIFY_HTTP_DNS_CACHE_TTL", "300"))
+    DIFY_HTTP_CONNECT_TIMEOUT: float = float(os.getenv("DIFY_HTTP_CONNECT_TIMEOUT", "10"))
+    DIFY_HTTP_READ_TIMEOUT: float = float(os.getenv("DIFY_HTTP_READ_TIMEOUT", "60"))
+    DIFY_HTTP_TOTAL_TIMEOUT: float = float(os.getenv("DIFY_HTTP_TOTAL_TIMEOUT", "120"))
+    
+    # 相同提示词的并发请求合并为一次上游调用
+    DIFY_SINGLE_FLIGHT_ENABLED: bool = os.getenv("DIFY_SINGLE_FLIGHT_ENABLED", "True").lower() in ("true", "1", "t")
+    # 平台内部AI调用（漏洞分析、修复建议等）使用的固定Dify用户，相同提示词的内部调用共用同一合并键
+    DIFY_INTERNAL_USER_ID: str = os.getenv("DIFY_INTERNAL_USER_ID", "vuln-platform-service")
+    
+    # 普通聊天的流式接口默认是否使用透传模式（直接转发上游SSE字节），请求体中的passthrough字段优先；
+    # 透传的帧没有事件ID，需要断点续传的请求不使用透传
+    DIFY_STREAM_PASSTHROUGH: bool = os.getenv("DIFY_STREAM_PASSTHROUGH", "False").lower() in ("true", "1", "t")
+    
+    # 流式回答的消息合并：缓冲的小消息超过间隔（毫秒）或大小（字节）时合并为一帧发出，间隔为0时不合并
+    SSE_COALESCE_INTERVAL_MS: int = int(os.getenv("SSE_COALESCE_INTERVAL_MS", "50"))
+    SSE_COALESCE_MAX_BYTES: int = int(os.getenv("SSE_COALESCE_MAX_BYTES", "1024"))
+    
+    # 可续传的流式回答：每个流缓冲的最近帧数、所有连接断开后（或流结束后）保留等待重连的秒数，以及保活注释的间隔（秒）
+    SSE_REPLAY_BUFFER_SIZE: int = int(os.getenv("SSE_REPLAY_BUFFER_SIZE", "512"))
+    SSE_RESUME_LINGER_SECONDS: float = float(os.getenv("SSE_RESUME_LINGER_SECONDS", "30"))
+    SSE_KEEPALIVE_SECONDS: float = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+    # 请求未声明resumable时是否按支持Last-Event-ID续传处理；不支持续传的流在连接断开后立即取消上游
+    SSE_RESUMABLE_DEFAULT: bool = os.getenv("SSE_RESUMABLE_DEFAULT", "False").lower() in ("true", "1", "t")
+    # 多人同时打开同一漏洞的流式分析时以服务用户身份共享一次生成，帧中不带会话和用户标识
+    SSE_BROADCAST_ENABLED: bool = os.getenv("SSE_BROADCAST_ENABLED", "True").lower() in ("true", "1", "t")
+    
+    # Dify上游调用调度配置：最大并发数、最大排队数、最长排队时间（秒），以及拒绝时返回的Retry-After（秒）
+    DIFY_MAX_CONCURRENCY: int = int(os.getenv("DIFY_MAX_CONCURRENCY", "16"))
+    DIFY_QUEUE_MAX_SIZE: int = int(os.getenv("DIFY_QUEUE_MAX_SIZE", "64"))
+    DIFY_QUEUE_MAX_WAIT: float = float(os.getenv("DIFY_QUEUE_MAX_WAIT", "30"))
+    DIFY_RETRY_AFTER_SECONDS: int = int(os.getenv("DIFY_RETRY_AFTER_SECONDS", "5"))
+    
+    # Dify上游熔断配置：统计最近N次调用，失败率或慢调用率超过阈值时打开熔断，冷却后放行少量探测请求
+    DIFY_BREAKER_ENABLED: bool = os.getenv("DIFY_BREAKER_ENABLED", "True").lower() in ("true", "1", "t")
+    DIFY_BREAKER_WINDOW_SIZE: int = int(os.getenv("DIFY_BREAKER_WINDOW_SIZE", "20"))
+    DIFY_BREAKER_MIN_CALLS: int = int(os.getenv("DIFY_BREAKER_MIN_CALLS", "10"))
+    DIFY_BREAKER_FAILURE_RATE: float = float(os.getenv("DIFY_BREAKER_FAILURE_RATE", "0.5"))
+    # 首包（响应头）耗时超过该值视为慢调用
+    DIFY_BREAKER_SLOW_CALL_SECONDS: float = float(os.getenv("DIFY_BREAKER_SLOW_CALL_SECONDS", "20"))
+    DIFY_BREAKER_SLOW_RATE: float = float(os.getenv("DIFY_BREAKER_SLOW_RATE", "0.8"))
+    DIFY_BREAKER_OPEN_SECONDS: float = float(os.getenv("DIFY_BREAKER_OPEN_SECONDS", "30"))
+    DIFY_BREAKER_HALF_OPEN_CALLS: int = int(os.getenv("DIFY_BREAKER_HALF_OPEN_CALLS", "2"))
+    
+    # 幂等请求（查询会话、消息等）的重试配置，退避时间为带随机抖动的指数退避
+    DIFY_RETRY_MAX_ATTEMPTS: int = int(os.getenv("DIFY_RETRY_MAX_ATTEMPTS", "3"))
+    DIFY_RETRY_BASE_DELAY: float = float(os.getenv("DIFY_RETRY_BASE_DELAY", "0.2"))
+    DIFY_RETRY_MAX_DELAY: float = float(os.getenv("DIFY_RETRY_MAX_DELAY", "2"))
+    
+    # Dify会话缓存配置（会话ID到用户ID的映射），超过条目数时淘汰最久未使用的会话
+    DIFY_SESSION_CACHE_MAX_ENTRIES: int = int(os.getenv("DIFY_SESSION_CACHE_MAX_ENTRIES", "10000"))
+    DIFY_SESSION_CACHE_TTL: int = int(os.getenv("DIFY_SESSION_CACHE_TTL", str(7 * 24 * 3600)))
+    # 会话缓存文件路径，多个工作进程可共用；为空时只使用内存缓存，重启后丢失
+    DIFY_SESSION_CACHE_DB: str = os.getenv("DIFY_SESSION_CACHE_DB", "./dify_sessions.db")
+    
+    # Dify会话历史的本地副本，历史记录接口从本地读取；为空时使用内存数据库，重启后重新同步
+    DIFY_HISTORY_DB: str = os.getenv("DIFY_HISTORY_DB", "./dify_history.db")
+    # 距上次同步超过该秒数时在后台从Dify增量同步
+    DIFY_HISTORY_SYNC_INTERVAL: int = int(os.getenv("DIFY_HISTORY_SYNC_INTERVAL", "60"))
+    
+    # AI响应缓存配置
+    AI_RESPONSE_CACHE_ENABLED: bool = os.getenv("AI_RESPONSE_CACHE_ENABLED", "True").lower() in ("true", "1", "t")
+    AI_RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("AI_RESPONSE_CACHE_MAX_ENTRIES", "512"))
+    AI_RESPONSE_CACHE_TTL: int = int(os.getenv("AI_RESPONSE_CACHE_TTL", str(24 * 3600)))
+    # 磁盘缓存文件路径，为空时只使用内存缓存
+    AI_RESPONSE_CACHE_DB: str = os.getenv("AI_RESPONSE_CACHE_DB", "./ai_response_cache.db")
+    # 不使用缓存的端点（端点函数名），如 ["assess_vulnerability_risk"]
+    AI_RESPONSE_CACHE_DISABLED_ENDPOINTS: List[str] = []
+    
+    # 后台AI任务配置
+    # 任务状态持久化文件路径，为空时任务状态只保存在内存中，重启后无法恢复
+    AI_JOB_DB: str = os.getenv("AI_JOB_DB", "./ai_jobs.db")
+    # 后台AI任务队列的工作协程数
+    AI_JOB_WORKERS: int = int(os.getenv("AI_JOB_WORKERS", "4"))
+    # 批量补全任务的默认并发数，上限为DIFY_MAX_CONCURRENCY
+    AI_ENRICHMENT_DEFAULT_CONCURRENCY: int = int(os.getenv("AI_ENRICHMENT_DEFAULT_CONCURRENCY", "8"))
+    
+    # 仪表盘图表按查询规格实时计算，结果按(规格, 数据版本)缓存的最大条目数
+    DASHBOARD_CHART_CACHE_MAX_ENTRIES: int = int(os.getenv("DASHBOARD_CHART_CACHE_MAX_ENTRIES", "256"))
+    
     # 数据库配置
     DATABASE_URL: str = os.getenv(
         "DATABASE_URL", "sqlite:///./app.db"
@@ -48,6 +132,46 @@ class Settings(BaseSettings):
         "低": [0.0, 3.9]      # VPR评分在0.0-3.9之间为低优先级
     }
     
+    # 本地VPR评分引擎的漏洞类型权重，未列出的类型按1.0计算
+    VULNERABILITY_TYPE_WEIGHTS: Dict[str, float] = {
+        "远程代码执行": 1.15,
+        "命令注入": 1.15,
+        "反序列化": 1.1,
+        "SQL注入": 1.1,
+        "权限提升": 1.05,
+        "未授权访问": 1.05,
+        "文件上传": 1.05,
+        "SSRF": 1.0,
+        "目录遍历": 0.95,
+        "信息泄露": 0.9,
+        "XSS": 0.85,
+        "拒绝服务": 0.85,
+        "CSRF": 0.8
+    }
+    
+    # 资产风险评分权重配置
+    # 资产等级权重，兼容"高/中/低"和"重要/一般"两种写法
+    ASSET_IMPORTANCE_WEIGHTS: Dict[str, float] = {
+        "高": 1.0, "重要": 1.0,
+        "中": 0.7, "一般": 0.7,
+        "低": 0.4
+    }
+    # 资产网络属性权重
+    ASSET_NETWORK_WEIGHTS: Dict[str, float] = {
+        "外网": 1.0,
+        "DMZ": 0.9,
+        "内网": 0.6
+    }
+    # 资产暴露面权重，按关键字匹配（先匹配先生效）
+    ASSET_EXPOSURE_WEIGHTS: Dict[str, float] = {
+        "公网": 1.0,
+        "互联网": 1.0,
+        "外网": 1.0,
+        "内网": 0.6
+    }
+    # 资产属性未知时使用的默认权重
+    ASSET_UNKNOWN_WEIGHT: float = 0.8
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -0,0 +1,180 @@
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from pydantic import BaseModel, ValidationError
+
+logger = logging.getLogger(__name__)
+
+# 模型常在JSON字符串中直接输出换行和制表符，解析前转义
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+class StructuredOutputError(ValueError):
+    """AI回答中没有完整的JSON对象，或字段不符合目标模型；text为出错时已接收的回答文本"""
+
+    def __init__(self, message: str, text: str = ""):
+        super().__init__(message)
+        self.text = text
+
+class IncrementalJSONExtractor:
+    """从AI回答的文本流中增量提取第一个JSON对象
+
+    逐块喂入回答文本，跳过对象前的说明文字和```json标记；顶层对象闭合后feed返回True，
+    调用方即可停止读取上游，不必等待对象后的说明文字。每个顶层字段的值完整后立即解析，
+    指定了目标模型时按该字段的类型（包括字段校验器）校验；on_field回调用于逐步展示已完成的字段。
+    候选对象闭合后无法解析或字段不符合目标模型时（如说明文字中的花括号或示例对象），
+    丢弃该候选对象，从其后的下一个"{"重新开始；直到回答结束都没有符合的对象时，
+    finish抛出StructuredOutputError，带最后一次字段校验失败的原因。
+    """
+
+    def __init__(self, model: Optional[Type[BaseModel]] = None,
+                 on_field: Optional[Callable[[str, Any], None]] = None):
+        self._model = model
+        self._on_field = on_field
+        self._text = ""
+        self._pos = 0
+        self._end: Optional[int] = None
+        self._result: Optional[Dict[str, Any]] = None
+        # 最近一个因字段不符合目标模型而被丢弃的候选对象的错误信息
+        self._rejection: Optional[str] = None
+        self._reset(None)
+
+    def _reset(self, start: Optional[int]):
+        """从start处的"{"开始新的候选对象，start为None时等待下一个"{" """
+        self._start = start
+        self._depth = 1 if start is not None else 0
+        self._in_string = False
+        self._escape = False
+        # 转义控制字符后的候选对象文本
+        self._out: List[str] = ["{"] if start is not None else []
+        self._key: Optional[str] = None
+        self._key_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+        self._fields: Dict[str, Any] = {}
+        self._partial = self._model.model_construct() if self._model is not None else None
+
+    @property
+    def done(self) -> bool:
+        """顶层对象是否已闭合并解析成功"""
+        return self._result is not None
+
+    @property
+    def fields(self) -> Dict[str, Any]:
+        """已完成的顶层字段，指定了目标模型时为校验后的值"""
+        return dict(self._fields)
+
+    @property
+    def text(self) -> str:
+        """已接收的回答文本，对象闭合后截至对象结束"""
+        return self._text[:self._end] if self._end is not None else self._text
+
+    def _complete_field(self) -> bool:
+        """解析刚完成的顶层字段，字段不符合目标模型时丢弃当前候选对象并返回False"""
+        value_text = "".join(self._out[self._value_start:]).strip()
+        key, self._key, self._value_start = self._key, None, None
+        try:
+            value = json.loads(value_text)
+        except json.JSONDecodeError:
+            # 值本身不完整时对象整体也无法解析，交给对象闭合时处理
+            return True
+        if self._model is not None and key in self._model.model_fields:
+            try:
+                self._model.__pydantic_validator__.validate_assignment(self._partial, key, value)
+            except ValidationError as e:
+                self._rejection = f"字段 {key} 不符合格式: {e.errors()[0]['msg']}"
+                logger.debug(f"候选JSON对象{self._rejection}，继续查找 - 位置: {self._start}")
+                self._pos = self._start + 1
+                self._reset(None)
+                return False
+            value = getattr(self._partial, key)
+        self._fields[key] = value
+        if self._on_field is not None:
+            self._on_field(key, value)
+        return True
+
+    def _close_object(self, index: int) -> bool:
+        try:
+            value = json.loads("".join(self._out))
+        except json.JSONDecodeError:
+            value = None
+        if isinstance(value, dict):
+            self._result = value
+            self._end = index + 1
+            return True
+        logger.debug(f"候选JSON对象无法解析，继续查找 - 位置: {self._start}")
+        self._pos = self._start + 1
+        self._reset(None)
+        return False
+
+    def feed(self, chunk: str) -> bool:
+        """喂入一段回答文本，返回顶层对象是否已闭合"""
+        if self._result is not None:
+            return True
+        self._text += chunk
+        text = self._text
+        while self._pos < len(text):
+            index = self._pos
+            char = text[index]
+            self._pos += 1
+            out = self._out
+            if self._start is None:
+                if char == "{":
+                    self._reset(index)
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        out.append(char)
+                        try:
+                            self._key = json.loads("".join(out[self._key_start:]))
+                        except json.JSONDecodeError:
+                            self._key = None
+                        self._key_start = None
+                        continue
+                elif char in _CONTROL_ESCAPES:
+                    char = _CONTROL_ESCAPES[char]
+                out.append(char)
+                continue
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._value_start is None:
+                    self._key_start = len(out)
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 1 and self._value_start is not None and not self._complete_field():
+                    continue
+                self._depth -= 1
+                if self._depth == 0:
+                    out.append(char)
+                    if self._close_object(index):
+                        return True
+                    continue
+            elif self._depth == 1 and char == ":" and self._key is not None and self._value_start is None:
+                out.append(char)
+                self._value_start = len(out)
+                continue
+            elif self._depth == 1 and char == "," and self._value_start is not None:
+                if not self._complete_field():
+                    continue
+            out.append(char)
+        return False
+
+    def finish(self) -> Dict[str, Any]:
+        """回答结束后获取解析结果，没有完整的JSON对象时抛出StructuredOutputError"""
+        if self._result is None:
+            if self._rejection is not None:
+                raise StructuredOutputError(self._rejection, self._text)
+            raise StructuredOutputError("AI回答中未找到完整的JSON对象", self._text)
+        return self._result
+
+def extract_json(text: str, model: Optional[Type[BaseModel]] = None) -> Dict[str, Any]:
+    """从完整的回答文本中提取第一个JSON对象"""
+    extractor = IncrementalJSONExtractor(model)
+    extractor.feed(text)
+    return extractor.finish()
@@ -180,9 +180,10 @@ VULNERABILITY_REMEDIATION_PROMPT = """
 DATA_CHART_GENERATION_PROMPT = """
 你是一名专业的安全数据分析师和可视化专家，请根据用户的自然语言描述，生成符合要求的数据图表。
 
-分析范围内的数据：
-- 漏洞数据: {vulnerability_data}
-- 资产数据: {asset_data}
+分析范围内的数据（已对筛选后的全部记录做了本地汇总，total为记录总数，by为各字段的分类计数，
+scores为评分的区间分布，discovery_date为按时间分桶的计数，"其他"为计数较少的取值合并）：
+- 漏洞数据汇总: {vulnerability_data}
+- 资产数据汇总: {asset_data}
 - 分析时间范围: {time_range}
 - 特定查询条件: {filter_conditions}
 - 是否使用高级分析: {use_advanced_analysis}
@@ -201,7 +202,7 @@ DATA_CHART_GENERATION_PROMPT = """
 
 请基于提供的数据执行以下步骤：
 1. 理解用户需求，确定最佳图表类型
-2. 从提供的数据中筛选和聚合相关数据点
+2. 从提供的汇总数据中选取相关的统计值作为图表数据，数值必须与汇总一致，不要编造汇总中没有的数据
 3. 构建符合ECharts或Ant Design Charts要求的图表配置
 4. 提供简洁的图表分析结论和解读
 
@@ -228,4 +229,47 @@ DATA_CHART_GENERATION_PROMPT = """
 - 图表标题和轴标签应当简洁明了
 - 配色应当符合数据可视化最佳实践
 - 如果用户描述不够具体，应基于专业知识选择最有价值的数据维度进行展示
-""" 
\ No newline at end of file
+""" 
+# 图表规划提示词模板：AI只把用户描述翻译为查询规格，数据由后端在本地计算
+CHART_SPEC_PLANNER_PROMPT = """
+你是一名安全数据可视化规划助手。请把用户的图表需求翻译为一个查询规格，由系统在本地对完整数据执行。
+不需要、也不要生成任何图表数据。
+
+可用数据源及字段：
+1. vulnerabilities（漏洞）
+   - 分组字段: risk_level(风险等级), status(状态), vulnerability_type(漏洞类型), priority(优先级),
+     department(部门), responsible_person(负责人), affected_asset(受影响资产)
+   - 时间分组字段: discovery_date, first_found_date, latest_found_date，写作"字段:粒度"，粒度为day/week/month/year
+   - 数值字段: cvss_score, vpr_score, fix_time_hours
+   - 筛选字段: 以上字段以及 name, description, cve_id
+2. assets（资产）
+   - 分组字段: type(资产类型), department, asset_group, network_type, importance_level(重要性),
+     business_system, exposure, responsible_person, source
+   - 时间分组字段: discovery_date, update_date
+   - 数值字段: vulnerability_count(漏洞总数), open_ports(开放端口数)
+
+用户的要求描述：
+{user_description}
+
+只输出一个JSON对象，格式如下：
+```json
+{{
+  "source": "vulnerabilities 或 assets",
+  "chart_type": "bar、line 或 pie",
+  "group_by": ["1到2个分组字段，第二个字段作为系列"],
+  "measures": [{{"op": "count"}}, {{"op": "avg/sum/min/max", "field": "数值字段"}}],
+  "filter": {{"and": [{{"field": "risk_level", "op": "in", "value": ["高"]}}]}},
+  "sort": "value（按数值倒序）或 key（按分组值正序，时间分组时使用）",
+  "limit": 10,
+  "title": "图表标题",
+  "description": "图表说明",
+  "category": "图表分类（如'漏洞分布'、'风险趋势'等）"
+}}
+```
+
+请注意：
+- filter的操作符可选 eq/ne/in/not_in/gt/gte/lt/lte/contains/exists，可用and/or/not组合；不需要筛选时为null
+- 饼图只使用一个分组字段和一个聚合项
+- limit只在用户要求"前N个"等情况下设置，否则为null
+- 时间趋势使用折线图并按时间分组
+"""
@@ -0,0 +1,383 @@
+import asyncio
+import codecs
+import json
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+
+import anyio
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时使用标准库json
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+def dumps_json(value: Any) -> bytes:
+    """紧凑的UTF-8 JSON序列化，中文不转义为\\uXXXX"""
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+def encode_event(data: Any) -> bytes:
+    """将任意对象编码为一个SSE data帧"""
+    return b"data: " + dumps_json(data) + b"\n\n"
+
+# 常用事件帧的固定部分
+_MESSAGE_PREFIX = b'data: {"event":"message","answer":'
+_END_PREFIX = b'data: {"event":"message_end","answer":'
+_ERROR_PREFIX = b'data: {"event":"error","error":'
+_FRAME_END = b"}\n\n"
+
+class SSEEncoder:
+    """聊天流的SSE帧编码器
+
+    message、message_end和error帧使用预先构造的字节模板；同一个流中会话ID、用户ID等
+    元数据通常不变，其编码结果被缓存，每个token只需序列化回答片段本身。
+    drop_fields中的字段不写入任何帧，用于多人共享的流中去掉会话ID、用户ID等身份信息。
+    """
+
+    __slots__ = ("_meta_key", "_meta_suffix", "_drop_fields")
+
+    def __init__(self, drop_fields: Tuple[str, ...] = ()):
+        self._meta_key: Optional[tuple] = None
+        self._meta_suffix = _FRAME_END
+        self._drop_fields = drop_fields
+
+    def _without_dropped(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        if not self._drop_fields:
+            return data
+        return {key: value for key, value in data.items() if key not in self._drop_fields}
+
+    def _suffix(self, meta: Dict[str, Any]) -> bytes:
+        meta = self._without_dropped(meta)
+        key = tuple(meta.items())
+        if key != self._meta_key:
+            self._meta_key = key
+            self._meta_suffix = b"," + dumps_json(meta)[1:] + b"\n\n" if meta else _FRAME_END
+        return self._meta_suffix
+
+    def message(self, answer: str, **meta) -> bytes:
+        """增量回答片段，附加字段（conversation_id、user_id等）按传入顺序输出"""
+        return _MESSAGE_PREFIX + dumps_json(answer) + self._suffix(meta)
+
+    def end(self, answer: str = "", **meta) -> bytes:
+        """结束事件"""
+        frame = _END_PREFIX + dumps_json(answer)
+        meta = self._without_dropped(meta)
+        if meta:
+            return frame + b"," + dumps_json(meta)[1:] + b"\n\n"
+        return frame + _FRAME_END
+
+    @staticmethod
+    def error(message: str) -> bytes:
+        """错误事件"""
+        return _ERROR_PREFIX + dumps_json(message) + _FRAME_END
+
+    def event(self, data: Dict[str, Any]) -> bytes:
+        """其他事件"""
+        return encode_event(self._without_dropped(data))
+
+class SSEEvent:
+    """一个完整的SSE事件"""
+
+    __slots__ = ("event", "data", "id", "retry")
+
+    def __init__(self, data: str, event: str = "message", id: Optional[str] = None, retry: Optional[int] = None):
+        self.event = event
+        self.data = data
+        self.id = id
+        self.retry = retry
+
+    def json(self) -> Optional[Dict[str, Any]]:
+        """将data字段解析为JSON对象，解析失败时返回None"""
+        try:
+            value = json.loads(self.data)
+        except ValueError:
+            logger.error(f"解析SSE数据失败: {self.data[:200]}")
+            return None
+        return value if isinstance(value, dict) else None
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, id={self.id!r}, data={self.data[:50]!r})"
+
+class SSEDecoder:
+    """增量SSE解码器
+
+    直接接收字节块：使用增量UTF-8解码器处理被拆分在两个块之间的多字节字符，
+    只保留尚未结束的最后一行，每个字节只被扫描常数次，总耗时与响应长度成线性关系。
+    支持多行data字段、event/id/retry字段、注释行，以及\\n、\\r\\n、\\r三种换行符。
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        # 尚未遇到换行符的行尾片段，按块追加，遇到换行符时一次性拼接
+        self._pending: List[str] = []
+        # 上一块以\r结尾时，下一块开头的\n属于同一个换行符
+        self._skip_lf = False
+        self._data: List[str] = []
+        self._event = ""
+        self._last_event_id: Optional[str] = None
+        self._retry: Optional[int] = None
+
+    @property
+    def last_event_id(self) -> Optional[str]:
+        return self._last_event_id
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """输入一个字节块，返回其中已完整的事件"""
+        return self._feed_text(self._decoder.decode(chunk))
+
+    def flush(self) -> List[SSEEvent]:
+        """输入结束，返回剩余的事件；上游未以空行结束的最后一个事件也会返回"""
+        events = self._feed_text(self._decoder.decode(b"", final=True))
+        if self._pending:
+            self._process_line("".join(self._pending), events)
+            self._pending = []
+        self._dispatch(events)
+        return events
+
+    def _feed_text(self, text: str) -> List[SSEEvent]:
+        events: List[SSEEvent] = []
+        if not text:
+            return events
+        if self._skip_lf:
+            self._skip_lf = False
+            if text[0] == "\n":
+                text = text[1:]
+        if "\r" in text:
+            # 统一换行符；块末尾的\r可能与下一块开头的\n组成一个换行符
+            if text[-1] == "\r":
+                self._skip_lf = True
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+        lines = text.split("\n")
+        # 最后一段没有遇到换行符，留待下一块拼接
+        tail = lines.pop()
+        if lines:
+            if self._pending:
+                self._pending.append(lines[0])
+                lines[0] = "".join(self._pending)
+                self._pending = []
+            data = self._data
+            for line in lines:
+                # 常见的data行和空行走快速路径，其余字段交给_process_line
+                if line.startswith("data: "):
+                    data.append(line[6:])
+                elif not line:
+                    if data:
+                        self._dispatch(events)
+                        data = self._data
+                else:
+                    self._process_line(line, events)
+        if tail:
+            self._pending.append(tail)
+        return events
+
+    def _process_line(self, line: str, events: List[SSEEvent]):
+        if not line:
+            self._dispatch(events)
+            return
+        if line[0] == ":":
+            return
+        colon = line.find(":")
+        if colon >= 0:
+            field = line[:colon]
+            value = line[colon + 1:]
+            if value.startswith(" "):
+                value = value[1:]
+        else:
+            field, value = line, ""
+
+        if field == "data":
+            self._data.append(value)
+        elif field == "event":
+            self._event = value
+        elif field == "id":
+            if "\0" not in value:
+                self._last_event_id = value
+        elif field == "retry":
+            if value.isdigit():
+                self._retry = int(value)
+
+    def _dispatch(self, events: List[SSEEvent]):
+        if self._data:
+            data = self._data
+            events.append(SSEEvent(
+                data[0] if len(data) == 1 else "\n".join(data),
+                self._event or "message",
+                self._last_event_id,
+                self._retry
+            ))
+            self._data = []
+        self._event = ""
+
+async def iter_sse_events(chunks: AsyncIterable[bytes]) -> AsyncIterator[SSEEvent]:
+    """从字节流中逐个产生SSE事件"""
+    decoder = SSEDecoder()
+    async for chunk in chunks:
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.flush():
+        yield event
+
+# 消息合并统计：合并前的消息事件数和实际发出的消息帧数
+_coalesce_stats = {"streams": 0, "events_in": 0, "frames_out": 0}
+
+def get_coalesce_metrics() -> Dict[str, Any]:
+    """获取消息合并指标"""
+    stats = _coalesce_stats
+    return {
+        **stats,
+        "events_per_frame": round(stats["events_in"] / stats["frames_out"], 2) if stats["frames_out"] else 0.0
+    }
+
+_MESSAGE_META_FIELDS = ("conversation_id", "message_id", "task_id", "user_id")
+_COALESCE_QUEUE_SIZE = 256
+
+class _SourceError:
+    """上游事件源抛出的异常，转交给消费方重新抛出"""
+
+    __slots__ = ("error",)
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+async def coalesce_messages(events: AsyncIterable[Dict[str, Any]], interval: float,
+                            max_bytes: int) -> AsyncIterator[Dict[str, Any]]:
+    """合并连续的小消息事件
+
+    上游经常逐字产生message事件，这里把元数据相同的连续消息合并为一个：距离缓冲中
+    第一条消息超过interval秒，或缓冲内容超过max_bytes字节时发出。每个流第一条有内容的消息
+    立即发出，不增加首字延迟，在它之前的空消息（如只带会话ID的占位事件）原样转发；
+    结束、错误等其他事件到达时先发出缓冲内容，再立即转发。
+    interval不大于0时不做合并。
+    """
+    if interval <= 0:
+        async for event in events:
+            yield event
+        return
+
+    # 上游在独立的任务中读取，保证生成器始终在同一个上下文中执行（上下文变量的设置与重置一致）
+    queue: asyncio.Queue = asyncio.Queue(maxsize=_COALESCE_QUEUE_SIZE)
+    done = object()
+
+    async def pump():
+        try:
+            async for event in events:
+                await queue.put(event)
+        except Exception as e:
+            await queue.put(_SourceError(e))
+        await queue.put(done)
+
+    loop = asyncio.get_running_loop()
+    pump_task = asyncio.create_task(pump())
+    stats = _coalesce_stats
+    stats["streams"] += 1
+    pending: Optional[Dict[str, Any]] = None
+    parts: List[str] = []
+    size = 0
+    deadline = 0.0
+    first_sent = False
+
+    def flush() -> Dict[str, Any]:
+        nonlocal pending, parts, size
+        merged = pending
+        content = "".join(parts)
+        if "content" in merged:
+            merged["content"] = content
+        if "answer" in merged:
+            merged["answer"] = content
+        pending, parts, size = None, [], 0
+        stats["frames_out"] += 1
+        return merged
+
+    try:
+        while True:
+            if pending is None:
+                event = await queue.get()
+            else:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    yield flush()
+                    continue
+            if event is done:
+                break
+            if isinstance(event, _SourceError):
+                raise event.error
+
+            is_message = isinstance(event, dict) and (event.get("type") or event.get("event")) == "message"
+            if not is_message:
+                if pending is not None:
+                    yield flush()
+                yield event
+                continue
+
+            stats["events_in"] += 1
+            text = event.get("content") or event.get("answer") or ""
+            if not first_sent:
+                first_sent = bool(text)
+                stats["frames_out"] += 1
+                yield event
+                continue
+            if pending is not None and any(event.get(f) != pending.get(f) for f in _MESSAGE_META_FIELDS):
+                yield flush()
+            if pending is None:
+                pending = dict(event)
+                deadline = loop.time() + interval
+            parts.append(text)
+            size += len(text.encode("utf-8"))
+            if size >= max_bytes:
+                yield flush()
+        if pending is not None:
+            yield flush()
+    finally:
+        if not pump_task.done():
+            # 下游已停止读取，取消上游读取
+            pump_task.cancel()
+        await asyncio.gather(pump_task, return_exceptions=True)
+
+class SSEStreamingResponse(StreamingResponse):
+    """客户端断开后立即停止的流式响应
+
+    无论服务器使用哪个ASGI版本，都同时监听http.disconnect；客户端断开时取消发送任务，
+    并显式关闭响应体生成器，使生成器内的上游请求立即中断、清理代码立即执行，
+    而不是继续读取完整的上游回答后再丢弃。
+    """
+
+    media_type = "text/event-stream"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        error: Optional[BaseException] = None
+        disconnected = False
+
+        async def stream():
+            nonlocal error, disconnected
+            try:
+                await self.stream_response(send)
+            except OSError:
+                disconnected = True
+            except Exception as e:
+                error = e
+            task_group.cancel_scope.cancel()
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(stream)
+                await self.listen_for_disconnect(receive)
+                if not task_group.cancel_scope.cancel_called:
+                    disconnected = True
+                task_group.cancel_scope.cancel()
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        if disconnected:
+            logger.info("客户端已断开，停止流式响应")
+        if error is not None:
+            raise error
+        if self.background is not None:
+            await self.background()
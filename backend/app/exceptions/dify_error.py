@@ -1,3 +1,14 @@
 class DifyAPIError(Exception):
     """Dify API调用异常"""
-    pass 
\ No newline at end of file
+    pass
+
+class DifyOverloadedError(DifyAPIError):
+    """Dify上游调用已达并发上限，请求被拒绝"""
+
+    def __init__(self, message: str, retry_after: int = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class DifyCircuitOpenError(DifyOverloadedError):
+    """Dify上游故障，熔断器打开期间请求被快速拒绝"""
+    pass
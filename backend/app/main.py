@@ -1,7 +1,16 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.api.routes import api_router
 from app.core.config import settings
+from app.services.dify_service import dify_service
+from app.services.response_cache import ai_response_cache
+from app.services.enrichment_jobs import enrichment_job_manager
+from app.services.job_queue import ai_job_queue
+from app.services.job_store import job_store
+from app.services.session_cache import session_cache
+from app.services.conversation_store import conversation_store
+from app.exceptions.dify_error import DifyOverloadedError
 import logging
 import sys
 import uvicorn
@@ -55,6 +64,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# AI服务繁忙时快速返回503，提示客户端稍后重试
+@app.exception_handler(DifyOverloadedError)
+async def dify_overloaded_handler(request: Request, exc: DifyOverloadedError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # 包含API路由
 logger.info(f"注册API路由，前缀：{settings.API_V1_STR}")
 app.include_router(api_router, prefix=settings.API_V1_STR)
@@ -72,6 +90,28 @@ async def startup_event():
     logger.info("已注册的API路由:")
     for route in routes:
         logger.info(f"  {route}")
+    
+    # 创建Dify共享HTTP连接池
+    await dify_service.startup()
+    # 恢复重启前未完成的批量补全任务
+    await enrichment_job_manager.resume()
+    # 启动后台AI任务队列
+    await ai_job_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 暂停运行中的批量补全任务，重启后继续
+    await enrichment_job_manager.shutdown()
+    await ai_job_queue.stop()
+    # 关闭Dify共享HTTP连接池
+    await dify_service.shutdown()
+    # 关闭AI响应磁盘缓存
+    ai_response_cache.close()
+    # 关闭任务状态存储
+    job_store.close()
+    # 关闭会话缓存和会话历史存储
+    session_cache.close()
+    conversation_store.close()
 
 @app.get("/")
 def root():
@@ -70,4 +70,16 @@ class AssetUpdate(BaseModel):
     ports: Optional[List[AssetPort]] = None
     business_system: Optional[str] = None
     business_impact: Optional[str] = None
-    exposure: Optional[str] = None 
\ No newline at end of file
+    exposure: Optional[str] = None
+
+
+class AssetRiskScore(BaseModel):
+    """资产风险评分模型"""
+    asset_id: int
+    name: str = Field(..., description="资产名称")
+    risk_score: float = Field(..., description="资产风险分（0-100），综合资产等级、网络属性、暴露面和关联漏洞评分")
+    importance_level: Optional[str] = Field(None, description="资产等级")
+    network_type: Optional[str] = Field(None, description="资产网络属性")
+    exposure: Optional[str] = Field(None, description="资产暴露面")
+    open_vulnerabilities: int = Field(0, description="关联的未修复漏洞数量")
+    max_vulnerability_score: Optional[float] = Field(None, description="关联未修复漏洞的最高评分")
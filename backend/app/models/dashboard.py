@@ -11,6 +11,8 @@ class ChartConfig(BaseModel):
     config: Dict[str, Any]
     category: str
     applied_filters: str
+    # 图表查询规格（见 app.services.chart_spec），设置后获取图表时按当前数据重新计算data和config
+    spec: Optional[Dict[str, Any]] = None
 
 class DashboardChart(BaseModel):
     """仪表盘图表模型"""
@@ -8,4 +8,8 @@ class DifyRequestModel(BaseModel):
     user_id: Optional[str] = Field(None, description="用户ID")
     inputs: Optional[Dict[str, Any]] = Field(None, description="输入参数")
     vulnerability_data: Optional[Dict[str, Any]] = Field(None, description="漏洞数据")
-    stream: Optional[bool] = Field(False, description="是否使用流式响应") 
\ No newline at end of file
+    stream: Optional[bool] = Field(False, description="是否使用流式响应") 
+
+class DifyStopRequest(BaseModel):
+    """停止生成请求的数据模型"""
+    user_id: Optional[str] = Field(None, description="发起生成的用户ID，任务不在本进程中时必填")
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field
 
 class Asset(BaseModel):
@@ -8,6 +8,13 @@ class Asset(BaseModel):
     ip: Optional[str] = None
     type: str
 
+class AIGeneratedContent(BaseModel):
+    """保存在漏洞记录上的AI生成内容"""
+    content: str = Field(..., description="AI生成的内容")
+    fingerprint: str = Field(..., description="生成时提示词输入字段的指纹，字段变化后需重新生成")
+    generated_at: datetime = Field(..., description="生成时间")
+    conversation_id: Optional[str] = Field(None, description="生成时的Dify会话ID")
+
 class Vulnerability(BaseModel):
     id: int
     name: str
@@ -39,6 +46,10 @@ class Vulnerability(BaseModel):
     fix_impact: Optional[str] = Field(None, description="漏洞修复影响")
     references: Optional[str] = Field(None, description="漏洞参考资料，可以是链接或文献")
     
+    # AI生成结果，随漏洞记录保存
+    ai_analysis: Optional[AIGeneratedContent] = Field(None, description="AI漏洞分析结果")
+    ai_remediation: Optional[AIGeneratedContent] = Field(None, description="AI修复建议")
+    
 class VulnerabilityCreate(BaseModel):
     name: str
     cve_id: Optional[str] = None
@@ -94,4 +105,16 @@ class VulnerabilityUpdate(BaseModel):
     affected_components: Optional[str] = None
     impact_scope: Optional[str] = None
     fix_impact: Optional[str] = None
-    references: Optional[str] = None
\ No newline at end of file
+    references: Optional[str] = None
+
+
+class VulnerabilityQueryRequest(BaseModel):
+    """漏洞布尔表达式查询请求"""
+    expression: Dict[str, Any] = Field(..., description="布尔表达式树，支持and/or/not节点和field/op/value叶子节点")
+    explain: bool = Field(False, description="是否返回查询计划、索引选择和各阶段耗时")
+
+class VulnerabilityQueryResponse(BaseModel):
+    """漏洞布尔表达式查询响应"""
+    total: int
+    items: List[Vulnerability]
+    explain: Optional[Dict[str, Any]] = None
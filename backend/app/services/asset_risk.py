@@ -0,0 +1,186 @@
+import bisect
+import logging
+import math
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 不计入资产风险的漏洞状态
+CLOSED_VULNERABILITY_STATUSES = ("已修复", "已验证")
+
+# 漏洞缺少VPR和CVSS评分时，按风险等级估算的默认分值
+RISK_LEVEL_DEFAULT_SCORES = {"紧急": 9.0, "高": 7.5, "中": 5.0, "低": 2.5}
+
+def importance_weight(importance_level: Optional[str]) -> float:
+    """资产等级权重"""
+    return settings.ASSET_IMPORTANCE_WEIGHTS.get(importance_level or "", settings.ASSET_UNKNOWN_WEIGHT)
+
+def network_weight(network_type: Optional[str]) -> float:
+    """资产网络属性权重"""
+    return settings.ASSET_NETWORK_WEIGHTS.get(network_type or "", settings.ASSET_UNKNOWN_WEIGHT)
+
+def exposure_weight(exposure: Optional[str]) -> float:
+    """资产暴露面权重，按关键字匹配"""
+    if exposure:
+        for keyword, weight in settings.ASSET_EXPOSURE_WEIGHTS.items():
+            if keyword in exposure:
+                return weight
+    return settings.ASSET_UNKNOWN_WEIGHT
+
+def vulnerability_score(vulnerability: Dict[str, Any]) -> float:
+    """漏洞对资产风险的贡献分值：优先VPR，其次CVSS，最后按风险等级估算"""
+    for field in ("vpr_score", "cvss_score"):
+        value = vulnerability.get(field)
+        if value is not None:
+            return float(value)
+    return RISK_LEVEL_DEFAULT_SCORES.get(vulnerability.get("risk_level"), 0.0)
+
+class AssetRiskIndex:
+    """资产风险评分索引
+
+    每个资产的风险分由资产等级、网络属性、暴露面和关联未修复漏洞的评分综合得出，
+    在漏洞或资产变化时只重算受影响的资产，并维护一个按分数降序排列的有序列表，
+    Top-K查询只需切片即可完成。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 资产ID -> 资产属性快照
+        self._assets: Dict[int, Dict[str, Any]] = {}
+        # 漏洞ID -> (关联资产ID元组, 漏洞分值)，仅记录未修复漏洞
+        self._vulnerabilities: Dict[int, Tuple[Tuple[int, ...], float]] = {}
+        # 资产ID -> {漏洞ID: 漏洞分值}
+        self._asset_vulnerabilities: Dict[int, Dict[int, float]] = {}
+        # 资产ID -> 风险分
+        self._scores: Dict[int, float] = {}
+        # 按(-风险分, 资产ID)排序的列表
+        self._ranking: List[Tuple[float, int]] = []
+
+    def rebuild(self, assets: List[Dict[str, Any]], vulnerabilities: List[Dict[str, Any]]):
+        """根据全量数据重建索引"""
+        with self._lock:
+            self._assets = {}
+            self._vulnerabilities = {}
+            self._asset_vulnerabilities = {}
+            for asset in assets:
+                self._assets[asset["id"]] = self._snapshot_asset(asset)
+            for vuln in vulnerabilities:
+                self._apply_vulnerability(vuln)
+            self._scores = {asset_id: self._compute_score(asset_id) for asset_id in self._assets}
+            self._ranking = sorted((-score, asset_id) for asset_id, score in self._scores.items())
+        logger.info(f"资产风险索引重建完成 - 资产数: {len(self._assets)}, 未修复漏洞数: {len(self._vulnerabilities)}")
+
+    @staticmethod
+    def _snapshot_asset(asset: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "name": asset.get("name"),
+            "importance_level": asset.get("importance_level"),
+            "network_type": asset.get("network_type"),
+            "exposure": asset.get("exposure"),
+            "weight": importance_weight(asset.get("importance_level"))
+                      * network_weight(asset.get("network_type"))
+                      * exposure_weight(asset.get("exposure"))
+        }
+
+    def _apply_vulnerability(self, vulnerability: Dict[str, Any]) -> set:
+        """登记漏洞与资产的关联，返回受影响的资产ID集合"""
+        vuln_id = vulnerability["id"]
+        affected = set(self._detach_vulnerability(vuln_id))
+
+        if vulnerability.get("status") in CLOSED_VULNERABILITY_STATUSES:
+            return affected
+
+        asset_ids = tuple(a.get("id") for a in vulnerability.get("affected_assets", []) or [] if a.get("id") is not None)
+        score = vulnerability_score(vulnerability)
+        self._vulnerabilities[vuln_id] = (asset_ids, score)
+        for asset_id in asset_ids:
+            self._asset_vulnerabilities.setdefault(asset_id, {})[vuln_id] = score
+            affected.add(asset_id)
+        return affected
+
+    def _detach_vulnerability(self, vuln_id: int) -> Tuple[int, ...]:
+        previous = self._vulnerabilities.pop(vuln_id, None)
+        if previous is None:
+            return ()
+        asset_ids, _ = previous
+        for asset_id in asset_ids:
+            linked = self._asset_vulnerabilities.get(asset_id)
+            if linked is not None:
+                linked.pop(vuln_id, None)
+                if not linked:
+                    del self._asset_vulnerabilities[asset_id]
+        return asset_ids
+
+    def _compute_score(self, asset_id: int) -> float:
+        """计算资产风险分（0-100）"""
+        asset = self._assets.get(asset_id)
+        linked = self._asset_vulnerabilities.get(asset_id)
+        if asset is None or not linked:
+            return 0.0
+        # 以最高漏洞分为主，多个漏洞叠加时按对数递增，封顶10分
+        vuln_component = min(10.0, max(linked.values()) + 0.5 * math.log2(len(linked)))
+        return round(vuln_component * 10 * asset["weight"], 2)
+
+    def _rescore(self, asset_ids):
+        for asset_id in asset_ids:
+            old_score = self._scores.pop(asset_id, None)
+            if old_score is not None:
+                pos = bisect.bisect_left(self._ranking, (-old_score, asset_id))
+                if pos < len(self._ranking) and self._ranking[pos] == (-old_score, asset_id):
+                    del self._ranking[pos]
+            if asset_id in self._assets:
+                score = self._compute_score(asset_id)
+                self._scores[asset_id] = score
+                bisect.insort(self._ranking, (-score, asset_id))
+
+    def upsert_vulnerability(self, vulnerability: Dict[str, Any]):
+        """漏洞新增或更新后，重算受影响资产的风险分"""
+        with self._lock:
+            self._rescore(self._apply_vulnerability(vulnerability))
+
+    def remove_vulnerability(self, vuln_id: int):
+        """漏洞删除后，重算受影响资产的风险分"""
+        with self._lock:
+            self._rescore(self._detach_vulnerability(vuln_id))
+
+    def upsert_asset(self, asset: Dict[str, Any]):
+        """资产新增或更新后，重算该资产的风险分"""
+        with self._lock:
+            self._assets[asset["id"]] = self._snapshot_asset(asset)
+            self._rescore([asset["id"]])
+
+    def remove_asset(self, asset_id: int):
+        """资产删除后，从排名中移除"""
+        with self._lock:
+            self._assets.pop(asset_id, None)
+            self._rescore([asset_id])
+
+    def top(self, k: int) -> List[Dict[str, Any]]:
+        """返回风险分最高的K个资产"""
+        with self._lock:
+            ranking = self._ranking[:k]
+            results = []
+            for neg_score, asset_id in ranking:
+                asset = self._assets[asset_id]
+                linked = self._asset_vulnerabilities.get(asset_id, {})
+                results.append({
+                    "asset_id": asset_id,
+                    "name": asset["name"],
+                    "risk_score": -neg_score,
+                    "importance_level": asset["importance_level"],
+                    "network_type": asset["network_type"],
+                    "exposure": asset["exposure"],
+                    "open_vulnerabilities": len(linked),
+                    "max_vulnerability_score": max(linked.values()) if linked else None
+                })
+            return results
+
+    def get_score(self, asset_id: int) -> Optional[float]:
+        """获取单个资产的风险分"""
+        return self._scores.get(asset_id)
+
+# 创建全局实例
+asset_risk_index = AssetRiskIndex()
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+from app.core.config import settings
+from app.services.chart_spec import execute_spec, spec_hash
+from app.services.data_version import data_version
+from app.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+class ChartResultCache:
+    """图表查询规格的执行结果缓存
+
+    结果按(规格哈希, 数据源版本)缓存。数据增删改后版本号递增，旧结果不再命中，
+    按LRU淘汰。相同规格的并发计算只执行一次，计算在线程池中进行，不阻塞事件循环。
+    """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        # (规格哈希, 数据版本) -> 图表数据
+        self._results: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evicted": 0
+        }
+
+    async def evaluate(self, spec: Dict[str, Any], records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """获取规格在当前数据上的执行结果，spec为validate_spec规范化后的规格"""
+        # 先读取版本再计算：计算期间数据变化时结果记在旧版本下，下次请求会重新计算
+        key = f"{spec_hash(spec)}:{data_version.get(spec['source'])}"
+        with self._lock:
+            rows = self._results.get(key)
+            if rows is not None:
+                self._results.move_to_end(key)
+                self._stats["hits"] += 1
+                return rows
+            self._stats["misses"] += 1
+
+        rows = await self._single_flight.do(key, lambda: asyncio.to_thread(execute_spec, spec, records))
+        with self._lock:
+            self._results[key] = rows
+            self._results.move_to_end(key)
+            while len(self._results) > self._max_entries:
+                self._results.popitem(last=False)
+                self._stats["evicted"] += 1
+        return rows
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取图表结果缓存指标"""
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._results),
+                "max_entries": self._max_entries
+            }
+
+# 创建全局实例
+chart_result_cache = ChartResultCache(max_entries=settings.DASHBOARD_CHART_CACHE_MAX_ENTRIES)
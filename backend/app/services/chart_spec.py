@@ -0,0 +1,349 @@
+import datetime
+import hashlib
+import json
+import logging
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.services.vulnerability_query import check_logical_node, vulnerability_query_engine
+
+logger = logging.getLogger(__name__)
+
+def _asset_names(record: Dict[str, Any]) -> List[Any]:
+    return [asset.get("name") or asset.get("id") for asset in record.get("affected_assets") or []]
+
+def _vulnerability_total(record: Dict[str, Any]) -> Optional[float]:
+    counts = record.get("vulnerabilities_summary")
+    if not isinstance(counts, dict):
+        return None
+    return sum(count for count in counts.values() if isinstance(count, (int, float)))
+
+def _open_ports(record: Dict[str, Any]) -> int:
+    return sum(1 for port in record.get("ports") or [] if port.get("status", "open") == "open")
+
+# 各数据源可分组的字段；取值为函数时表示派生字段，返回值为列表时一条记录计入多个分组
+GROUP_FIELDS: Dict[str, Dict[str, Optional[Callable[[Dict[str, Any]], Any]]]] = {
+    "vulnerabilities": {
+        "risk_level": None, "status": None, "vulnerability_type": None, "priority": None,
+        "department": None, "responsible_person": None, "affected_asset": _asset_names
+    },
+    "assets": {
+        "type": None, "department": None, "asset_group": None, "network_type": None,
+        "importance_level": None, "business_system": None, "exposure": None,
+        "responsible_person": None, "source": None
+    }
+}
+# 可按时间分桶分组的字段，写作 "字段:粒度"
+DATE_FIELDS = {
+    "vulnerabilities": ("discovery_date", "first_found_date", "latest_found_date"),
+    "assets": ("discovery_date", "update_date")
+}
+DATE_GRANULARITIES = ("day", "week", "month", "year")
+# 各数据源可聚合的数值字段
+MEASURE_FIELDS: Dict[str, Dict[str, Optional[Callable[[Dict[str, Any]], Any]]]] = {
+    "vulnerabilities": {"cvss_score": None, "vpr_score": None, "fix_time_hours": None},
+    "assets": {"vulnerability_count": _vulnerability_total, "open_ports": _open_ports}
+}
+MEASURE_OPS = ("count", "sum", "avg", "min", "max")
+CHART_TYPES = ("bar", "line", "pie")
+FILTER_OPS = ("eq", "ne", "in", "not_in", "gt", "gte", "lt", "lte", "contains", "exists")
+MAX_GROUP_BY = 2
+MAX_ROWS = 100
+UNKNOWN_LABEL = "未知"
+
+def normalize_description(description: str) -> str:
+    """规范化图表描述，用作规划结果的缓存键：去除首尾空白和结尾标点，合并空白，英文转小写"""
+    text = re.sub(r"\s+", " ", description or "").strip().lower()
+    return text.rstrip("。.!！?？ ")
+
+def spec_hash(spec: Dict[str, Any]) -> str:
+    """计算图表规格的规范化哈希"""
+    canonical = json.dumps(spec, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _validate_filter(node: Any, source: str):
+    if not isinstance(node, dict):
+        raise ValueError(f"筛选条件节点必须是对象: {node!r}")
+    check_logical_node(node)
+    for key in ("and", "or"):
+        if key in node:
+            if not isinstance(node[key], list) or not node[key]:
+                raise ValueError(f"'{key}' 节点必须是非空数组")
+            for child in node[key]:
+                _validate_filter(child, source)
+            return
+    if "not" in node:
+        _validate_filter(node["not"], source)
+        return
+    if node.get("op", "eq") not in FILTER_OPS:
+        raise ValueError(f"不支持的筛选操作符: {node.get('op')}")
+    if not node.get("field"):
+        raise ValueError(f"筛选条件缺少字段: {node!r}")
+
+def validate_spec(raw: Any) -> Dict[str, Any]:
+    """校验并规范化图表规格，不合法时抛出ValueError
+
+    规格格式:
+    {"source": "vulnerabilities" | "assets", "chart_type": "bar" | "line" | "pie",
+     "group_by": ["risk_level", "discovery_date:month"], "measures": [{"op": "count"}, {"op": "avg", "field": "cvss_score"}],
+     "filter": 与 /vulnerabilities/query 相同的表达式, "sort": "value" | "key", "limit": 10,
+     "title": "...", "description": "...", "category": "..."}
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("图表规格必须是JSON对象")
+    source = raw.get("source", "vulnerabilities")
+    if source not in GROUP_FIELDS:
+        raise ValueError(f"不支持的数据源: {source}，可选值: {', '.join(GROUP_FIELDS)}")
+
+    chart_type = raw.get("chart_type", "bar")
+    if chart_type not in CHART_TYPES:
+        logger.warning(f"不支持的图表类型 {chart_type}，使用柱状图")
+        chart_type = "bar"
+
+    group_by = raw.get("group_by") or []
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    if not isinstance(group_by, list) or not 1 <= len(group_by) <= MAX_GROUP_BY:
+        raise ValueError(f"group_by必须包含1到{MAX_GROUP_BY}个字段")
+    for field in group_by:
+        name, _, granularity = str(field).partition(":")
+        if name in DATE_FIELDS[source]:
+            if (granularity or "month") not in DATE_GRANULARITIES:
+                raise ValueError(f"不支持的时间粒度: {granularity}，可选值: {', '.join(DATE_GRANULARITIES)}")
+        elif name not in GROUP_FIELDS[source] or granularity:
+            raise ValueError(f"数据源 {source} 不支持按 {field} 分组")
+
+    measures = raw.get("measures") or [{"op": "count"}]
+    if not isinstance(measures, list):
+        raise ValueError("measures必须是数组")
+    normalized_measures = []
+    for measure in measures:
+        if isinstance(measure, str):
+            measure = {"op": measure}
+        if not isinstance(measure, dict):
+            raise ValueError(f"聚合项必须是对象: {measure!r}")
+        op = measure.get("op", "count")
+        if op not in MEASURE_OPS:
+            raise ValueError(f"不支持的聚合方式: {op}，可选值: {', '.join(MEASURE_OPS)}")
+        if op == "count":
+            normalized_measures.append({"op": "count"})
+            continue
+        field = measure.get("field")
+        if field not in MEASURE_FIELDS[source]:
+            raise ValueError(f"数据源 {source} 不支持聚合字段: {field}")
+        normalized_measures.append({"op": op, "field": field})
+
+    filter_expression = raw.get("filter") or None
+    if filter_expression is not None:
+        _validate_filter(filter_expression, source)
+
+    sort = raw.get("sort") or ("key" if str(group_by[0]).split(":")[0] in DATE_FIELDS[source] else "value")
+    if sort not in ("value", "key"):
+        raise ValueError("sort只能是value或key")
+    limit = raw.get("limit")
+    if limit is not None:
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit <= 0:
+            raise ValueError("limit必须是正整数")
+        limit = min(limit, MAX_ROWS)
+
+    return {
+        "source": source,
+        "chart_type": chart_type,
+        "group_by": [str(field) for field in group_by],
+        "measures": normalized_measures,
+        "filter": filter_expression,
+        "sort": sort,
+        "limit": limit,
+        "title": str(raw.get("title") or ""),
+        "description": str(raw.get("description") or ""),
+        "category": str(raw.get("category") or "")
+    }
+
+def measure_name(measure: Dict[str, Any]) -> str:
+    """聚合结果在数据行中的列名"""
+    return "count" if measure["op"] == "count" else f"{measure['op']}_{measure['field']}"
+
+def _date_key(value: Any, granularity: str) -> Optional[str]:
+    if not isinstance(value, str) or len(value) < 10:
+        return None
+    if granularity == "year":
+        return value[:4]
+    if granularity == "month":
+        return value[:7]
+    if granularity == "day":
+        return value[:10]
+    try:
+        day = datetime.date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+def _group_accessor(source: str, field: str) -> Callable[[Dict[str, Any]], List[Any]]:
+    name, _, granularity = field.partition(":")
+    if name in DATE_FIELDS[source]:
+        granularity = granularity or "month"
+        return lambda record: [_date_key(record.get(name), granularity)]
+    derived = GROUP_FIELDS[source][name]
+    if derived is not None:
+        return lambda record: derived(record) or [None]
+    return lambda record: [record.get(name)]
+
+def _measure_accessor(source: str, field: str) -> Callable[[Dict[str, Any]], Any]:
+    derived = MEASURE_FIELDS[source][field]
+    return derived if derived is not None else (lambda record: record.get(field))
+
+def _scan_predicate(node: Dict[str, Any]) -> Callable[[Dict[str, Any]], bool]:
+    """资产数据没有索引，按表达式逐条匹配"""
+    if "and" in node:
+        children = [_scan_predicate(child) for child in node["and"]]
+        return lambda record: all(child(record) for child in children)
+    if "or" in node:
+        children = [_scan_predicate(child) for child in node["or"]]
+        return lambda record: any(child(record) for child in children)
+    if "not" in node:
+        child = _scan_predicate(node["not"])
+        return lambda record: not child(record)
+
+    field, op, value = node["field"], node.get("op", "eq"), node.get("value")
+
+    def predicate(record):
+        actual = record.get(field)
+        if op == "eq":
+            return actual == value
+        if op == "ne":
+            return actual != value
+        if op == "in":
+            return actual in (value or [])
+        if op == "not_in":
+            return actual not in (value or [])
+        if op == "contains":
+            return actual is not None and str(value).lower() in str(actual).lower()
+        if op == "exists":
+            return (actual not in (None, "")) == (bool(value) if value is not None else True)
+        if actual is None:
+            return False
+        try:
+            return {"gt": actual > value, "gte": actual >= value, "lt": actual < value, "lte": actual <= value}[op]
+        except TypeError:
+            return False
+    return predicate
+
+def filter_records(spec: Dict[str, Any], records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """按规格中的筛选条件过滤记录；漏洞数据使用带索引的查询引擎，records应为完整的漏洞列表以复用索引"""
+    if not spec["filter"]:
+        return records
+    if spec["source"] == "vulnerabilities":
+        matched, _ = vulnerability_query_engine.execute(spec["filter"], records)
+        return matched
+    predicate = _scan_predicate(spec["filter"])
+    return [record for record in records if predicate(record)]
+
+def execute_spec(spec: Dict[str, Any], records: List[Dict[str, Any]],
+                 allowed_ids: Optional[set] = None) -> List[Dict[str, Any]]:
+    """在本地执行图表规格：筛选、限定在allowed_ids范围内（为空时不限定）后聚合"""
+    matched = filter_records(spec, records)
+    if allowed_ids is not None:
+        matched = [record for record in matched if record.get("id") in allowed_ids]
+    return aggregate(spec, matched)
+
+def aggregate(spec: Dict[str, Any], records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """按规格聚合记录，返回每个分组一行的数据，列为分组字段和各聚合结果
+
+    两个分组字段的柱状图和折线图按第二个字段展开为列，每个取值对应一个系列。
+    """
+    source = spec["source"]
+    group_fields = [field.partition(":")[0] for field in spec["group_by"]]
+    accessors = [_group_accessor(source, field) for field in spec["group_by"]]
+    measures = spec["measures"]
+    measure_accessors = [
+        None if measure["op"] == "count" else _measure_accessor(source, measure["field"]) for measure in measures
+    ]
+
+    # 分组键 -> 每个聚合的 [计数, 合计, 最小值, 最大值]
+    groups: "OrderedDict[Tuple[Any, ...], List[List[Any]]]" = OrderedDict()
+    for record in records:
+        keys: List[Tuple[Any, ...]] = [()]
+        for accessor in accessors:
+            keys = [key + (value if value is not None else UNKNOWN_LABEL,) for key in keys for value in accessor(record)]
+        values = [None if accessor is None else accessor(record) for accessor in measure_accessors]
+        for key in keys:
+            states = groups.get(key)
+            if states is None:
+                states = groups[key] = [[0, 0.0, None, None] for _ in measures]
+            for accessor, state, value in zip(measure_accessors, states, values):
+                if value is None and accessor is not None:
+                    continue
+                state[0] += 1
+                if isinstance(value, (int, float)):
+                    state[1] += value
+                    state[2] = value if state[2] is None else min(state[2], value)
+                    state[3] = value if state[3] is None else max(state[3], value)
+
+    rows = []
+    for key, states in groups.items():
+        row = dict(zip(group_fields, key))
+        for measure, (count, total, minimum, maximum) in zip(measures, states):
+            op = measure["op"]
+            if op == "count":
+                value = count
+            elif op == "sum":
+                value = round(total, 2)
+            elif op == "avg":
+                value = round(total / count, 2) if count else None
+            else:
+                value = minimum if op == "min" else maximum
+            row[measure_name(measure)] = value
+        rows.append(row)
+
+    first_measure = measure_name(measures[0])
+    if spec["sort"] == "key":
+        rows.sort(key=lambda row: tuple(str(row[field]) for field in group_fields))
+    else:
+        rows.sort(key=lambda row: row[first_measure] if row[first_measure] is not None else float("-inf"), reverse=True)
+
+    if len(group_fields) == 2 and spec["chart_type"] != "pie":
+        rows = _pivot(rows, group_fields, first_measure)
+    if spec["limit"]:
+        rows = rows[:spec["limit"]]
+    return rows
+
+def _pivot(rows: List[Dict[str, Any]], group_fields: List[str], measure: str) -> List[Dict[str, Any]]:
+    x_field, series_field = group_fields
+    pivoted: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+    series_values = list(dict.fromkeys(str(row[series_field]) for row in rows))
+    for row in rows:
+        target = pivoted.get(row[x_field])
+        if target is None:
+            target = pivoted[row[x_field]] = {x_field: row[x_field], **{value: 0 for value in series_values}}
+        target[str(row[series_field])] = row[measure]
+    return list(pivoted.values())
+
+def build_chart_config(spec: Dict[str, Any], rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """根据规格生成ECharts配置，数据通过dataset提供（前端将data作为dataset.source）"""
+    x_field = spec["group_by"][0].partition(":")[0]
+    config: Dict[str, Any] = {
+        "title": {"text": spec["title"], "left": "center"},
+        "tooltip": {"trigger": "item" if spec["chart_type"] == "pie" else "axis"},
+        "legend": {"bottom": 0}
+    }
+    if spec["chart_type"] == "pie":
+        config["series"] = [{
+            "type": "pie",
+            "radius": "60%",
+            "encode": {"itemName": x_field, "value": measure_name(spec["measures"][0])}
+        }]
+        return config
+
+    if len(spec["group_by"]) == 2:
+        columns = [key for key in (rows[0] if rows else {}) if key != x_field]
+    else:
+        columns = [measure_name(measure) for measure in spec["measures"]]
+    config["xAxis"] = {"type": "category"}
+    config["yAxis"] = {"type": "value"}
+    config["series"] = [
+        {"type": spec["chart_type"], "name": column, "encode": {"x": x_field, "y": column}}
+        for column in columns
+    ]
+    return config
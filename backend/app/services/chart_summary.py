@@ -0,0 +1,183 @@
+import datetime
+import json
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 漏洞和资产按类别计数的字段
+VULNERABILITY_CATEGORY_FIELDS = (
+    "risk_level", "status", "vulnerability_type", "priority", "department", "responsible_person"
+)
+ASSET_CATEGORY_FIELDS = (
+    "type", "department", "asset_group", "network_type", "importance_level",
+    "business_system", "exposure", "responsible_person", "source"
+)
+# 分区间统计的评分字段，区间宽度为1分
+SCORE_FIELDS = ("cvss_score", "vpr_score")
+# 修复时长的区间边界（小时）
+FIX_TIME_BUCKETS = (24, 72, 168, 720)
+# 每个类别最多保留的取值数，其余合并为"其他"
+MAX_CATEGORIES = 15
+OTHER_LABEL = "其他"
+UNKNOWN_LABEL = "未知"
+_ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+def _top_counts(counter: Counter, limit: int = MAX_CATEGORIES) -> Dict[str, int]:
+    """按计数倒序保留前limit个取值，其余合并为"其他" """
+    items = counter.most_common()
+    result = {str(value): count for value, count in items[:limit]}
+    rest = sum(count for _, count in items[limit:])
+    if rest:
+        result[OTHER_LABEL] = result.get(OTHER_LABEL, 0) + rest
+    return result
+
+def _category_counts(records: List[Dict[str, Any]], fields: Iterable[str]) -> Dict[str, Dict[str, int]]:
+    counts = {}
+    for field in fields:
+        counter = Counter(record.get(field) or UNKNOWN_LABEL for record in records)
+        if len(counter) > 1 or UNKNOWN_LABEL not in counter:
+            counts[field] = _top_counts(counter)
+    return counts
+
+def _score_histogram(records: List[Dict[str, Any]], field: str) -> Optional[Dict[str, Any]]:
+    scores = []
+    for record in records:
+        value = record.get(field)
+        if isinstance(value, (int, float)):
+            scores.append(float(value))
+    if not scores:
+        return None
+    bins = Counter(min(int(score), 9) for score in scores)
+    return {
+        "min": round(min(scores), 2),
+        "max": round(max(scores), 2),
+        "avg": round(sum(scores) / len(scores), 2),
+        "missing": len(records) - len(scores),
+        "bins": {f"{low}-{low + 1}": bins[low] for low in range(10) if bins[low]}
+    }
+
+def _fix_time_buckets(records: List[Dict[str, Any]]) -> Dict[str, int]:
+    counter = Counter()
+    for record in records:
+        hours = record.get("fix_time_hours")
+        if not isinstance(hours, (int, float)):
+            continue
+        for bound in FIX_TIME_BUCKETS:
+            if hours <= bound:
+                counter[f"<={bound}h"] += 1
+                break
+        else:
+            counter[f">{FIX_TIME_BUCKETS[-1]}h"] += 1
+    return dict(counter)
+
+def time_buckets(records: List[Dict[str, Any]], field: str) -> Optional[Dict[str, Any]]:
+    """按时间字段分桶计数，跨度不超过62天按天、不超过2年按月，否则按年
+
+    时间字段为ISO格式字符串，直接取日期前缀分桶，不逐条解析。
+    """
+    days = Counter()
+    for record in records:
+        value = record.get(field)
+        if isinstance(value, str) and _ISO_DATE.match(value):
+            days[value[:10]] += 1
+    if not days:
+        return None
+    span = datetime.date.fromisoformat(max(days)) - datetime.date.fromisoformat(min(days))
+    if span <= datetime.timedelta(days=62):
+        granularity, width = "day", 10
+    elif span <= datetime.timedelta(days=731):
+        granularity, width = "month", 7
+    else:
+        granularity, width = "year", 4
+    buckets = Counter()
+    for day, count in days.items():
+        buckets[day[:width]] += count
+    return {"granularity": granularity, "buckets": dict(sorted(buckets.items()))}
+
+def summarize_vulnerabilities(vulnerabilities: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """汇总漏洞数据：分类计数、评分分布、修复时长分布、发现时间分布和受影响最多的资产"""
+    summary: Dict[str, Any] = {
+        "total": len(vulnerabilities),
+        "by": _category_counts(vulnerabilities, VULNERABILITY_CATEGORY_FIELDS)
+    }
+    scores = {field: _score_histogram(vulnerabilities, field) for field in SCORE_FIELDS}
+    summary["scores"] = {field: histogram for field, histogram in scores.items() if histogram}
+    fix_time = _fix_time_buckets(vulnerabilities)
+    if fix_time:
+        summary["fix_time_hours"] = fix_time
+    discovered = time_buckets(vulnerabilities, "discovery_date")
+    if discovered:
+        summary["discovery_date"] = discovered
+    affected = Counter(
+        asset.get("name") or asset.get("id")
+        for vulnerability in vulnerabilities
+        for asset in vulnerability.get("affected_assets") or []
+    )
+    if affected:
+        summary["top_affected_assets"] = _top_counts(affected, limit=10)
+    # 风险等级与漏洞类型的交叉计数，用于堆叠图等多维图表
+    cross = Counter(
+        (v.get("risk_level") or UNKNOWN_LABEL, v.get("vulnerability_type") or UNKNOWN_LABEL)
+        for v in vulnerabilities
+    )
+    if cross:
+        summary["risk_level_by_type"] = [
+            {"risk_level": risk_level, "vulnerability_type": vuln_type, "count": count}
+            for (risk_level, vuln_type), count in cross.most_common(MAX_CATEGORIES * 2)
+        ]
+    return summary
+
+def summarize_assets(assets: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """汇总资产数据：分类计数、各风险等级漏洞数、开放服务和组件分布"""
+    summary: Dict[str, Any] = {
+        "total": len(assets),
+        "by": _category_counts(assets, ASSET_CATEGORY_FIELDS)
+    }
+    vulnerability_counts = Counter()
+    services = Counter()
+    components = Counter()
+    for asset in assets:
+        for level, count in (asset.get("vulnerabilities_summary") or {}).items():
+            if isinstance(count, (int, float)):
+                vulnerability_counts[level] += count
+        for port in asset.get("ports") or []:
+            if port.get("status", "open") == "open":
+                services[port.get("service") or str(port.get("port"))] += 1
+        for component in asset.get("components") or []:
+            if component.get("name"):
+                components[component["name"]] += 1
+    if vulnerability_counts:
+        summary["vulnerabilities_by_risk_level"] = dict(vulnerability_counts)
+    if services:
+        summary["open_services"] = _top_counts(services)
+    if components:
+        summary["components"] = _top_counts(components)
+    discovered = time_buckets(assets, "discovery_date")
+    if discovered:
+        summary["discovery_date"] = discovered
+    return summary
+
+def apply_filter_conditions(records: List[Dict[str, Any]],
+                            conditions: Optional[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """按等值条件筛选记录，条件值为列表时匹配其中任意一个；只应用记录中存在的字段
+
+    返回筛选后的记录和实际应用的字段名。
+    """
+    if not conditions or not records:
+        return records, []
+    fields = set()
+    for record in records:
+        fields.update(record.keys())
+    applied = [field for field in conditions if field in fields]
+    for field in applied:
+        expected = conditions[field]
+        if isinstance(expected, (list, tuple, set)):
+            allowed = set(expected)
+            records = [record for record in records if record.get(field) in allowed]
+        else:
+            records = [record for record in records if record.get(field) == expected]
+    return records, applied
+
+def compact_json(value: Any) -> str:
+    """紧凑的JSON文本，用于放入提示词"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
@@ -0,0 +1,175 @@
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from app.exceptions.dify_error import DifyCircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+class BreakerCall:
+    """一次受熔断器保护的上游调用
+
+    响应头到达时记录状态码和首包耗时，调用结束时由调用方统一上报结果。
+    """
+
+    def __init__(self, breaker: "CircuitBreaker", probe: bool):
+        self._breaker = breaker
+        self.probe = probe
+        self._request_started: Optional[float] = None
+        self.status: Optional[int] = None
+        self.latency: Optional[float] = None
+        self._finished = False
+
+    def request_started(self):
+        self._request_started = time.monotonic()
+
+    def response_received(self, status: int):
+        self.status = status
+        if self._request_started is not None:
+            self.latency = time.monotonic() - self._request_started
+
+    def finish(self, upstream_error: bool):
+        """上报调用结果：上游异常或5xx计为失败，未发出请求的调用只释放探测名额"""
+        if self._finished:
+            return
+        self._finished = True
+        if upstream_error:
+            self._breaker._record(self, failed=True, slow=False)
+        elif self.status is not None:
+            slow = self.latency is not None and self.latency >= self._breaker.slow_call_seconds
+            self._breaker._record(self, failed=self.status >= 500, slow=slow)
+        else:
+            self._breaker._release(self)
+
+class CircuitBreaker:
+    """上游调用熔断器
+
+    关闭状态下统计最近N次调用的失败率和慢调用率，任一超过阈值即打开；
+    打开期间直接拒绝请求，冷却时间过后进入半开状态，放行少量探测请求，
+    探测全部成功则关闭，任一失败或过慢则重新打开。
+    """
+
+    def __init__(self, name: str, window_size: int, min_calls: int, failure_rate_threshold: float,
+                 slow_call_seconds: float, slow_rate_threshold: float, open_seconds: float,
+                 half_open_max_calls: int):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self._min_calls = min_calls
+        self._failure_rate_threshold = failure_rate_threshold
+        self._slow_rate_threshold = slow_rate_threshold
+        self._open_seconds = open_seconds
+        self._half_open_max_calls = half_open_max_calls
+        # 最近调用结果: (是否失败, 是否慢调用)
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        self._stats = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self._open_seconds:
+            self._state = STATE_HALF_OPEN
+            self._half_open_in_flight = 0
+            self._half_open_successes = 0
+            logger.info(f"熔断器进入半开状态，开始探测上游 - {self.name}")
+        return self._state
+
+    def allows_request(self) -> bool:
+        """判断当前是否放行新请求（不占用探测名额）"""
+        state = self.state
+        if state == STATE_OPEN:
+            return False
+        if state == STATE_HALF_OPEN:
+            return self._half_open_in_flight < self._half_open_max_calls
+        return True
+
+    def retry_after(self) -> int:
+        """距离下次允许探测的秒数"""
+        if self._state != STATE_OPEN:
+            return 1
+        remaining = self._open_seconds - (time.monotonic() - self._opened_at)
+        return max(1, math.ceil(remaining))
+
+    def begin(self) -> BreakerCall:
+        """开始一次调用，熔断打开或探测名额已满时抛出DifyCircuitOpenError"""
+        state = self.state
+        if state == STATE_CLOSED:
+            return BreakerCall(self, probe=False)
+        if state == STATE_HALF_OPEN and self._half_open_in_flight < self._half_open_max_calls:
+            self._half_open_in_flight += 1
+            return BreakerCall(self, probe=True)
+        self._stats["rejected"] += 1
+        raise DifyCircuitOpenError(
+            f"AI服务暂时不可用（熔断中），请{self.retry_after()}秒后重试", retry_after=self.retry_after()
+        )
+
+    def _release(self, call: BreakerCall):
+        if call.probe and self._state == STATE_HALF_OPEN:
+            self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+
+    def _record(self, call: BreakerCall, failed: bool, slow: bool):
+        self._stats["calls"] += 1
+        self._stats["failures"] += int(failed)
+        self._stats["slow_calls"] += int(slow)
+
+        if self._state == STATE_HALF_OPEN:
+            self._release(call)
+            if failed or slow:
+                self._open("探测请求失败" if failed else "探测请求过慢")
+            elif call.probe:
+                self._half_open_successes += 1
+                if self._half_open_successes >= self._half_open_max_calls:
+                    self._close()
+            return
+        if self._state == STATE_OPEN:
+            # 熔断打开前已发出的请求，结果不再计入
+            return
+
+        self._outcomes.append((failed, slow))
+        if len(self._outcomes) < self._min_calls:
+            return
+        failure_rate, slow_rate = self._rates()
+        if failure_rate >= self._failure_rate_threshold:
+            self._open(f"失败率 {failure_rate:.0%}")
+        elif slow_rate >= self._slow_rate_threshold:
+            self._open(f"慢调用率 {slow_rate:.0%}")
+
+    def _rates(self) -> Tuple[float, float]:
+        total = len(self._outcomes)
+        if not total:
+            return 0.0, 0.0
+        failures = sum(1 for failed, _ in self._outcomes if failed)
+        slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+        return failures / total, slow / total
+
+    def _open(self, reason: str):
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._stats["opened"] += 1
+        self._outcomes.clear()
+        logger.warning(f"熔断器打开 - {self.name}, 原因: {reason}, 冷却时间: {self._open_seconds}秒")
+
+    def _close(self):
+        self._state = STATE_CLOSED
+        self._outcomes.clear()
+        logger.info(f"探测成功，熔断器关闭 - {self.name}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取熔断器指标"""
+        failure_rate, slow_rate = self._rates()
+        return {
+            "state": self.state,
+            "window_calls": len(self._outcomes),
+            "failure_rate": round(failure_rate, 4),
+            "slow_rate": round(slow_rate, 4),
+            "retry_after": self.retry_after() if self._state == STATE_OPEN else 0,
+            **self._stats
+        }
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.services.conversation_store import conversation_store, parse_timestamp
+from app.services.dify_service import dify_service
+from app.services.session_cache import session_cache
+from app.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 每次同步请求的条数（Dify允许的最大值）和单次同步最多拉取的页数
+SYNC_PAGE_SIZE = 100
+SYNC_MAX_PAGES = 50
+
+class ConversationHistory:
+    """会话历史记录服务
+
+    历史记录接口只读本地会话存储。首次访问某个用户的会话列表或某个会话的消息时
+    同步后再返回；之后距上次同步超过DIFY_HISTORY_SYNC_INTERVAL秒时在后台增量同步，
+    当次请求直接返回本地数据。同步按Dify的分页从最新数据开始拉取，遇到本地已有的
+    数据即停止；相同的同步同时只执行一次。
+    """
+
+    def __init__(self, sync_interval: float):
+        self._sync_interval = sync_interval
+        self._single_flight = SingleFlight()
+        self._background_tasks: Set[asyncio.Task] = set()
+        self._stats = {
+            "local_reads": 0,
+            "blocking_syncs": 0,
+            "background_syncs": 0,
+            "sync_failures": 0,
+            "pages_fetched": 0,
+            "conversations_synced": 0,
+            "messages_synced": 0
+        }
+
+    async def _sync_conversations(self, user_id: str):
+        state = await conversation_store.get_sync_state(user_id)
+        known_until = state["latest_updated_at"] if state else 0.0
+        latest = known_until
+        last_id = None
+        for _ in range(SYNC_MAX_PAGES):
+            page = await dify_service.fetch_conversations(user_id, last_id, SYNC_PAGE_SIZE)
+            self._stats["pages_fetched"] += 1
+            items = page["data"]
+            if items:
+                await conversation_store.upsert_conversations(user_id, items)
+                self._stats["conversations_synced"] += len(items)
+                latest = max(latest, max(parse_timestamp(item.get("updated_at")) for item in items))
+            # 列表按更新时间倒序，出现上次已同步的更新时间说明后面都没有变化
+            if not page["has_more"] or not items or parse_timestamp(items[-1].get("updated_at")) <= known_until:
+                break
+            last_id = items[-1]["id"]
+        await conversation_store.set_sync_state(user_id, latest)
+
+    async def _sync_messages(self, conversation_id: str, user_id: str):
+        conversation = await conversation_store.get_conversation(conversation_id)
+        history_complete = bool(conversation and conversation["history_complete"])
+        complete = False
+        first_id = None
+        for _ in range(SYNC_MAX_PAGES):
+            page = await dify_service.fetch_messages(conversation_id, user_id, first_id, SYNC_PAGE_SIZE)
+            self._stats["pages_fetched"] += 1
+            items = page["data"]
+            if not items:
+                complete = True
+                break
+            known = await conversation_store.existing_message_ids([item["id"] for item in items])
+            new_items = [item for item in items if item["id"] not in known]
+            if new_items:
+                for item in new_items:
+                    item.setdefault("conversation_id", conversation_id)
+                await conversation_store.upsert_messages(new_items)
+                self._stats["messages_synced"] += len(new_items)
+            if not page["has_more"]:
+                complete = True
+                break
+            # 已有完整历史时，遇到本地已有的消息说明更早的部分都已同步
+            if known and history_complete:
+                complete = True
+                break
+            first_id = items[0]["id"]
+        if conversation is None:
+            await conversation_store.upsert_conversations(user_id, [{"id": conversation_id}])
+        await conversation_store.mark_messages_synced(conversation_id, complete)
+
+    async def _run_sync(self, key: str, synced_at: Optional[float], factory):
+        """按同步时间决定同步方式：从未同步时等待同步完成，已过期时在后台同步"""
+        if synced_at is not None and time.time() - synced_at < self._sync_interval:
+            return
+        if synced_at is None:
+            self._stats["blocking_syncs"] += 1
+            try:
+                await self._single_flight.do(key, factory)
+            except Exception as e:
+                self._stats["sync_failures"] += 1
+                logger.error(f"同步会话历史失败，使用本地数据 - {key}: {str(e)}")
+            return
+
+        async def background():
+            try:
+                await self._single_flight.do(key, factory)
+            except Exception as e:
+                self._stats["sync_failures"] += 1
+                logger.error(f"后台同步会话历史失败 - {key}: {str(e)}")
+
+        self._stats["background_syncs"] += 1
+        task = asyncio.create_task(background())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def list_conversations(self, user_id: str, limit: int,
+                                 cursor: Optional[str]) -> Tuple[list, Optional[str]]:
+        """列出用户的会话；翻页请求不触发同步"""
+        if not cursor:
+            state = await conversation_store.get_sync_state(user_id)
+            await self._run_sync(f"conversations:{user_id}", state["synced_at"] if state else None,
+                                 lambda: self._sync_conversations(user_id))
+        self._stats["local_reads"] += 1
+        return await conversation_store.list_conversations(user_id, limit, cursor)
+
+    async def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """获取本地的会话详情"""
+        self._stats["local_reads"] += 1
+        return await conversation_store.get_conversation(conversation_id)
+
+    async def list_messages(self, conversation_id: str, user_id: Optional[str], limit: Optional[int],
+                            cursor: Optional[str]) -> Tuple[list, Optional[str]]:
+        """列出会话消息，limit为None时返回全部；翻页请求不触发同步"""
+        conversation = await conversation_store.get_conversation(conversation_id)
+        # Dify按用户隔离会话，查询消息需要会话所属的用户
+        if not user_id:
+            user_id = conversation["user_id"] if conversation else await session_cache.get(conversation_id)
+        if user_id and not cursor:
+            await self._run_sync(f"messages:{conversation_id}",
+                                 conversation["messages_synced_at"] if conversation else None,
+                                 lambda: self._sync_messages(conversation_id, user_id))
+        self._stats["local_reads"] += 1
+        return await conversation_store.list_messages(conversation_id, limit, cursor)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取会话历史同步指标"""
+        return {
+            **self._stats,
+            "sync_interval": self._sync_interval,
+            "syncs_in_flight": self._single_flight.get_metrics()["calls_in_flight"]
+        }
+
+# 创建全局实例
+conversation_history = ConversationHistory(sync_interval=settings.DIFY_HISTORY_SYNC_INTERVAL)
@@ -0,0 +1,268 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+def encode_cursor(timestamp: float, item_id: str) -> str:
+    """将排序位置编码为不透明的分页游标"""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, item_id]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """解析分页游标，格式不正确时抛出ValueError"""
+    try:
+        timestamp, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(timestamp), str(item_id)
+    except Exception:
+        raise ValueError(f"无效的分页游标: {cursor}")
+
+def parse_timestamp(value: Any) -> float:
+    """Dify返回的时间为秒级时间戳，缺失时使用当前时间"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return time.time()
+
+class ConversationStore:
+    """Dify会话和消息的本地副本
+
+    会话元数据和消息保存在SQLite中，由代理的聊天流写入，并定期从Dify增量同步；
+    历史记录接口直接从本地读取，按游标分页。未配置数据库路径时使用内存数据库。
+    """
+
+    def __init__(self, db_path: Optional[str]):
+        self._db_path = db_path or ":memory:"
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            if self._db_path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self._db_path)), exist_ok=True)
+            self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            if self._db_path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+            # history_complete: 本地已包含该会话的全部历史消息
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "id TEXT PRIMARY KEY, user_id TEXT, name TEXT, status TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+                "history_complete INTEGER NOT NULL DEFAULT 0, messages_synced_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations (user_id, updated_at)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id TEXT PRIMARY KEY, conversation_id TEXT NOT NULL, query TEXT, answer TEXT, "
+                "created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, created_at)")
+            # 每个用户的会话列表同步状态
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_sync ("
+                "user_id TEXT PRIMARY KEY, synced_at REAL NOT NULL, latest_updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            logger.info(f"会话存储已打开: {self._db_path}")
+        return self._db
+
+    @staticmethod
+    def _row_to_conversation(row: sqlite3.Row) -> Dict[str, Any]:
+        conversation = dict(row)
+        conversation["history_complete"] = bool(conversation["history_complete"])
+        return conversation
+
+    def _record_message(self, conversation_id: str, user_id: str, message: Dict[str, Any], new_conversation: bool):
+        now = time.time()
+        created_at = parse_timestamp(message.get("created_at"))
+        with self._lock:
+            db = self._connect()
+            # 本地看到会话创建时，其全部历史都经过代理，无需再从Dify拉取
+            db.execute(
+                "INSERT INTO conversations (id, user_id, created_at, updated_at, history_complete, messages_synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET updated_at = MAX(updated_at, excluded.updated_at), "
+                "user_id = COALESCE(conversations.user_id, excluded.user_id)",
+                (conversation_id, user_id, created_at, created_at,
+                 1 if new_conversation else 0, now if new_conversation else None)
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO messages (id, conversation_id, query, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+                (message["id"], conversation_id, message.get("query"), message.get("answer"), created_at)
+            )
+            db.commit()
+
+    def _upsert_conversations(self, user_id: str, conversations: Iterable[Dict[str, Any]]):
+        with self._lock:
+            db = self._connect()
+            db.executemany(
+                "INSERT INTO conversations (id, user_id, name, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name, status = excluded.status, "
+                "user_id = excluded.user_id, updated_at = MAX(updated_at, excluded.updated_at)",
+                [
+                    (item["id"], user_id, item.get("name"), item.get("status"),
+                     parse_timestamp(item.get("created_at")), parse_timestamp(item.get("updated_at") or item.get("created_at")))
+                    for item in conversations
+                ]
+            )
+            db.commit()
+
+    def _upsert_messages(self, messages: Iterable[Dict[str, Any]]):
+        with self._lock:
+            db = self._connect()
+            db.executemany(
+                "INSERT OR REPLACE INTO messages (id, conversation_id, query, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (item["id"], item["conversation_id"], item.get("query"), item.get("answer"),
+                     parse_timestamp(item.get("created_at")))
+                    for item in messages
+                ]
+            )
+            db.commit()
+
+    def _existing_message_ids(self, message_ids: List[str]) -> Set[str]:
+        if not message_ids:
+            return set()
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT id FROM messages WHERE id IN ({', '.join('?' for _ in message_ids)})", message_ids
+            ).fetchall()
+        return {row["id"] for row in rows}
+
+    def _get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        return self._row_to_conversation(row) if row else None
+
+    def _list_conversations(self, user_id: Optional[str], limit: int,
+                            cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        query = "SELECT * FROM conversations WHERE 1 = 1"
+        params: List[Any] = []
+        if user_id:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        if cursor:
+            updated_at, conversation_id = decode_cursor(cursor)
+            query += " AND (updated_at < ? OR (updated_at = ? AND id < ?))"
+            params.extend([updated_at, updated_at, conversation_id])
+        query += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        conversations = [self._row_to_conversation(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = conversations[-1]
+            next_cursor = encode_cursor(last["updated_at"], last["id"])
+        return conversations, next_cursor
+
+    def _list_messages(self, conversation_id: str, limit: Optional[int],
+                       cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # 与Dify一致：先返回最新的消息，游标指向更早的消息；每页内按时间正序
+        query = "SELECT * FROM messages WHERE conversation_id = ?"
+        params: List[Any] = [conversation_id]
+        if cursor:
+            created_at, message_id = decode_cursor(cursor)
+            query += " AND (created_at < ? OR (created_at = ? AND id < ?))"
+            params.extend([created_at, created_at, message_id])
+        query += " ORDER BY created_at DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit + 1)
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        messages = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            oldest = messages[-1]
+            next_cursor = encode_cursor(oldest["created_at"], oldest["id"])
+        messages.reverse()
+        return messages, next_cursor
+
+    def _mark_messages_synced(self, conversation_id: str, complete: bool):
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "UPDATE conversations SET messages_synced_at = ?, history_complete = MAX(history_complete, ?) "
+                "WHERE id = ?",
+                (time.time(), 1 if complete else 0, conversation_id)
+            )
+            db.commit()
+
+    def _get_sync_state(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM conversation_sync WHERE user_id = ?", (user_id,)).fetchone()
+        return dict(row) if row else None
+
+    def _set_sync_state(self, user_id: str, latest_updated_at: float):
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "INSERT INTO conversation_sync (user_id, synced_at, latest_updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET synced_at = excluded.synced_at, "
+                "latest_updated_at = MAX(latest_updated_at, excluded.latest_updated_at)",
+                (user_id, time.time(), latest_updated_at)
+            )
+            db.commit()
+
+    async def record_message(self, conversation_id: str, user_id: str, message: Dict[str, Any],
+                             new_conversation: bool = False):
+        """记录经过代理的一轮问答，message包含id、query、answer和created_at"""
+        await asyncio.to_thread(self._record_message, conversation_id, user_id, message, new_conversation)
+
+    async def upsert_conversations(self, user_id: str, conversations: List[Dict[str, Any]]):
+        """写入从Dify同步的会话"""
+        await asyncio.to_thread(self._upsert_conversations, user_id, conversations)
+
+    async def upsert_messages(self, messages: List[Dict[str, Any]]):
+        """写入从Dify同步的消息"""
+        await asyncio.to_thread(self._upsert_messages, messages)
+
+    async def existing_message_ids(self, message_ids: List[str]) -> Set[str]:
+        """返回本地已有的消息ID"""
+        return await asyncio.to_thread(self._existing_message_ids, message_ids)
+
+    async def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """获取会话"""
+        return await asyncio.to_thread(self._get_conversation, conversation_id)
+
+    async def list_conversations(self, user_id: Optional[str] = None, limit: int = 20,
+                                 cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """按更新时间倒序列出会话，返回(会话列表, 下一页游标)"""
+        return await asyncio.to_thread(self._list_conversations, user_id, limit, cursor)
+
+    async def list_messages(self, conversation_id: str, limit: Optional[int] = 20,
+                            cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """列出会话消息，返回(消息列表, 更早一页的游标)；limit为None时返回全部，游标为None"""
+        return await asyncio.to_thread(self._list_messages, conversation_id, limit, cursor)
+
+    async def mark_messages_synced(self, conversation_id: str, complete: bool):
+        """记录会话消息的同步时间，complete表示已同步到最早的消息"""
+        await asyncio.to_thread(self._mark_messages_synced, conversation_id, complete)
+
+    async def get_sync_state(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """获取用户会话列表的同步状态"""
+        return await asyncio.to_thread(self._get_sync_state, user_id)
+
+    async def set_sync_state(self, user_id: str, latest_updated_at: float):
+        """记录用户会话列表的同步时间和已同步的最新更新时间"""
+        await asyncio.to_thread(self._set_sync_state, user_id, latest_updated_at)
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+# 创建全局实例
+conversation_store = ConversationStore(settings.DIFY_HISTORY_DB)
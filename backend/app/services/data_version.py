@@ -0,0 +1,31 @@
+import logging
+import threading
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+class DataVersion:
+    """数据版本计数器
+
+    漏洞、资产等模拟数据在增删改后递增对应版本号，
+    依赖这些数据的索引和缓存通过比较版本号判断是否需要重建。
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def bump(self, name: str) -> int:
+        """递增指定数据集的版本号并返回新版本"""
+        with self._lock:
+            version = self._versions.get(name, 0) + 1
+            self._versions[name] = version
+        logger.debug(f"数据版本更新 - {name}: {version}")
+        return version
+
+    def get(self, name: str) -> int:
+        """获取指定数据集的当前版本号"""
+        return self._versions.get(name, 0)
+
+# 创建全局实例
+data_version = DataVersion()
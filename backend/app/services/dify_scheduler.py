@@ -0,0 +1,192 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from app.exceptions.dify_error import DifyOverloadedError
+
+logger = logging.getLogger(__name__)
+
+# 优先级，数值越小越优先
+PRIORITY_INTERACTIVE = 0  # 交互式对话
+PRIORITY_ANALYSIS = 1     # 单个漏洞的分析、修复建议、自动补全
+PRIORITY_BATCH = 2        # 图表生成、风险评估等批量型调用
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_ANALYSIS: "analysis",
+    PRIORITY_BATCH: "batch"
+}
+
+# 当前请求的优先级，由API端点设置，在同一请求内的Dify调用中生效
+_request_priority: ContextVar[int] = ContextVar("dify_request_priority", default=PRIORITY_ANALYSIS)
+# 固定优先级的上下文（如批量任务）中，端点设置的优先级不再生效
+_pinned_priority: ContextVar[Optional[int]] = ContextVar("dify_pinned_priority", default=None)
+# 当前上下文是否已持有调度槽位，避免嵌套调用（如会话过期后重建会话）重复申请而死锁
+_holding_slot: ContextVar[bool] = ContextVar("dify_holding_slot", default=False)
+
+def set_request_priority(priority: int):
+    """设置当前请求调用Dify时使用的优先级"""
+    _request_priority.set(priority)
+
+def pin_request_priority(priority: int):
+    """固定当前上下文的优先级，供后台任务复用端点逻辑时使用"""
+    _pinned_priority.set(priority)
+
+def get_request_priority() -> int:
+    """获取当前请求调用Dify时使用的优先级"""
+    pinned = _pinned_priority.get()
+    return pinned if pinned is not None else _request_priority.get()
+
+class DifyScheduler:
+    """Dify上游调用的优先级调度器
+
+    限制同时进行的上游请求数，超出时按优先级排队，槽位释放后优先唤醒高优先级请求。
+    队列有上限：队列已满时，若新请求优先级更高则挤出队列中优先级最低的请求，
+    否则直接拒绝；排队超过最长等待时间的请求同样被拒绝，由调用方返回503。
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, max_wait: float, retry_after: int):
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._max_wait = max_wait
+        self._retry_after = retry_after
+        self._active = 0
+        # 排队中的请求: [优先级, 序号, Future]
+        self._queue: List[List[Any]] = []
+        self._sequence = itertools.count()
+        self._stats: Dict[int, Dict[str, float]] = {
+            priority: {"admitted": 0, "queued": 0, "shed": 0, "evicted": 0, "timeouts": 0,
+                       "wait_total_ms": 0.0, "wait_max_ms": 0.0}
+            for priority in PRIORITY_NAMES
+        }
+
+    @property
+    def retry_after(self) -> int:
+        return self._retry_after
+
+    def would_shed(self, priority: int) -> bool:
+        """判断该优先级的新请求当前是否会被直接拒绝"""
+        if self._active < self._max_concurrency and not self._queue:
+            return False
+        if len(self._queue) < self._max_queue:
+            return False
+        return not self._queue or max(entry[0] for entry in self._queue) <= priority
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[int] = None):
+        """申请一个上游请求槽位，退出时释放"""
+        if _holding_slot.get():
+            yield
+        else:
+            if priority is None:
+                priority = get_request_priority()
+            await self._acquire(priority)
+            token = _holding_slot.set(True)
+            try:
+                yield
+            finally:
+                _holding_slot.reset(token)
+                self._release()
+
+    def _overloaded(self, priority: int, reason: str) -> DifyOverloadedError:
+        logger.warning(f"AI服务繁忙，拒绝请求 - 优先级: {PRIORITY_NAMES[priority]}, 原因: {reason}, "
+                       f"进行中: {self._active}, 排队: {len(self._queue)}")
+        return DifyOverloadedError(f"AI服务繁忙（{reason}），请稍后重试", retry_after=self._retry_after)
+
+    def _record_wait(self, priority: int, started: float):
+        waited_ms = (time.monotonic() - started) * 1000
+        stats = self._stats[priority]
+        stats["admitted"] += 1
+        stats["wait_total_ms"] += waited_ms
+        stats["wait_max_ms"] = max(stats["wait_max_ms"], waited_ms)
+
+    async def _acquire(self, priority: int):
+        started = time.monotonic()
+        if self._active < self._max_concurrency and not self._queue:
+            self._active += 1
+            self._record_wait(priority, started)
+            return
+
+        if len(self._queue) >= self._max_queue:
+            victim = max(self._queue) if self._queue else None
+            if victim is not None and victim[0] > priority:
+                # 挤出优先级最低、最晚入队的请求
+                self._queue.remove(victim)
+                heapq.heapify(self._queue)
+                self._stats[victim[0]]["evicted"] += 1
+                victim[2].set_exception(self._overloaded(victim[0], "被更高优先级请求挤出队列"))
+            else:
+                self._stats[priority]["shed"] += 1
+                raise self._overloaded(priority, "排队已满")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._sequence), future]
+        heapq.heappush(self._queue, entry)
+        self._stats[priority]["queued"] += 1
+
+        try:
+            await asyncio.wait({future}, timeout=self._max_wait)
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+
+        if not future.done():
+            self._abandon(entry)
+            self._stats[priority]["timeouts"] += 1
+            raise self._overloaded(priority, "排队超时")
+
+        # 被挤出时抛出DifyOverloadedError，否则槽位已由释放方转交
+        future.result()
+        self._record_wait(priority, started)
+
+    def _abandon(self, entry: List[Any]):
+        """放弃排队：仍在队列中则移除，已获得槽位则归还"""
+        future = entry[2]
+        if future.done():
+            if not future.cancelled() and future.exception() is None:
+                self._release()
+            return
+        future.cancel()
+        if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+
+    def _release(self):
+        """释放槽位，直接转交给排队中优先级最高的请求"""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取调度器指标"""
+        depth_by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, _ in self._queue:
+            depth_by_priority[PRIORITY_NAMES[priority]] += 1
+        by_priority = {}
+        for priority, stats in self._stats.items():
+            admitted = stats["admitted"]
+            by_priority[PRIORITY_NAMES[priority]] = {
+                "admitted": int(admitted),
+                "queued": int(stats["queued"]),
+                "shed": int(stats["shed"]),
+                "evicted": int(stats["evicted"]),
+                "timeouts": int(stats["timeouts"]),
+                "wait_avg_ms": round(stats["wait_total_ms"] / admitted, 2) if admitted else 0.0,
+                "wait_max_ms": round(stats["wait_max_ms"], 2)
+            }
+        return {
+            "max_concurrency": self._max_concurrency,
+            "active": self._active,
+            "max_queue": self._max_queue,
+            "queue_depth": len(self._queue),
+            "queue_depth_by_priority": depth_by_priority,
+            "by_priority": by_priority
+        }
@@ -1,23 +1,45 @@
-import httpx
 from app.core.config import settings
-from typing import Dict, Any, Optional, List, AsyncGenerator
+from typing import Dict, Any, Optional, List, AsyncGenerator, Set
 import json
 import uuid
 import logging
-from app.exceptions.dify_error import DifyAPIError
+from app.exceptions.dify_error import DifyAPIError, DifyOverloadedError
 import time
 import os
-from httpx import Response
 from functools import lru_cache
 import traceback
 import aiohttp
 from aiohttp.client_exceptions import ClientResponseError
 import asyncio
+import hashlib
+import random
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from app.services.single_flight import SingleFlight, make_flight_key
+from app.services.dify_scheduler import DifyScheduler
+from app.services.circuit_breaker import CircuitBreaker, BreakerCall
+from app.services.session_cache import session_cache
+from app.services.conversation_store import conversation_store
+from app.core.sse import iter_sse_events, encode_event, SSEEncoder
+import re
 
 # 不要在这里设置基本日志配置，这会导致多重日志
 # logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 当前上游调用对应的熔断记录，由HTTP请求跟踪回调写入状态码和首包耗时
+_breaker_call: ContextVar[Optional[BreakerCall]] = ContextVar("dify_breaker_call", default=None)
+
+# 计为上游故障的异常类型
+UPSTREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+# 透传模式下从响应开头提取会话ID、任务ID和消息ID，最多检查的字节数
+_STREAM_ID_PATTERN = re.compile(rb'"(conversation_id|task_id|message_id)"\s*:\s*"([^"]+)"')
+_PASSTHROUGH_HEAD_LIMIT = 16 * 1024
+# 透传模式下只从消息事件中取出回答片段的字符串字面量，不解析整个事件
+_STREAM_ANSWER_EVENT = re.compile(rb'"event"\s*:\s*"(?:agent_)?message"')
+_STREAM_ANSWER_PATTERN = re.compile(rb'"answer"\s*:\s*("(?:[^"\\]|\\.)*")')
+
 class DifyService:
     """Dify API服务封装"""
     
@@ -33,8 +55,59 @@ class DifyService:
         # 设置默认的会话
         self.default_user_id = str(uuid.uuid4())
         
-        # 保存会话状态的字典
-        self._session_cache = {}
+        # Dify应用标识，由API地址和密钥哈希得到，用于区分不同应用的缓存
+        self.app_fingerprint = hashlib.sha256(f"{self.base_url}|{self.api_key}".encode("utf-8")).hexdigest()[:16]
+        
+        # 会话ID到用户ID的映射，有界并带过期时间
+        self._session_cache = session_cache
+        
+        # 相同提示词的并发请求合并
+        self._single_flight = SingleFlight()
+        
+        # 上游调用的并发上限和优先级调度
+        self.scheduler = DifyScheduler(
+            max_concurrency=settings.DIFY_MAX_CONCURRENCY,
+            max_queue=settings.DIFY_QUEUE_MAX_SIZE,
+            max_wait=settings.DIFY_QUEUE_MAX_WAIT,
+            retry_after=settings.DIFY_RETRY_AFTER_SECONDS
+        )
+        
+        # 上游故障时快速失败的熔断器
+        self.circuit_breaker = CircuitBreaker(
+            name="dify",
+            window_size=settings.DIFY_BREAKER_WINDOW_SIZE,
+            min_calls=settings.DIFY_BREAKER_MIN_CALLS,
+            failure_rate_threshold=settings.DIFY_BREAKER_FAILURE_RATE,
+            slow_call_seconds=settings.DIFY_BREAKER_SLOW_CALL_SECONDS,
+            slow_rate_threshold=settings.DIFY_BREAKER_SLOW_RATE,
+            open_seconds=settings.DIFY_BREAKER_OPEN_SECONDS,
+            half_open_max_calls=settings.DIFY_BREAKER_HALF_OPEN_CALLS
+        )
+        self._retry_stats = {"retries": 0, "exhausted": 0}
+        
+        # 流式调用统计：正常结束的流、客户端断开后中止的流，以及估算节省的上游生成时间
+        self._stream_stats = {
+            "completed": 0,
+            "completed_seconds": 0.0,
+            "cancelled": 0,
+            "seconds_saved": 0.0,
+            "stopped": 0,
+            "stop_requests": 0,
+            "stop_failures": 0
+        }
+        self._background_tasks: Set[asyncio.Task] = set()
+        # 正在读取的上游流: Dify任务ID -> (上游响应, 用户ID)，用户停止生成时据此立即关闭连接
+        self._active_streams: Dict[str, Any] = {}
+        self._stopped_tasks: Set[str] = set()
+        
+        # 共享的HTTP连接池，在应用启动时创建、关闭时释放
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self._pool_stats = {
+            "sessions_created": 0,
+            "requests_total": 0,
+            "in_flight": 0,
+            "max_in_flight": 0
+        }
         
         logger.info(f"Dify服务初始化完成 - 基础URL: {self.base_url}")
         logger.info(f"API密钥状态: {'已配置' if self.api_key else '未配置，请检查环境变量DIFY_API_KEY'}")
@@ -49,67 +122,339 @@ class DifyService:
             "Content-Type": "application/json"
         }
         
-    def _cache_session(self, conversation_id: str, user_id: str):
-        """缓存会话信息"""
-        self._session_cache[conversation_id] = {
-            "user_id": user_id,
-            "timestamp": import_time_module().time()  # 记录缓存时间
+    async def startup(self):
+        """创建共享的HTTP连接池"""
+        await self._get_http_session()
+        
+    async def shutdown(self):
+        """关闭共享的HTTP连接池"""
+        if self._http_session is not None and not self._http_session.closed:
+            await self._http_session.close()
+            logger.info("Dify HTTP连接池已关闭")
+        self._http_session = None
+        
+    async def _get_http_session(self) -> aiohttp.ClientSession:
+        """获取共享的HTTP会话，未创建或已关闭时按配置创建"""
+        if self._http_session is None or self._http_session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.DIFY_HTTP_MAX_CONNECTIONS,
+                limit_per_host=settings.DIFY_HTTP_MAX_CONNECTIONS_PER_HOST,
+                keepalive_timeout=settings.DIFY_HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=settings.DIFY_HTTP_DNS_CACHE_TTL
+            )
+            self._http_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self._request_timeout(settings.DIFY_HTTP_TOTAL_TIMEOUT),
+                trace_configs=[self._breaker_trace_config()]
+            )
+            self._pool_stats["sessions_created"] += 1
+            logger.info(
+                f"Dify HTTP连接池已创建 - 最大连接数: {settings.DIFY_HTTP_MAX_CONNECTIONS}, "
+                f"单主机最大连接数: {settings.DIFY_HTTP_MAX_CONNECTIONS_PER_HOST}, "
+                f"keep-alive: {settings.DIFY_HTTP_KEEPALIVE_TIMEOUT}秒"
+            )
+        return self._http_session
+    
+    @staticmethod
+    def _breaker_trace_config() -> aiohttp.TraceConfig:
+        """HTTP请求跟踪：记录请求开始时间和响应状态码，供熔断器计算失败率和首包耗时"""
+        async def on_request_start(session, context, params):
+            call = _breaker_call.get()
+            if call is not None:
+                call.request_started()
+        
+        async def on_request_end(session, context, params):
+            call = _breaker_call.get()
+            if call is not None:
+                call.response_received(params.response.status)
+        
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+    
+    @staticmethod
+    def _request_timeout(total: float) -> aiohttp.ClientTimeout:
+        """构造请求超时配置，连接和读取超时来自全局配置"""
+        return aiohttp.ClientTimeout(
+            total=total,
+            connect=settings.DIFY_HTTP_CONNECT_TIMEOUT,
+            sock_read=settings.DIFY_HTTP_READ_TIMEOUT
+        )
+    
+    @asynccontextmanager
+    async def _pooled_session(self):
+        """从共享连接池借用HTTP会话，退出时不关闭会话，仅更新统计
+        
+        借用前先检查熔断器，熔断打开时直接拒绝；再向调度器申请槽位，
+        超出并发上限时按当前请求的优先级排队。退出时向熔断器上报调用结果。
+        """
+        call = self.circuit_breaker.begin() if settings.DIFY_BREAKER_ENABLED else None
+        token = _breaker_call.set(call)
+        upstream_error = False
+        try:
+            async with self.scheduler.slot():
+                session = await self._get_http_session()
+                stats = self._pool_stats
+                stats["requests_total"] += 1
+                stats["in_flight"] += 1
+                stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+                try:
+                    yield session
+                finally:
+                    stats["in_flight"] -= 1
+        except UPSTREAM_ERRORS as e:
+            # raise_for_status抛出的响应错误按状态码计入，4xx不算上游故障
+            upstream_error = not isinstance(e, ClientResponseError)
+            raise
+        finally:
+            _breaker_call.reset(token)
+            if call is not None:
+                call.finish(upstream_error)
+    
+    def get_pool_metrics(self) -> Dict[str, Any]:
+        """获取HTTP连接池指标"""
+        metrics = {
+            "limit": settings.DIFY_HTTP_MAX_CONNECTIONS,
+            "limit_per_host": settings.DIFY_HTTP_MAX_CONNECTIONS_PER_HOST,
+            "keepalive_timeout": settings.DIFY_HTTP_KEEPALIVE_TIMEOUT,
+            **self._pool_stats,
+            "active_connections": 0,
+            "idle_connections": 0
+        }
+        session = self._http_session
+        if session is not None and not session.closed:
+            connector = session.connector
+            # aiohttp未提供公开的连接统计接口，这里读取连接器内部状态
+            metrics["active_connections"] = len(getattr(connector, "_acquired", ()))
+            metrics["idle_connections"] = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return metrics
+    
+    def get_retry_metrics(self) -> Dict[str, Any]:
+        """获取幂等请求重试指标"""
+        return {"max_attempts": settings.DIFY_RETRY_MAX_ATTEMPTS, **self._retry_stats}
+    
+    async def _with_retries(self, operation: str, request):
+        """执行幂等请求，连接错误、超时和5xx/429响应按带随机抖动的指数退避重试"""
+        max_attempts = max(1, settings.DIFY_RETRY_MAX_ATTEMPTS)
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return await request()
+            except UPSTREAM_ERRORS as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status < 500 and e.status != 429:
+                    raise
+                if attempt == max_attempts:
+                    self._retry_stats["exhausted"] += 1
+                    raise
+                delay = random.uniform(0, min(settings.DIFY_RETRY_MAX_DELAY, settings.DIFY_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+                self._retry_stats["retries"] += 1
+                logger.warning(f"{operation}失败，{delay:.2f}秒后第{attempt}次重试: {str(e) or type(e).__name__}")
+                await asyncio.sleep(delay)
+    
+    def get_single_flight_metrics(self) -> Dict[str, Any]:
+        """获取请求合并指标"""
+        return {"enabled": settings.DIFY_SINGLE_FLIGHT_ENABLED, **self._single_flight.get_metrics()}
+    
+    def get_stream_metrics(self) -> Dict[str, Any]:
+        """获取流式调用指标"""
+        stats = self._stream_stats
+        return {
+            "completed": stats["completed"],
+            "avg_completed_seconds": round(stats["completed_seconds"] / stats["completed"], 3) if stats["completed"] else 0.0,
+            "cancelled": stats["cancelled"],
+            "seconds_saved": round(stats["seconds_saved"], 3),
+            "stopped": stats["stopped"],
+            "active": len(self._active_streams),
+            "stop_requests": stats["stop_requests"],
+            "stop_failures": stats["stop_failures"]
         }
+    
+    async def stop_task(self, task_id: str, user_id: str) -> bool:
+        """请求Dify停止生成任务，返回是否成功
+
+        停止请求用于释放上游资源，不经过调度器排队，也不计入熔断统计。
+        """
+        self._stream_stats["stop_requests"] += 1
+        token = _breaker_call.set(None)
+        try:
+            session = await self._get_http_session()
+            async with session.post(
+                f"{self.base_url}/chat-messages/{task_id}/stop",
+                json={"user": user_id},
+                headers=self.get_headers(),
+                timeout=self._request_timeout(10)
+            ) as response:
+                if response.status == 200:
+                    logger.info(f"已停止Dify生成任务 - 任务ID: {task_id}")
+                    return True
+                error_text = await response.text()
+                logger.warning(f"停止Dify生成任务失败 - 任务ID: {task_id}, 状态码: {response.status}, 响应: {error_text[:200]}")
+        except UPSTREAM_ERRORS as e:
+            logger.warning(f"停止Dify生成任务失败 - 任务ID: {task_id}, 错误: {str(e) or type(e).__name__}")
+        finally:
+            _breaker_call.reset(token)
+        self._stream_stats["stop_failures"] += 1
+        return False
+    
+    async def stop_stream(self, task_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """停止生成：通知Dify停止任务，并立即关闭本地正在读取的上游连接，释放并发槽位
+
+        本进程中没有该任务的流且未提供用户ID时，无法调用Dify的停止接口，返回found=False。
+        """
+        active = self._active_streams.get(task_id)
+        if active is None and not user_id:
+            return {"task_id": task_id, "found": False, "upstream_stopped": False, "stream_closed": False}
+        stream_closed = False
+        if active is not None:
+            response, stream_user_id = active
+            user_id = user_id or stream_user_id
+            self._stopped_tasks.add(task_id)
+            response.close()
+            stream_closed = True
+        upstream_stopped = await self.stop_task(task_id, user_id)
+        logger.info(f"用户停止生成 - 任务ID: {task_id}, 上游已停止: {upstream_stopped}, 本地连接已关闭: {stream_closed}")
+        return {"task_id": task_id, "found": True, "upstream_stopped": upstream_stopped, "stream_closed": stream_closed}
+    
+    def _track_stream(self, task_id: str, response: aiohttp.ClientResponse, user_id: str):
+        self._active_streams[task_id] = (response, user_id)
+    
+    def _untrack_stream(self, task_id: Optional[str]) -> bool:
+        """移除流的跟踪记录，返回该流是否被用户停止"""
+        if not task_id:
+            return False
+        self._active_streams.pop(task_id, None)
+        if task_id in self._stopped_tasks:
+            self._stopped_tasks.discard(task_id)
+            self._stream_stats["stopped"] += 1
+            return True
+        return False
+    
+    def _record_stream_completed(self, started: float, stopped: bool = False):
+        """记录正常结束的流；被用户停止的流已计入stopped，不计入完成数和平均耗时"""
+        if stopped:
+            return
+        self._stream_stats["completed"] += 1
+        self._stream_stats["completed_seconds"] += time.monotonic() - started
+    
+    def _record_stream_aborted(self, started: float, task_id: Optional[str], user_id: str):
+        """流在结束前被中止（客户端断开）：通知Dify停止生成，并按正常流的平均耗时估算节省的时间"""
+        stats = self._stream_stats
+        elapsed = time.monotonic() - started
+        stats["cancelled"] += 1
+        if stats["completed"]:
+            stats["seconds_saved"] += max(0.0, stats["completed_seconds"] / stats["completed"] - elapsed)
+        logger.info(f"流式响应在结束前被中止 - 任务ID: {task_id}, 已耗时: {elapsed:.2f}秒")
+        if task_id:
+            # 当前协程正在被取消，停止请求放到独立任务中执行
+            task = asyncio.create_task(self.stop_task(task_id, user_id))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+        
+    async def _cache_session(self, conversation_id: str, user_id: str):
+        """缓存会话信息"""
+        await self._session_cache.set(conversation_id, user_id)
         logger.info(f"已缓存会话信息 - 会话ID: {conversation_id}, 用户ID: {user_id}")
         
-    def _get_cached_user_id(self, conversation_id: str) -> Optional[str]:
+    async def _get_cached_user_id(self, conversation_id: str) -> Optional[str]:
         """从缓存中获取用户ID"""
-        session_info = self._session_cache.get(conversation_id)
-        if session_info:
-            return session_info.get("user_id")
-        return None
+        return await self._session_cache.get(conversation_id)
+        
+    def get_session_cache_metrics(self) -> Dict[str, Any]:
+        """获取会话缓存指标"""
+        return self._session_cache.get_metrics()
         
-    async def get_conversations(self) -> List[Dict[str, Any]]:
-        """获取所有对话列表"""
+    async def _record_history(self, conversation_id: Optional[str], user_id: str, message_id: Optional[str],
+                              query: Optional[str], answer: str, created_at: Any = None,
+                              new_conversation: bool = False):
+        """将经过代理的一轮问答写入本地会话存储，写入失败不影响对话"""
+        if not conversation_id or not message_id:
+            return
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
+            await conversation_store.record_message(
+                conversation_id,
+                user_id,
+                {"id": message_id, "query": query, "answer": answer, "created_at": created_at},
+                new_conversation=new_conversation
+            )
+        except Exception as e:
+            logger.error(f"记录会话消息失败 - 会话ID: {conversation_id}, 错误: {str(e)}")
+        
+    async def fetch_conversations(self, user_id: str, last_id: Optional[str] = None,
+                                  limit: int = 100) -> Dict[str, Any]:
+        """获取用户的一页会话列表，按更新时间倒序，last_id为上一页最后一个会话"""
+        params = {"user": user_id, "limit": limit}
+        if last_id:
+            params["last_id"] = last_id
+        async def request():
+            async with self._pooled_session() as session:
+                async with session.get(
                     f"{self.base_url}/conversations",
+                    params=params,
                     headers=self.get_headers()
-                )
-                response.raise_for_status()
-                data = response.json()
-                return data.get("data", {}).get("conversations", [])
+                ) as response:
+                    response.raise_for_status()
+                    data = await response.json()
+                    return {"data": data.get("data") or [], "has_more": bool(data.get("has_more"))}
+        try:
+            return await self._with_retries("获取对话列表", request)
         except Exception as e:
             logger.error(f"获取对话列表失败: {str(e)}")
             raise
 
     async def get_conversation(self, conversation_id: str) -> Dict[str, Any]:
         """获取特定对话的详情"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
+        async def request():
+            async with self._pooled_session() as session:
+                async with session.get(
                     f"{self.base_url}/conversations/{conversation_id}",
                     headers=self.get_headers()
-                )
-                response.raise_for_status()
-                return response.json().get("data", {})
+                ) as response:
+                    response.raise_for_status()
+                    return (await response.json()).get("data", {})
+        try:
+            return await self._with_retries("获取对话详情", request)
         except Exception as e:
             logger.error(f"获取对话详情失败 - ID: {conversation_id}, 错误: {str(e)}")
             raise
 
-    async def get_conversation_messages(self, conversation_id: str) -> List[Dict[str, Any]]:
-        """获取特定对话的所有消息"""
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
+    async def fetch_messages(self, conversation_id: str, user_id: str, first_id: Optional[str] = None,
+                             limit: int = 100) -> Dict[str, Any]:
+        """获取一页会话消息，页内按时间正序；first_id为已获取的最早消息，返回更早的一页"""
+        params = {"conversation_id": conversation_id, "user": user_id, "limit": limit}
+        if first_id:
+            params["first_id"] = first_id
+        async def request():
+            async with self._pooled_session() as session:
+                async with session.get(
                     f"{self.base_url}/messages",
-                    params={"conversation_id": conversation_id},
+                    params=params,
                     headers=self.get_headers()
-                )
-                response.raise_for_status()
-                return response.json().get("data", {}).get("messages", [])
+                ) as response:
+                    response.raise_for_status()
+                    data = await response.json()
+                    return {"data": data.get("data") or [], "has_more": bool(data.get("has_more"))}
+        try:
+            return await self._with_retries("获取对话消息", request)
         except Exception as e:
             logger.error(f"获取对话消息失败 - 会话ID: {conversation_id}, 错误: {str(e)}")
             raise
 
     async def send_first_message(self, message: str, user_id: Optional[str] = None, stream: bool = True) -> Dict[str, Any]:
-        """发送首条消息，创建新对话"""
+        """发送首条消息，创建新对话
+        
+        同一用户相同消息的并发请求合并为一次上游调用，这些调用方得到同一结果（包括会话ID）；
+        未提供用户ID时为本次调用生成独立用户，不与其他请求合并，避免不同调用方共享会话。
+        平台内部调用传入固定的服务用户（DIFY_INTERNAL_USER_ID），相同提示词之间合并。
+        """
+        user_id = user_id or str(uuid.uuid4())
+        if not settings.DIFY_SINGLE_FLIGHT_ENABLED:
+            return await self._send_first_message(message, user_id, stream)
+        key = make_flight_key("first_message", message, stream, user_id)
+        result = await self._single_flight.do(key, lambda: self._send_first_message(message, user_id, stream))
+        return dict(result)
+
+    async def _send_first_message(self, message: str, user_id: Optional[str] = None, stream: bool = True) -> Dict[str, Any]:
+        """发送首条消息的上游调用"""
         try:
             # 如果未提供用户ID，则生成一个
             if not user_id:
@@ -126,8 +471,8 @@ class DifyService:
             
             logger.info(f"发送首条消息 - 用户ID: {user_id}, 消息: '{message[:100]}...'")
             
-            # 使用aiohttp进行异步HTTP请求
-            async with aiohttp.ClientSession() as session:
+            # 使用共享连接池进行异步HTTP请求
+            async with self._pooled_session() as session:
                 headers = self.get_headers()
                 
                 if stream:
@@ -158,7 +503,10 @@ class DifyService:
                         
                         # 缓存会话信息
                         if conversation_id:
-                            self._cache_session(conversation_id, user_id)
+                            await self._cache_session(conversation_id, user_id)
+                            await self._record_history(conversation_id, user_id, data.get("id"), message,
+                                                       data.get("answer", ""), data.get("created_at"),
+                                                       new_conversation=True)
                             
                         return {
                             "conversation_id": conversation_id,
@@ -167,18 +515,100 @@ class DifyService:
                             "message_id": data.get("id")
                         }
                         
+        except DifyOverloadedError:
+            raise
         except Exception as e:
             error_message = f"发送首条消息失败: {str(e)}"
             logger.error(error_message)
             logger.error(traceback.format_exc())
             raise Exception(error_message)
 
+    async def stream_answer(self, message: str, user_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """在新对话中发送消息，逐块产生回答文本
+        
+        上游错误（包括过载拒绝）直接抛出。调用方提前关闭生成器时关闭上游连接并通知Dify停止生成，
+        用于只需要回答中一部分内容（如JSON对象）的场景。同一用户相同消息的并发请求共享同一个上游流，
+        只产生回答文本、不暴露会话ID，因此未提供用户ID的调用之间也会合并。
+        """
+        if not settings.DIFY_SINGLE_FLIGHT_ENABLED:
+            events = self._stream_answer(message, user_id)
+        else:
+            key = make_flight_key("stream_answer", message, user_id)
+            events = self._single_flight.stream(key, lambda: self._stream_answer(message, user_id))
+        async for chunk in events:
+            yield chunk
+
+    async def _stream_answer(self, message: str, user_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """逐块产生回答文本的上游调用"""
+        user_id = user_id or str(uuid.uuid4())
+        payload = {
+            "inputs": {},
+            "query": message,
+            "response_mode": "streaming",
+            "conversation_id": None,
+            "user": user_id
+        }
+        logger.info(f"流式获取回答 - 用户ID: {user_id}, 消息: '{message[:100]}...'")
+        
+        async with self._pooled_session() as session:
+            async with session.post(
+                f"{self.base_url}/chat-messages",
+                json=payload,
+                headers=self.get_headers(),
+                timeout=self._request_timeout(60)
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"流式请求失败 - 状态码: {response.status}, 响应: {error_text}")
+                    raise Exception(f"流式请求失败: {error_text}")
+                
+                conversation_id = None
+                message_id = None
+                task_id = None
+                created_at = None
+                answer_parts: List[str] = []
+                stream_started = time.monotonic()
+                try:
+                    async for sse_event in iter_sse_events(response.content.iter_any()):
+                        data = sse_event.json()
+                        if data is None:
+                            continue
+                        if not task_id and data.get('task_id'):
+                            task_id = data['task_id']
+                            self._track_stream(task_id, response, user_id)
+                        event_type = data.get('event')
+                        if event_type == 'message':
+                            conversation_id = conversation_id or data.get('conversation_id')
+                            message_id = message_id or data.get('id')
+                            created_at = created_at or data.get('created_at')
+                            answer = data.get('answer', '')
+                            answer_parts.append(answer)
+                            yield answer
+                        elif event_type == 'error':
+                            raise Exception(f"流式响应错误: {data.get('message') or data.get('error') or '未知错误'}")
+                except (asyncio.CancelledError, GeneratorExit):
+                    if not self._untrack_stream(task_id):
+                        self._record_stream_aborted(stream_started, task_id, user_id)
+                    raise
+                except aiohttp.ClientError:
+                    # 用户停止生成时连接被主动关闭，按正常结束处理
+                    if task_id not in self._stopped_tasks:
+                        raise
+                finally:
+                    stopped = self._untrack_stream(task_id)
+                self._record_stream_completed(stream_started, stopped)
+        
+        if conversation_id:
+            await self._cache_session(conversation_id, user_id)
+            await self._record_history(conversation_id, user_id, message_id, message, "".join(answer_parts),
+                                       created_at, new_conversation=True)
+
     async def send_message(self, conversation_id: str, message: str, user_id: Optional[str] = None, 
                          inputs: Optional[Dict[str, Any]] = None, stream: bool = True) -> Dict[str, Any]:
         """向现有对话发送消息"""
         try:
             # 检查是否有缓存的用户ID
-            cached_user_id = self._get_cached_user_id(conversation_id)
+            cached_user_id = await self._get_cached_user_id(conversation_id)
             
             # 如果未提供用户ID，尝试使用缓存的用户ID
             if not user_id and cached_user_id:
@@ -200,8 +630,8 @@ class DifyService:
             
             logger.info(f"发送消息 - 会话ID: {conversation_id}, 用户ID: {user_id}, 消息: '{message[:100]}...'")
             
-            # 使用aiohttp进行异步HTTP请求
-            async with aiohttp.ClientSession() as session:
+            # 使用共享连接池进行异步HTTP请求
+            async with self._pooled_session() as session:
                 headers = self.get_headers()
                 
                 if stream:
@@ -261,7 +691,9 @@ class DifyService:
                             data = await response.json()
                             
                             # 缓存或更新会话信息
-                            self._cache_session(conversation_id, user_id)
+                            await self._cache_session(conversation_id, user_id)
+                            await self._record_history(conversation_id, user_id, data.get("id"), message,
+                                                       data.get("answer", ""), data.get("created_at"))
                             
                             return {
                                 "conversation_id": conversation_id,
@@ -296,6 +728,8 @@ class DifyService:
                             # 其他HTTP错误
                             raise Exception(f"发送消息失败: HTTP错误 {e.status} - {e.message}")
                         
+        except DifyOverloadedError:
+            raise
         except Exception as e:
             error_message = f"发送消息失败: {str(e)}"
             logger.error(error_message)
@@ -328,7 +762,7 @@ class DifyService:
                 url,
                 json=payload,
                 headers=headers,
-                timeout=60
+                timeout=self._request_timeout(60)
             ) as response:
                 # 检查响应状态
                 if response.status != 200:
@@ -336,45 +770,31 @@ class DifyService:
                     logger.error(f"流式请求失败 - 状态码: {response.status}, 响应: {error_text}")
                     raise Exception(f"流式请求失败: {error_text}")
                 
-                # 处理流式响应
-                async for line in response.content:
-                    if line:
-                        try:
-                            # 解码数据行
-                            line_text = line.decode('utf-8').strip()
-                            # 跳过空行
-                            if not line_text:
-                                continue
-                            
-                            # logger.debug(f"收到流式数据行: {line_text}")
-                            
-                            # 处理SSE格式
-                            if line_text.startswith('data: '):
-                                data_json = line_text[6:]  # 移除'data: '前缀
-                                data = json.loads(data_json)
-                                
-                                # 提取关键信息
-                                event_type = data.get('event')
-                                if event_type == 'message':
-                                    # 提取消息内容
-                                    message_content = data.get('answer', '')
-                                    answer_chunks.append(message_content)
-                                    
-                                    # 提取会话ID和消息ID（如果存在）
-                                    if 'conversation_id' in data and not conversation_id:
-                                        conversation_id = data['conversation_id']
-                                    if 'id' in data and not message_id:
-                                        message_id = data['id']
-                        except Exception as e:
-                            logger.error(f"处理流式数据行失败: {str(e)}")
-                            logger.error(f"问题数据: {line}")
+                # 增量解析SSE事件
+                async for sse_event in iter_sse_events(response.content.iter_any()):
+                    data = sse_event.json()
+                    if data is None:
+                        continue
+
+                    # 提取关键信息
+                    if data.get('event') == 'message':
+                        # 提取消息内容
+                        answer_chunks.append(data.get('answer', ''))
+
+                        # 提取会话ID和消息ID（如果存在）
+                        if 'conversation_id' in data and not conversation_id:
+                            conversation_id = data['conversation_id']
+                        if 'id' in data and not message_id:
+                            message_id = data['id']
             
             # 合并所有文本片段
             full_answer = ''.join(answer_chunks)
             
             # 缓存会话信息
             if conversation_id:
-                self._cache_session(conversation_id, user_id)
+                await self._cache_session(conversation_id, user_id)
+                await self._record_history(conversation_id, user_id, message_id, payload.get("query"), full_answer,
+                                           new_conversation=not payload.get("conversation_id"))
                 
             return {
                 "conversation_id": conversation_id,
@@ -413,8 +833,8 @@ class DifyService:
             # 保存会话和消息元数据
             conversation_id = payload.get("conversation_id")
             
-            # 使用aiohttp进行请求
-            async with aiohttp.ClientSession() as session:
+            # 使用共享连接池进行请求
+            async with self._pooled_session() as session:
                 headers = self.get_headers()
                 logger.debug(f"流式请求头: {headers}")
                 
@@ -425,7 +845,7 @@ class DifyService:
                     url,
                     json=payload,
                     headers=headers,
-                    timeout=120  # 扩展超时时间以处理长对话
+                    timeout=self._request_timeout(120)  # 扩展超时时间以处理长对话
                 ) as response:
                     # 检查响应状态
                     if response.status != 200:
@@ -460,149 +880,140 @@ class DifyService:
                     chunk_count = 0
                     total_content_size = 0
                     
-                    # 遍历流式数据行
-                    buffer = ""
-                    line_count = 0
-                    async for line in response.content:
-                        if line:
-                            line_count += 1
-                            line_text = line.decode('utf-8')
-                            buffer += line_text
-                            total_content_size += len(line_text)
-                            
-                            # 每10行日志一次进度
-                            if line_count % 10 == 0:
-                                logger.debug(f"已接收 {line_count} 行数据，总大小: {total_content_size} 字节")
-                            
-                            # 如果是第一行，记录首个响应时间
-                            if line_count == 1:
+                    # 增量解析SSE事件，按到达的字节块处理
+                    # 客户端断开时生成器被取消或关闭，此时通知Dify停止仍在进行的生成任务
+                    stream_started = time.monotonic()
+                    task_id = None
+                    upstream_finished = False
+                    # 完整回答和创建时间，结束时写入本地会话存储
+                    answer_parts: List[str] = []
+                    message_created_at = None
+                    try:
+                        async for sse_event in iter_sse_events(response.content.iter_any()):
+                            chunk_count += 1
+                            total_content_size += len(sse_event.data)
+                            if chunk_count == 1:
                                 first_chunk_time = time.time()
                                 logger.debug(f"收到第一个数据块，耗时: {first_chunk_time - response_start_time:.3f}秒")
-                                logger.debug(f"首个数据块内容: {line_text[:100]}...")
-                            
-                            # 处理完整的SSE消息（以\n\n分隔）
-                            if '\n\n' in buffer:
-                                parts = buffer.split('\n\n')
-                                buffer = parts[-1]  # 保留最后一个可能不完整的部分
-                                
-                                for part in parts[:-1]:  # 处理完整的消息
-                                    if part.startswith('data: '):
-                                        chunk_count += 1
-                                        data_json = part[6:].strip()  # 移除'data: '前缀
-                                        
-                                        try:
-                                            data = json.loads(data_json)
-                                            logger.debug(f"解析的SSE数据 #{chunk_count}: {data}")
-                                            
-                                            # 处理不同类型的消息
-                                            event_type = data.get('event')
-                                            logger.debug(f"事件类型: {event_type}")
-                                            
-                                            # 提取元数据
-                                            if 'conversation_id' in data and not new_conversation_id:
-                                                new_conversation_id = data['conversation_id']
-                                                logger.debug(f"从流中提取会话ID: {new_conversation_id}")
-                                                # 如果是新会话，缓存会话信息
-                                                if new_conversation_id != conversation_id:
-                                                    self._cache_session(new_conversation_id, user_id)
-                                                    yield {
-                                                        "type": "metadata",
-                                                        "conversation_id": new_conversation_id,
-                                                        "user_id": user_id,
-                                                        "is_new_conversation": True
-                                                    }
-                                            
-                                            if 'id' in data and not message_id:
-                                                message_id = data['id']
-                                                logger.debug(f"从流中提取消息ID: {message_id}")
-                                            
-                                            # 消息内容
-                                            if event_type == 'message':
-                                                message_content = data.get('answer', '')
-                                                logger.debug(f"收到消息内容块 #{chunk_count}: {message_content[:50]}...")
-                                                # 注意：这里不要转换事件类型，直接传递原始的 message 类型
-                                                yield {
-                                                    "type": "message",
-                                                    "content": message_content,
-                                                    "answer": message_content,  # 同时传递 answer 字段，以确保前端能够处理
-                                                    "conversation_id": new_conversation_id or conversation_id,
-                                                    "message_id": message_id,
-                                                    "user_id": user_id
-                                                }
-                                            # 结束标记
-                                            elif event_type == 'done' or event_type == 'message_end':
-                                                logger.debug("收到流式响应结束标记")
-                                                yield {
-                                                    "type": "end",
-                                                    "conversation_id": new_conversation_id or conversation_id,
-                                                    "message_id": message_id,
-                                                    "user_id": user_id
-                                                }
-                                            # 错误处理
-                                            elif event_type == 'error':
-                                                error_message = data.get('error', '未知错误')
-                                                logger.error(f"流式响应错误: {error_message}")
-                                                yield {
-                                                    "type": "error",
-                                                    "error": error_message,
-                                                    "conversation_id": new_conversation_id or conversation_id,
-                                                    "user_id": user_id
-                                                }
-                                                
-                                            # 为了调试，记录所有未处理的事件类型
-                                            else:
-                                                logger.warning(f"未处理的事件类型: {event_type}, 数据: {data}")
-                                                # 尝试从事件中提取回答内容
-                                                answer_content = None
-                                                if 'answer' in data:
-                                                    answer_content = data.get('answer')
-                                                    logger.debug(f"从未知事件中提取到answer内容: {answer_content[:50] if answer_content else 'None'}")
-                                                elif 'text' in data:
-                                                    answer_content = data.get('text')
-                                                    logger.debug(f"从未知事件中提取到text内容: {answer_content[:50] if answer_content else 'None'}")
-                                                elif 'content' in data:
-                                                    answer_content = data.get('content')
-                                                    logger.debug(f"从未知事件中提取到content内容: {answer_content[:50] if answer_content else 'None'}")
-                                                
-                                                # 如果能提取到内容，也发送为chunk
-                                                if answer_content:
-                                                    yield {
-                                                        "type": "chunk",
-                                                        "content": answer_content,
-                                                        "conversation_id": new_conversation_id or conversation_id,
-                                                        "message_id": message_id,
-                                                        "user_id": user_id
-                                                    }
-                                        except json.JSONDecodeError:
-                                            logger.error(f"解析JSON失败: {data_json}")
-                                            continue
-                    
-                    # 如果缓冲区中还有数据，处理它
-                    if buffer.strip():
-                        if buffer.startswith('data: '):
-                            try:
-                                data_json = buffer[6:].strip()
-                                data = json.loads(data_json)
-                                
-                                # 处理最后一条消息
-                                event_type = data.get('event')
-                                if event_type == 'message':
-                                    message_content = data.get('answer', '')
-                                    logger.debug(f"处理缓冲区中的最后一条消息: {message_content[:50]}...")
+
+                            data = sse_event.json()
+                            if data is None:
+                                continue
+                            if not task_id and data.get('task_id'):
+                                task_id = data['task_id']
+                                self._track_stream(task_id, response, user_id)
+
+                            # 处理不同类型的消息
+                            event_type = data.get('event')
+
+                            # 提取元数据
+                            if 'conversation_id' in data and not new_conversation_id:
+                                new_conversation_id = data['conversation_id']
+                                logger.debug(f"从流中提取会话ID: {new_conversation_id}")
+                                # 如果是新会话，缓存会话信息
+                                if new_conversation_id != conversation_id:
+                                    await self._cache_session(new_conversation_id, user_id)
+                                    yield {
+                                        "type": "metadata",
+                                        "conversation_id": new_conversation_id,
+                                        "user_id": user_id,
+                                        "is_new_conversation": True
+                                    }
+
+                            if 'id' in data and not message_id:
+                                message_id = data['id']
+                                logger.debug(f"从流中提取消息ID: {message_id}")
+
+                            # 消息内容
+                            if event_type == 'message':
+                                message_content = data.get('answer', '')
+                                answer_parts.append(message_content)
+                                if message_created_at is None:
+                                    message_created_at = data.get('created_at')
+                                # 注意：这里不要转换事件类型，直接传递原始的 message 类型
+                                yield {
+                                    "type": "message",
+                                    "content": message_content,
+                                    "answer": message_content,  # 同时传递 answer 字段，以确保前端能够处理
+                                    "conversation_id": new_conversation_id or conversation_id,
+                                    "message_id": message_id,
+                                    "task_id": task_id,
+                                    "user_id": user_id
+                                }
+                            # 结束标记
+                            elif event_type == 'done' or event_type == 'message_end':
+                                logger.debug("收到流式响应结束标记")
+                                upstream_finished = True
+                                await self._record_history(
+                                    new_conversation_id or conversation_id, user_id, message_id, payload.get("query"),
+                                    "".join(answer_parts), message_created_at, new_conversation=not conversation_id
+                                )
+                                yield {
+                                    "type": "end",
+                                    "conversation_id": new_conversation_id or conversation_id,
+                                    "message_id": message_id,
+                                    "task_id": task_id,
+                                    "user_id": user_id
+                                }
+                            # 错误处理
+                            elif event_type == 'error':
+                                error_message = data.get('error', '未知错误')
+                                logger.error(f"流式响应错误: {error_message}")
+                                yield {
+                                    "type": "error",
+                                    "error": error_message,
+                                    "conversation_id": new_conversation_id or conversation_id,
+                                    "user_id": user_id
+                                }
+
+                            # 为了调试，记录所有未处理的事件类型
+                            else:
+                                logger.debug(f"未处理的事件类型: {event_type}")
+                                # 尝试从事件中提取回答内容
+                                answer_content = data.get('answer') or data.get('text') or data.get('content')
+
+                                # 如果能提取到内容，也发送为chunk
+                                if answer_content:
                                     yield {
                                         "type": "chunk",
-                                        "content": message_content,
+                                        "content": answer_content,
                                         "conversation_id": new_conversation_id or conversation_id,
                                         "message_id": message_id,
                                         "user_id": user_id
                                     }
-                            except Exception as e:
-                                logger.error(f"处理缓冲区中的最后一条消息失败: {str(e)}")
-                    
+                    except (asyncio.CancelledError, GeneratorExit):
+                        stopped = self._untrack_stream(task_id)
+                        if upstream_finished:
+                            self._record_stream_completed(stream_started)
+                        elif not stopped:
+                            self._record_stream_aborted(stream_started, task_id, user_id)
+                        raise
+                    except aiohttp.ClientError:
+                        # 用户停止生成时连接被主动关闭，按正常结束处理
+                        if task_id not in self._stopped_tasks:
+                            raise
+                    finally:
+                        stopped = self._untrack_stream(task_id)
+                    self._record_stream_completed(stream_started, stopped and not upstream_finished)
+                    if stopped and not upstream_finished:
+                        upstream_finished = True
+                        await self._record_history(
+                            new_conversation_id or conversation_id, user_id, message_id, payload.get("query"),
+                            "".join(answer_parts), message_created_at, new_conversation=not conversation_id
+                        )
+                        yield {
+                            "type": "end",
+                            "conversation_id": new_conversation_id or conversation_id,
+                            "message_id": message_id,
+                            "task_id": task_id,
+                            "user_id": user_id,
+                            "stopped": True
+                        }
+
                     # 流处理统计
                     response_end_time = time.time()
                     total_time = response_end_time - response_start_time
-                    logger.info(f"流式响应处理完成 - 总计 {chunk_count} 个数据块, 总大小: {total_content_size} 字节, 总耗时: {total_time:.3f}秒")
+                    logger.info(f"流式响应处理完成 - 总计 {chunk_count} 个数据块, 总大小: {total_content_size} 字符, 总耗时: {total_time:.3f}秒")
                     
                     # 如果只收到一个数据块，可能不是真正的流式响应
                     if chunk_count <= 1:
@@ -634,12 +1045,13 @@ class DifyService:
                             await asyncio.sleep(1.0)
                     
                     # 确保发送结束标记
-                    yield {
-                        "type": "end",
-                        "conversation_id": new_conversation_id or conversation_id,
-                        "message_id": message_id or "test_msg_end",
-                        "user_id": user_id
-                    }
+                    if not upstream_finished:
+                        yield {
+                            "type": "end",
+                            "conversation_id": new_conversation_id or conversation_id,
+                            "message_id": message_id or "test_msg_end",
+                            "user_id": user_id
+                        }
                     
         except Exception as e:
             error_message = f"流式响应处理失败: {str(e)}"
@@ -665,7 +1077,7 @@ class DifyService:
         """流式聊天，返回异步生成器"""
         try:
             # 检查是否有缓存的用户ID
-            cached_user_id = self._get_cached_user_id(conversation_id) if conversation_id else None
+            cached_user_id = await self._get_cached_user_id(conversation_id) if conversation_id else None
             
             # 如果未提供用户ID，尝试使用缓存的用户ID
             if not user_id and cached_user_id:
@@ -696,7 +1108,14 @@ class DifyService:
             logger.info(f"准备进行流式请求 - URL: {url}")
             
             # 使用stream_response方法实现真正的流式响应
-            async for chunk in self.stream_response(url, payload, user_id):
+            # 同一用户新会话的相同请求共享同一个上游流，后加入的请求会重放已产生的事件；
+            # 事件中带有会话ID，不同用户的请求不合并
+            if not conversation_id and settings.DIFY_SINGLE_FLIGHT_ENABLED:
+                key = make_flight_key("stream_chat", message, inputs or {}, user_id)
+                events = self._single_flight.stream(key, lambda: self.stream_response(url, payload, user_id))
+            else:
+                events = self.stream_response(url, payload, user_id)
+            async for chunk in events:
                 # 确保所有事件都符合前端预期的格式
                 # 直接传递事件，保持原始的event字段
                 yield chunk
@@ -711,6 +1130,111 @@ class DifyService:
                 "error": error_message
             }
 
+    async def stream_passthrough(self, conversation_id: Optional[str], message: str,
+                                 user_id: Optional[str] = None,
+                                 inputs: Optional[Dict[str, Any]] = None) -> AsyncGenerator[bytes, None]:
+        """透传模式的流式聊天，直接产生上游SSE字节块
+
+        不解析事件、不重新序列化，只在响应开头查找会话ID（写入会话缓存）、任务ID
+        （客户端断开时用于停止生成）和消息ID；后续数据按行取出消息事件的回答片段，
+        结束后与消息ID一起写入本地会话记录。
+        """
+        if conversation_id and not user_id:
+            user_id = await self._get_cached_user_id(conversation_id)
+        user_id = user_id or str(uuid.uuid4())
+        payload = {
+            "inputs": inputs or {},
+            "query": message,
+            "response_mode": "streaming",
+            "user": user_id
+        }
+        if conversation_id:
+            payload["conversation_id"] = conversation_id
+        logger.info(f"透传流式聊天 - 会话ID: {conversation_id or '新会话'}, 用户ID: {user_id}")
+
+        try:
+            async with self._pooled_session() as session:
+                async with session.post(
+                    f"{self.base_url}/chat-messages",
+                    json=payload,
+                    headers=self.get_headers(),
+                    timeout=self._request_timeout(120)
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        logger.error(f"透传流式请求失败 - 状态码: {response.status}, 响应: {error_text}")
+                        yield self._passthrough_error(f"流式请求失败: {error_text[:200]}")
+                        return
+
+                    # 会话ID、任务ID和消息ID出现在第一个事件中，只检查响应开头的有限字节
+                    ids: Dict[str, str] = {}
+                    head: Optional[bytes] = b""
+                    answer_parts: List[str] = []
+                    pending = b""
+                    stream_started = time.monotonic()
+                    try:
+                        async for chunk in response.content.iter_any():
+                            if head is not None:
+                                head += chunk
+                                for match in _STREAM_ID_PATTERN.finditer(head):
+                                    ids.setdefault(match.group(1).decode(), match.group(2).decode("utf-8"))
+                                if len(ids) == 3 or len(head) > _PASSTHROUGH_HEAD_LIMIT:
+                                    head = None
+                                    if not conversation_id and ids.get("conversation_id"):
+                                        await self._cache_session(ids["conversation_id"], user_id)
+                                    if ids.get("task_id"):
+                                        self._track_stream(ids["task_id"], response, user_id)
+                            # 按行收集回答片段，用于写入本地会话记录
+                            lines = (pending + chunk).split(b"\n")
+                            pending = lines.pop()
+                            self._collect_answer(lines, answer_parts)
+                            yield chunk
+                    except (asyncio.CancelledError, GeneratorExit):
+                        if not self._untrack_stream(ids.get("task_id")):
+                            self._record_stream_aborted(stream_started, ids.get("task_id"), user_id)
+                        raise
+                    except aiohttp.ClientError:
+                        # 用户停止生成时连接被主动关闭，按正常结束处理
+                        if ids.get("task_id") not in self._stopped_tasks:
+                            raise
+                    finally:
+                        stopped = self._untrack_stream(ids.get("task_id"))
+                    self._record_stream_completed(stream_started, stopped)
+                    self._collect_answer([pending], answer_parts)
+                    await self._record_history(ids.get("conversation_id") or conversation_id, user_id,
+                                               ids.get("message_id"), message, "".join(answer_parts),
+                                               new_conversation=not conversation_id)
+                    if stopped:
+                        # 上游连接已被关闭，补发结束事件
+                        yield encode_event({
+                            "event": "message_end",
+                            "task_id": ids.get("task_id"),
+                            "conversation_id": ids.get("conversation_id") or conversation_id,
+                            "stopped": True
+                        })
+        except DifyOverloadedError:
+            raise
+        except Exception as e:
+            logger.error(f"透传流式聊天失败: {str(e) or type(e).__name__}")
+            yield self._passthrough_error(f"流式聊天失败: {str(e) or type(e).__name__}")
+
+    @staticmethod
+    def _collect_answer(lines: List[bytes], answer_parts: List[str]):
+        """从完整的SSE行中取出消息事件的回答片段，只解码回答字段本身"""
+        for line in lines:
+            if not _STREAM_ANSWER_EVENT.search(line):
+                continue
+            match = _STREAM_ANSWER_PATTERN.search(line)
+            if match:
+                try:
+                    answer_parts.append(json.loads(match.group(1)))
+                except ValueError:
+                    continue
+
+    @staticmethod
+    def _passthrough_error(message: str) -> bytes:
+        return SSEEncoder.error(message)
+
     async def get_vulnerability_advice(self, vulnerability_data: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
         """获取漏洞建议 - 返回流式响应"""
         try:
@@ -782,10 +1306,5 @@ class DifyService:
                 "error": error_message
             }
 
-def import_time_module():
-    """导入time模块的辅助函数"""
-    import time
-    return time
-
 # 创建服务实例
 dify_service = DifyService()
\ No newline at end of file
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.exceptions.dify_error import DifyOverloadedError
+from app.services.dify_scheduler import pin_request_priority, PRIORITY_BATCH
+from app.services.job_store import JobStore, JobEventBus, JOB_FINAL_STATUSES, OVERLOAD_MAX_RETRIES, job_store, job_event_bus
+
+logger = logging.getLogger(__name__)
+
+JOB_KIND = "enrichment"
+
+# 子任务处理函数：(漏洞ID, 是否强制重新生成) -> None，失败时抛出异常
+EnrichmentHandler = Callable[[int, bool], Awaitable[None]]
+# 子任务结果检查函数：漏洞ID -> 漏洞记录上是否仍有该补全类型的有效结果
+EnrichmentResultCheck = Callable[[int], bool]
+
+class EnrichmentJobManager:
+    """批量AI补全任务管理
+
+    一个任务包含若干漏洞和若干补全类型（风险评估、分析、修复建议），
+    每个 (漏洞, 类型) 为一个子项，由有限数量的协程并发处理并把结果写回漏洞记录。
+    子项完成后立即持久化，服务重启后继续执行；结果只写回内存中的漏洞记录，重启后可能已丢失，
+    因此已成功的子项只有在记录上仍有有效结果时才跳过，否则重新处理。
+    """
+
+    def __init__(self, store: JobStore, event_bus: JobEventBus):
+        self._store = store
+        self._event_bus = event_bus
+        self._handlers: Dict[str, EnrichmentHandler] = {}
+        self._result_checks: Dict[str, EnrichmentResultCheck] = {}
+        # 运行中的任务: 任务ID -> 后台协程
+        self._running: Dict[str, asyncio.Task] = {}
+        # 运行中任务的最新状态快照
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        self._shutting_down = False
+
+    def register_handler(self, task_name: str, handler: EnrichmentHandler,
+                         has_result: Optional[EnrichmentResultCheck] = None):
+        """注册补全类型的处理函数，has_result用于恢复任务时确认已成功子项的结果仍在记录上"""
+        self._handlers[task_name] = handler
+        if has_result is not None:
+            self._result_checks[task_name] = has_result
+
+    @property
+    def task_names(self) -> List[str]:
+        return list(self._handlers)
+
+    async def submit(self, vulnerability_ids: List[int], tasks: List[str],
+                     concurrency: int, force: bool) -> Dict[str, Any]:
+        """创建并启动补全任务"""
+        unknown = [name for name in tasks if name not in self._handlers]
+        if unknown:
+            raise ValueError(f"不支持的补全类型: {', '.join(unknown)}")
+        now = datetime.now().isoformat()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": JOB_KIND,
+            "status": "pending",
+            "params": {
+                "vulnerability_ids": vulnerability_ids,
+                "tasks": tasks,
+                "concurrency": max(1, min(concurrency, settings.DIFY_MAX_CONCURRENCY)),
+                "force": force
+            },
+            "progress": {
+                "total": len(vulnerability_ids) * len(tasks),
+                "succeeded": 0,
+                "failed": 0,
+                "started_at": None,
+                "finished_at": None
+            },
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        await self._store.create(job)
+        logger.info(f"已创建批量补全任务 - 任务ID: {job['id']}, 漏洞数: {len(vulnerability_ids)}, "
+                    f"补全类型: {tasks}, 并发数: {job['params']['concurrency']}")
+        self._start(job)
+        return self._public(job)
+
+    async def resume(self):
+        """恢复服务重启前未完成的任务"""
+        unfinished = await self._store.list(JOB_KIND, ["pending", "running"], limit=1000)
+        for job in unfinished:
+            if job["id"] not in self._running:
+                logger.info(f"恢复未完成的批量补全任务 - 任务ID: {job['id']}")
+                self._start(job)
+
+    async def shutdown(self):
+        """停止运行中的任务，保留运行状态以便重启后恢复"""
+        self._shutting_down = True
+        tasks = list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取消任务"""
+        job = await self.get(job_id)
+        if job is None:
+            return None
+        if job["status"] in JOB_FINAL_STATUSES:
+            return job
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        else:
+            await self._finish(await self._store.get(job_id), "cancelled")
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态，运行中的任务返回内存中的最新快照"""
+        snapshot = self._snapshots.get(job_id)
+        if snapshot is not None:
+            return self._public(snapshot)
+        job = await self._store.get(job_id)
+        if job is None or job["kind"] != JOB_KIND:
+            return None
+        return self._public(job)
+
+    async def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """列出最近的任务"""
+        jobs = await self._store.list(JOB_KIND, limit=limit)
+        return [self._public(self._snapshots.get(job["id"], job)) for job in jobs]
+
+    def _start(self, job: Dict[str, Any]):
+        self._snapshots[job["id"]] = job
+        self._running[job["id"]] = asyncio.create_task(self._run(job))
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        progress = job["progress"] or {}
+        done = progress.get("succeeded", 0) + progress.get("failed", 0)
+        elapsed = None
+        if progress.get("started_at"):
+            end = progress.get("finished_at") or datetime.now().isoformat()
+            elapsed = (datetime.fromisoformat(end) - datetime.fromisoformat(progress["started_at"])).total_seconds()
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "tasks": job["params"]["tasks"],
+            "concurrency": job["params"]["concurrency"],
+            "force": job["params"]["force"],
+            "total": progress.get("total", 0),
+            "succeeded": progress.get("succeeded", 0),
+            "failed": progress.get("failed", 0),
+            "remaining": progress.get("total", 0) - done,
+            "items_per_second": round(done / elapsed, 3) if elapsed else None,
+            "error": job.get("error"),
+            "created_at": job["created_at"],
+            "started_at": progress.get("started_at"),
+            "finished_at": progress.get("finished_at")
+        }
+
+    def _publish(self, job: Dict[str, Any], event: str, **extra):
+        self._event_bus.publish(job["id"], {"event": event, "job": self._public(job), **extra})
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        params = job["params"]
+        progress = job["progress"]
+        try:
+            done_items = await self._store.get_items(job_id)
+            lost = [key for key, item in done_items.items() if item["status"] == "succeeded" and not self._has_result(key)]
+            for key in lost:
+                del done_items[key]
+            if lost:
+                logger.info(f"已成功子项的结果已不在漏洞记录上，重新处理 - 任务ID: {job_id}, 子项数: {len(lost)}")
+            # 重启恢复时按已持久化的子项重新统计进度
+            progress["succeeded"] = sum(1 for item in done_items.values() if item["status"] == "succeeded")
+            progress["failed"] = sum(1 for item in done_items.values() if item["status"] == "failed")
+            progress["started_at"] = progress.get("started_at") or datetime.now().isoformat()
+            job["status"] = "running"
+            await self._store.update(job_id, status="running", progress=progress)
+            self._publish(job, "progress")
+
+            queue: asyncio.Queue = asyncio.Queue()
+            for vulnerability_id in params["vulnerability_ids"]:
+                for task_name in params["tasks"]:
+                    if f"{vulnerability_id}:{task_name}" not in done_items:
+                        queue.put_nowait((vulnerability_id, task_name))
+            logger.info(f"批量补全任务开始执行 - 任务ID: {job_id}, 待处理子项: {queue.qsize()}, "
+                        f"已完成子项: {len(done_items)}")
+
+            workers = [
+                asyncio.create_task(self._worker(job, queue))
+                for _ in range(min(params["concurrency"], max(queue.qsize(), 1)))
+            ]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+            await self._finish(job, "completed")
+        except asyncio.CancelledError:
+            if self._shutting_down:
+                logger.info(f"服务关闭，批量补全任务暂停 - 任务ID: {job_id}")
+            else:
+                await self._finish(job, "cancelled")
+        except Exception as e:
+            logger.exception(f"批量补全任务执行失败 - 任务ID: {job_id}, 错误: {str(e)}")
+            job["error"] = str(e)
+            await self._finish(job, "failed")
+        finally:
+            self._running.pop(job_id, None)
+            self._snapshots.pop(job_id, None)
+
+    def _has_result(self, item_key: str) -> bool:
+        vulnerability_id, _, task_name = item_key.partition(":")
+        check = self._result_checks.get(task_name)
+        if check is None:
+            return True
+        try:
+            return check(int(vulnerability_id))
+        except Exception as e:
+            logger.warning(f"检查补全结果失败，将重新处理 - 子项: {item_key}, 错误: {str(e)}")
+            return False
+
+    async def _worker(self, job: Dict[str, Any], queue: asyncio.Queue):
+        # 批量补全不与交互请求争抢，所有上游调用都以批量优先级排队
+        pin_request_priority(PRIORITY_BATCH)
+        while not queue.empty():
+            vulnerability_id, task_name = queue.get_nowait()
+            status, error = await self._process(job, vulnerability_id, task_name)
+            job["progress"][status] += 1
+            self._publish(job, "item", item={
+                "vulnerability_id": vulnerability_id,
+                "task": task_name,
+                "status": status,
+                "error": error
+            })
+            await self._store.set_item(job["id"], f"{vulnerability_id}:{task_name}", status, error)
+            await self._store.update(job["id"], progress=job["progress"])
+
+    async def _process(self, job: Dict[str, Any], vulnerability_id: int, task_name: str):
+        handler = self._handlers[task_name]
+        started = time.monotonic()
+        for attempt in range(OVERLOAD_MAX_RETRIES + 1):
+            try:
+                await handler(vulnerability_id, job["params"]["force"])
+                logger.info(f"批量补全子项完成 - 任务ID: {job['id']}, 漏洞ID: {vulnerability_id}, "
+                            f"类型: {task_name}, 耗时: {time.monotonic() - started:.2f}秒")
+                return "succeeded", None
+            except DifyOverloadedError as e:
+                if attempt == OVERLOAD_MAX_RETRIES:
+                    return "failed", str(e)
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                error = str(getattr(e, "detail", None) or e)
+                logger.error(f"批量补全子项失败 - 任务ID: {job['id']}, 漏洞ID: {vulnerability_id}, "
+                             f"类型: {task_name}, 错误: {error}")
+                return "failed", error
+
+    async def _finish(self, job: Dict[str, Any], status: str):
+        job["status"] = status
+        job["progress"]["finished_at"] = datetime.now().isoformat()
+        await self._store.update(job["id"], status=status, progress=job["progress"], error=job.get("error"))
+        logger.info(f"批量补全任务结束 - 任务ID: {job['id']}, 状态: {status}, "
+                    f"成功: {job['progress']['succeeded']}, 失败: {job['progress']['failed']}")
+        self._publish(job, "end")
+
+# 创建全局实例
+enrichment_job_manager = EnrichmentJobManager(job_store, job_event_bus)
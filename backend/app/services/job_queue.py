@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from app.core.config import settings
+from app.exceptions.dify_error import DifyOverloadedError
+from app.services.job_store import JobStore, JobEventBus, JOB_FINAL_STATUSES, OVERLOAD_MAX_RETRIES, job_store, job_event_bus
+
+logger = logging.getLogger(__name__)
+
+# 任务处理函数：任务参数 -> 任务结果，失败时抛出异常
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+class AIJobQueue:
+    """长耗时AI调用的后台任务队列
+
+    提交后立即返回任务ID，由固定数量的工作协程依次执行，HTTP请求无需等待整个LLM往返。
+    任务状态和结果持久化到任务存储，服务重启后未完成的任务重新排队执行。
+    """
+
+    def __init__(self, store: JobStore, event_bus: JobEventBus, workers: int):
+        self._store = store
+        self._event_bus = event_bus
+        self._worker_count = workers
+        self._handlers: Dict[str, JobHandler] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # 执行中的任务: 任务ID -> 处理协程
+        self._running: Dict[str, asyncio.Task] = {}
+        # 已请求取消的任务ID
+        self._cancel_requested: Set[str] = set()
+
+    def register_handler(self, kind: str, handler: JobHandler):
+        """注册任务类型的处理函数"""
+        self._handlers[kind] = handler
+
+    async def start(self):
+        """启动工作协程，并重新排队重启前未完成的任务"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        unfinished = await self._store.list(statuses=["pending", "running"], limit=10000)
+        for job in reversed(unfinished):
+            if job["kind"] in self._handlers:
+                logger.info(f"重新排队未完成的AI任务 - 任务ID: {job['id']}, 类型: {job['kind']}")
+                self._queue.put_nowait(job["id"])
+        for _ in range(self._worker_count - len(self._workers)):
+            self._workers.append(asyncio.create_task(self._worker()))
+        logger.info(f"AI任务队列已启动 - 工作协程数: {self._worker_count}, 待执行任务: {self._queue.qsize()}")
+
+    async def stop(self):
+        """停止工作协程，执行中的任务保持running状态，重启后重新执行"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """提交任务，返回任务状态"""
+        if kind not in self._handlers:
+            raise ValueError(f"不支持的任务类型: {kind}")
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        now = datetime.now().isoformat()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": "pending",
+            "params": params,
+            "progress": {"started_at": None, "finished_at": None},
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        await self._store.create(job)
+        self._queue.put_nowait(job["id"])
+        logger.info(f"已提交AI任务 - 任务ID: {job['id']}, 类型: {kind}, 排队数: {self._queue.qsize()}")
+        return self._public(job)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态和结果"""
+        job = await self._store.get(job_id)
+        if job is None or job["kind"] not in self._handlers:
+            return None
+        return self._public(job)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取消任务：排队中的任务不再执行，执行中的任务立即中断"""
+        job = await self._store.get(job_id)
+        if job is None or job["kind"] not in self._handlers:
+            return None
+        if job["status"] in JOB_FINAL_STATUSES:
+            return self._public(job)
+        self._cancel_requested.add(job_id)
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        else:
+            await self._finish(job, "cancelled")
+        return await self.get(job_id)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取任务队列指标"""
+        return {
+            "workers": len(self._workers),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": len(self._running)
+        }
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        progress = job["progress"] or {}
+        return {
+            "job_id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "result": job["result"],
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "started_at": progress.get("started_at"),
+            "finished_at": progress.get("finished_at")
+        }
+
+    def _publish(self, job: Dict[str, Any], event: str):
+        self._event_bus.publish(job["id"], {"event": event, "job": self._public(job)})
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._execute(job_id)
+            except Exception as e:
+                logger.exception(f"AI任务执行异常 - 任务ID: {job_id}, 错误: {str(e)}")
+
+    async def _execute(self, job_id: str):
+        job = await self._store.get(job_id)
+        if job is None or job["status"] in JOB_FINAL_STATUSES:
+            return
+        if job_id in self._cancel_requested:
+            self._cancel_requested.discard(job_id)
+            await self._finish(job, "cancelled")
+            return
+
+        job["status"] = "running"
+        job["progress"]["started_at"] = datetime.now().isoformat()
+        await self._store.update(job_id, status="running", progress=job["progress"])
+        self._publish(job, "status")
+        logger.info(f"开始执行AI任务 - 任务ID: {job_id}, 类型: {job['kind']}")
+
+        task = asyncio.create_task(self._call_handler(job))
+        self._running[job_id] = task
+        try:
+            job["result"] = await task
+            await self._finish(job, "completed")
+        except asyncio.CancelledError:
+            if job_id not in self._cancel_requested:
+                # 工作协程本身被停止（服务关闭），保留running状态等待重启后重新执行
+                task.cancel()
+                raise
+            await self._finish(job, "cancelled")
+        except Exception as e:
+            job["error"] = str(getattr(e, "detail", None) or e)
+            logger.error(f"AI任务失败 - 任务ID: {job_id}, 错误: {job['error']}")
+            await self._finish(job, "failed")
+        finally:
+            self._running.pop(job_id, None)
+            self._cancel_requested.discard(job_id)
+
+    async def _call_handler(self, job: Dict[str, Any]) -> Any:
+        handler = self._handlers[job["kind"]]
+        for attempt in range(OVERLOAD_MAX_RETRIES + 1):
+            try:
+                return await handler(job["params"])
+            except DifyOverloadedError as e:
+                if attempt == OVERLOAD_MAX_RETRIES:
+                    raise
+                logger.warning(f"AI服务繁忙，任务稍后重试 - 任务ID: {job['id']}, 第{attempt + 1}次")
+                await asyncio.sleep(e.retry_after)
+
+    async def _finish(self, job: Dict[str, Any], status: str):
+        job["status"] = status
+        job["progress"]["finished_at"] = datetime.now().isoformat()
+        job["updated_at"] = job["progress"]["finished_at"]
+        await self._store.update(job["id"], status=status, progress=job["progress"],
+                                 result=job["result"], error=job["error"])
+        logger.info(f"AI任务结束 - 任务ID: {job['id']}, 类型: {job['kind']}, 状态: {status}")
+        self._publish(job, "end")
+
+# 创建全局实例
+ai_job_queue = AIJobQueue(job_store, job_event_bus, settings.AI_JOB_WORKERS)
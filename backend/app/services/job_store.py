@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 任务终态
+JOB_FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# 后台任务被调度器拒绝时的最大重试次数
+OVERLOAD_MAX_RETRIES = 3
+
+# 以JSON文本保存的字段
+_JSON_FIELDS = ("params", "progress", "result")
+
+class JobStore:
+    """后台任务状态的持久化存储
+
+    任务及其子项的状态保存在SQLite中，服务重启后可以据此恢复未完成的任务。
+    未配置数据库路径时使用内存数据库，只在进程内有效。
+    """
+
+    def __init__(self, db_path: Optional[str]):
+        self._db_path = db_path or ":memory:"
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            if self._db_path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self._db_path)), exist_ok=True)
+            self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            if self._db_path != ":memory:":
+                self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+                "params TEXT, progress TEXT, result TEXT, error TEXT, "
+                "created_at TEXT NOT NULL, updated_at TEXT NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_kind_status ON jobs (kind, status)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS job_items ("
+                "job_id TEXT NOT NULL, item_key TEXT NOT NULL, status TEXT NOT NULL, "
+                "error TEXT, updated_at TEXT NOT NULL, PRIMARY KEY (job_id, item_key))"
+            )
+            self._db.commit()
+            logger.info(f"任务存储已打开: {self._db_path}")
+        return self._db
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        for field in _JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def _create(self, job: Dict[str, Any]):
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "INSERT INTO jobs (id, kind, status, params, progress, result, error, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["kind"], job["status"],
+                 json.dumps(job.get("params"), ensure_ascii=False),
+                 json.dumps(job.get("progress"), ensure_ascii=False),
+                 json.dumps(job.get("result"), ensure_ascii=False, default=str),
+                 job.get("error"), job["created_at"], job["updated_at"])
+            )
+            db.commit()
+
+    def _update(self, job_id: str, fields: Dict[str, Any]):
+        fields = dict(fields)
+        fields["updated_at"] = datetime.now().isoformat()
+        columns = []
+        values = []
+        for name, value in fields.items():
+            if name in _JSON_FIELDS:
+                value = json.dumps(value, ensure_ascii=False, default=str)
+            columns.append(f"{name} = ?")
+            values.append(value)
+        values.append(job_id)
+        with self._lock:
+            db = self._connect()
+            db.execute(f"UPDATE jobs SET {', '.join(columns)} WHERE id = ?", values)
+            db.commit()
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def _list(self, kind: Optional[str], statuses: Optional[List[str]], limit: int) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM jobs WHERE 1 = 1"
+        params: List[Any] = []
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        if statuses:
+            query += f" AND status IN ({', '.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def _set_item(self, job_id: str, item_key: str, status: str, error: Optional[str]):
+        with self._lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO job_items (job_id, item_key, status, error, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, item_key, status, error, datetime.now().isoformat())
+            )
+            db.commit()
+
+    def _get_items(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT item_key, status, error FROM job_items WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        return {row["item_key"]: {"status": row["status"], "error": row["error"]} for row in rows}
+
+    async def create(self, job: Dict[str, Any]):
+        """保存新任务"""
+        await asyncio.to_thread(self._create, job)
+
+    async def update(self, job_id: str, **fields):
+        """更新任务字段"""
+        await asyncio.to_thread(self._update, job_id, fields)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务"""
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def list(self, kind: Optional[str] = None, statuses: Optional[List[str]] = None,
+                   limit: int = 50) -> List[Dict[str, Any]]:
+        """按创建时间倒序列出任务"""
+        return await asyncio.to_thread(self._list, kind, statuses, limit)
+
+    async def set_item(self, job_id: str, item_key: str, status: str, error: Optional[str] = None):
+        """记录任务子项的处理结果"""
+        await asyncio.to_thread(self._set_item, job_id, item_key, status, error)
+
+    async def get_items(self, job_id: str) -> Dict[str, Dict[str, Any]]:
+        """获取任务所有子项的处理结果"""
+        return await asyncio.to_thread(self._get_items, job_id)
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+class JobEventBus:
+    """任务进度事件的进程内发布订阅"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(job_id)
+        if queues and queue in queues:
+            queues.remove(queue)
+            if not queues:
+                del self._subscribers[job_id]
+
+    def publish(self, job_id: str, event: Dict[str, Any]):
+        for queue in self._subscribers.get(job_id, []):
+            queue.put_nowait(event)
+
+# 创建全局实例
+job_store = JobStore(settings.AI_JOB_DB)
+job_event_bus = JobEventBus()
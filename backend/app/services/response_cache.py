@@ -0,0 +1,197 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 属于原始调用方的会话标识，不随缓存内容返回给其他请求
+IDENTITY_FIELDS = ("conversation_id", "user_id", "message_id", "is_new_conversation")
+
+def _without_identity(value: Dict[str, Any]) -> Dict[str, Any]:
+    """返回去掉会话标识的深拷贝"""
+    return copy.deepcopy({k: v for k, v in value.items() if k not in IDENTITY_FIELDS})
+
+class AIResponseCache:
+    """AI响应的内容寻址缓存
+
+    缓存键为 (模板名称, 渲染后的提示词, Dify应用) 的哈希。
+    内存层为LRU，磁盘层为带TTL的SQLite，内存未命中时回源磁盘并回填内存。
+    只缓存回答内容，不包含原始调用方的会话ID、用户ID等标识；读取时返回副本，
+    调用方修改返回结果不影响缓存。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, db_path: Optional[str]):
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._db_path = db_path
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._sets_since_purge = 0
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def make_key(template_name: str, prompt: str, app_id: str) -> str:
+        """计算缓存键"""
+        digest = hashlib.sha256()
+        for part in (template_name, app_id, prompt):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    @staticmethod
+    def is_enabled_for(endpoint: str) -> bool:
+        """判断指定端点是否启用缓存"""
+        return settings.AI_RESPONSE_CACHE_ENABLED and endpoint not in settings.AI_RESPONSE_CACHE_DISABLED_ENDPOINTS
+
+    def _count(self, template_name: str, field: str):
+        stats = self._stats.setdefault(template_name, {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0})
+        stats[field] += 1
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if not self._db_path:
+            return None
+        if self._db is None:
+            directory = os.path.dirname(os.path.abspath(self._db_path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ai_response_cache ("
+                "key TEXT PRIMARY KEY, template_name TEXT NOT NULL, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            logger.info(f"AI响应磁盘缓存已打开: {self._db_path}")
+        return self._db
+
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return value
+
+    def _memory_set(self, key: str, value: Dict[str, Any], expires_at: float):
+        with self._memory_lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self._max_entries:
+                self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return None
+            row = db.execute(
+                "SELECT value, expires_at FROM ai_response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                db.execute("DELETE FROM ai_response_cache WHERE key = ?", (key,))
+                db.commit()
+                return None
+            return row[1], json.loads(row[0])
+
+    def _disk_set(self, key: str, template_name: str, value: Dict[str, Any], expires_at: float):
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return
+            db.execute(
+                "INSERT OR REPLACE INTO ai_response_cache (key, template_name, value, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, template_name, json.dumps(value, ensure_ascii=False), time.time(), expires_at)
+            )
+            self._sets_since_purge += 1
+            if self._sets_since_purge >= 100:
+                db.execute("DELETE FROM ai_response_cache WHERE expires_at < ?", (time.time(),))
+                self._sets_since_purge = 0
+            db.commit()
+
+    async def get(self, key: str, template_name: str) -> Optional[Dict[str, Any]]:
+        """读取缓存，依次查询内存层和磁盘层"""
+        value = self._memory_get(key)
+        if value is not None:
+            self._count(template_name, "memory_hits")
+            return _without_identity(value)
+
+        try:
+            entry = await asyncio.to_thread(self._disk_get, key)
+        except Exception as e:
+            logger.error(f"读取AI响应磁盘缓存失败: {str(e)}")
+            entry = None
+        if entry is not None:
+            expires_at, value = entry
+            self._memory_set(key, value, expires_at)
+            self._count(template_name, "disk_hits")
+            return _without_identity(value)
+
+        self._count(template_name, "misses")
+        return None
+
+    async def set(self, key: str, template_name: str, value: Dict[str, Any]):
+        """写入缓存，同时写入内存层和磁盘层"""
+        expires_at = time.time() + self._ttl
+        value = _without_identity(value)
+        self._memory_set(key, value, expires_at)
+        self._count(template_name, "stores")
+        try:
+            await asyncio.to_thread(self._disk_set, key, template_name, value, expires_at)
+        except Exception as e:
+            logger.error(f"写入AI响应磁盘缓存失败: {str(e)}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取缓存命中率指标"""
+        totals = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        by_template = {}
+        for template_name, stats in self._stats.items():
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            by_template[template_name] = {
+                **stats,
+                "hit_rate": round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+            }
+            for field in totals:
+                totals[field] += stats[field]
+        lookups = totals["memory_hits"] + totals["disk_hits"] + totals["misses"]
+        return {
+            "enabled": settings.AI_RESPONSE_CACHE_ENABLED,
+            "memory_entries": len(self._memory),
+            "memory_max_entries": self._max_entries,
+            "disk_enabled": bool(self._db_path),
+            **totals,
+            "hit_rate": round((totals["memory_hits"] + totals["disk_hits"]) / lookups, 4) if lookups else 0.0,
+            "by_template": by_template
+        }
+
+    def close(self):
+        """关闭磁盘缓存连接"""
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+# 创建全局实例
+ai_response_cache = AIResponseCache(
+    max_entries=settings.AI_RESPONSE_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.AI_RESPONSE_CACHE_TTL,
+    db_path=settings.AI_RESPONSE_CACHE_DB
+)
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class SessionCache:
+    """Dify会话到用户ID的映射缓存
+
+    内存层为有界LRU，条目超过TTL后失效；配置了数据库路径时写入SQLite，
+    服务重启后仍可恢复，多个工作进程共用同一文件时也能互相读取对方创建的会话。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, db_path: Optional[str]):
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._db_path = db_path
+        # 会话ID -> (过期时间, 用户ID)
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._sets_since_purge = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evicted_lru": 0,
+            "evicted_expired": 0
+        }
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if not self._db_path:
+            return None
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self._db_path)), exist_ok=True)
+            self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS dify_sessions ("
+                "conversation_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            logger.info(f"会话缓存已打开: {self._db_path}")
+        return self._db
+
+    def _memory_get(self, conversation_id: str) -> Optional[str]:
+        with self._memory_lock:
+            entry = self._memory.get(conversation_id)
+            if entry is None:
+                return None
+            expires_at, user_id = entry
+            if expires_at < time.time():
+                del self._memory[conversation_id]
+                self._stats["evicted_expired"] += 1
+                return None
+            self._memory.move_to_end(conversation_id)
+            return user_id
+
+    def _memory_set(self, conversation_id: str, user_id: str, expires_at: float):
+        with self._memory_lock:
+            self._memory[conversation_id] = (expires_at, user_id)
+            self._memory.move_to_end(conversation_id)
+            while len(self._memory) > self._max_entries:
+                self._memory.popitem(last=False)
+                self._stats["evicted_lru"] += 1
+
+    def _disk_get(self, conversation_id: str) -> Optional[Tuple[float, str]]:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return None
+            row = db.execute(
+                "SELECT user_id, expires_at FROM dify_sessions WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            if row is None or row[1] < time.time():
+                return None
+            return row[1], row[0]
+
+    def _disk_set(self, conversation_id: str, user_id: str, expires_at: float):
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return
+            now = time.time()
+            db.execute(
+                "INSERT OR REPLACE INTO dify_sessions (conversation_id, user_id, updated_at, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (conversation_id, user_id, now, expires_at)
+            )
+            self._sets_since_purge += 1
+            if self._sets_since_purge >= 100:
+                db.execute("DELETE FROM dify_sessions WHERE expires_at < ?", (now,))
+                self._sets_since_purge = 0
+            db.commit()
+
+    async def get(self, conversation_id: str) -> Optional[str]:
+        """获取会话对应的用户ID，依次查询内存层和磁盘层"""
+        user_id = self._memory_get(conversation_id)
+        if user_id is not None:
+            self._stats["memory_hits"] += 1
+            return user_id
+
+        try:
+            entry = await asyncio.to_thread(self._disk_get, conversation_id)
+        except Exception as e:
+            logger.error(f"读取会话缓存失败: {str(e)}")
+            entry = None
+        if entry is not None:
+            expires_at, user_id = entry
+            self._memory_set(conversation_id, user_id, expires_at)
+            self._stats["disk_hits"] += 1
+            return user_id
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, conversation_id: str, user_id: str):
+        """记录会话对应的用户ID，重复写入时刷新过期时间"""
+        expires_at = time.time() + self._ttl
+        self._memory_set(conversation_id, user_id, expires_at)
+        self._stats["stores"] += 1
+        try:
+            await asyncio.to_thread(self._disk_set, conversation_id, user_id, expires_at)
+        except Exception as e:
+            logger.error(f"写入会话缓存失败: {str(e)}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取会话缓存指标"""
+        stats = self._stats
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        return {
+            "memory_entries": len(self._memory),
+            "memory_max_entries": self._max_entries,
+            "ttl_seconds": self._ttl,
+            "disk_enabled": bool(self._db_path),
+            **stats,
+            "hit_rate": round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        }
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+# 创建全局实例
+session_cache = SessionCache(
+    max_entries=settings.DIFY_SESSION_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.DIFY_SESSION_CACHE_TTL,
+    db_path=settings.DIFY_SESSION_CACHE_DB
+)
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import json
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+def make_flight_key(*parts: Any) -> str:
+    """根据请求参数计算合并键"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class SharedStream:
+    """被多个订阅者共享的上游事件流
+
+    上游事件由单个后台任务拉取并保存，订阅者先重放已产生的事件，再实时接收后续事件。
+    最后一个订阅者离开且上游尚未结束时取消上游任务；设置了linger时等待该时间，
+    期间有订阅者重新加入则继续。设置了max_events时只保留最近的事件。
+    """
+
+    def __init__(self, key: str, source: AsyncIterator[Any],
+                 on_done: Callable[["SharedStream"], None],
+                 max_events: Optional[int] = None, linger: float = 0):
+        self.key = key
+        self._events: Deque[Any] = deque(maxlen=max_events)
+        # 已从缓冲中淘汰的事件数，第i个缓冲事件的序号为 _dropped + i + 1
+        self._dropped = 0
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self._linger = linger
+        self._linger_handle: Optional[asyncio.TimerHandle] = None
+        self._on_done = on_done
+        self._task = asyncio.create_task(self._pump(source))
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
+
+    @property
+    def linger(self) -> float:
+        """最后一个订阅者离开后等待重新加入的秒数"""
+        return self._linger
+
+    @linger.setter
+    def linger(self, value: float):
+        self._linger = value
+
+    @property
+    def last_seq(self) -> int:
+        """最后一个事件的序号"""
+        return self._dropped + len(self._events)
+
+    @property
+    def first_seq(self) -> int:
+        """缓冲中最早事件的序号"""
+        return self._dropped + 1
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for event in source:
+                if len(self._events) == self._events.maxlen:
+                    self._dropped += 1
+                self._events.append(event)
+                self._notify()
+        except asyncio.CancelledError:
+            logger.info(f"共享流已取消 - 键: {self.key[:12]}")
+        except Exception as e:
+            self._error = e
+        finally:
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception:
+                    pass
+            self._done = True
+            self._notify()
+            self._on_done(self)
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """订阅事件流，从第一个事件开始重放"""
+        async for _, event in self.subscribe_from(0):
+            yield event
+
+    async def subscribe_from(self, after: int,
+                             heartbeat: Optional[float] = None) -> AsyncIterator[Tuple[int, Optional[Any]]]:
+        """从序号after之后开始订阅，产生(序号, 事件)
+
+        after之后的事件已被淘汰时从缓冲中最早的事件开始。设置heartbeat时，
+        超过该秒数没有新事件则产生(序号, None)，供调用方发送保活数据。
+        """
+        self._subscribers += 1
+        if self._linger_handle is not None:
+            self._linger_handle.cancel()
+            self._linger_handle = None
+        seq = after
+        try:
+            while True:
+                # 产生事件期间缓冲可能继续淘汰，每次都重新校正位置
+                while max(seq, self._dropped) < self.last_seq:
+                    seq = max(seq, self._dropped)
+                    event = self._events[seq - self._dropped]
+                    seq += 1
+                    yield seq, dict(event) if isinstance(event, dict) else event
+                if self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                if heartbeat is None:
+                    await self._changed.wait()
+                else:
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout=heartbeat)
+                    except asyncio.TimeoutError:
+                        yield seq, None
+        finally:
+            self._subscribers -= 1
+            if self._subscribers == 0 and not self._done:
+                if self._linger > 0:
+                    self._linger_handle = asyncio.get_running_loop().call_later(self._linger, self._cancel_if_idle)
+                else:
+                    self._task.cancel()
+
+    def _cancel_if_idle(self):
+        self._linger_handle = None
+        if self._subscribers == 0 and not self._done:
+            logger.info(f"共享流无订阅者超过{self._linger}秒，取消上游 - 键: {self.key[:12]}")
+            self._task.cancel()
+
+    def cancel(self):
+        """立即取消上游任务"""
+        if not self._done:
+            self._task.cancel()
+
+class SingleFlight:
+    """相同请求的并发合并
+
+    同一键只有一个上游调用在进行中，期间到达的相同请求等待并共享其结果；
+    流式请求通过SharedStream共享，后加入的订阅者会重放已产生的事件。
+    调用结束后立即移除，不作为结果缓存使用。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, Dict[str, Any]] = {}
+        self._streams: Dict[str, SharedStream] = {}
+        self._stats = {
+            "calls_started": 0,
+            "calls_joined": 0,
+            "streams_started": 0,
+            "streams_joined": 0
+        }
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """执行请求，相同键的请求正在进行时等待其结果"""
+        call = self._calls.get(key)
+        if call is None:
+            call = {"task": asyncio.ensure_future(factory()), "waiters": 0}
+            self._calls[key] = call
+            call["task"].add_done_callback(lambda _: self._release_call(key, call))
+            self._stats["calls_started"] += 1
+        else:
+            self._stats["calls_joined"] += 1
+            logger.info(f"合并相同的进行中请求 - 键: {key[:12]}, 等待数: {call['waiters'] + 1}")
+
+        call["waiters"] += 1
+        try:
+            # shield保证单个调用方被取消时不影响其他等待者
+            return await asyncio.shield(call["task"])
+        except asyncio.CancelledError:
+            if call["waiters"] == 1 and not call["task"].done():
+                call["task"].cancel()
+            raise
+        finally:
+            call["waiters"] -= 1
+
+    def _release_call(self, key: str, call: Dict[str, Any]):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        task = call["task"]
+        if not task.cancelled():
+            # 标记异常已被读取，避免无人等待时输出未处理异常警告
+            task.exception()
+
+    async def stream(self, key: str,
+                     factory: Callable[[], AsyncIterator[Dict[str, Any]]]) -> AsyncIterator[Dict[str, Any]]:
+        """订阅流式请求，相同键的流正在进行时加入该流"""
+        shared = self._streams.get(key)
+        if shared is None or shared.done:
+            shared = SharedStream(key, factory(), self._release_stream)
+            self._streams[key] = shared
+            self._stats["streams_started"] += 1
+        else:
+            self._stats["streams_joined"] += 1
+            logger.info(f"加入进行中的共享流 - 键: {key[:12]}, 订阅数: {shared.subscribers + 1}")
+
+        async for event in shared.subscribe():
+            yield event
+
+    def _release_stream(self, shared: SharedStream):
+        if self._streams.get(shared.key) is shared:
+            del self._streams[shared.key]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取请求合并指标"""
+        return {
+            **self._stats,
+            "calls_in_flight": len(self._calls),
+            "streams_in_flight": len(self._streams)
+        }
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.single_flight import SharedStream
+
+logger = logging.getLogger(__name__)
+
+class ResumableStreamRegistry:
+    """可断点续传的SSE流
+
+    每个流的输出帧由后台任务生成并保存在有界环形缓冲中，每帧带有
+    "流ID-序号"格式的事件ID。客户端断线后携带Last-Event-ID重连，从该事件之后继续接收，
+    不会重新发起一次生成。客户端声明支持续传时，所有连接都断开后上游继续保留linger秒等待重连，
+    流结束后同样保留linger秒，供断线的客户端取回结尾部分；不支持续传的流在连接断开后立即取消上游。
+    相同内容的流可以作为广播流被多个客户端共享，只有全部订阅者离开后才取消上游。
+    """
+
+    def __init__(self, buffer_size: int, linger: float, keepalive: float):
+        self._buffer_size = buffer_size
+        self._linger = linger
+        self._keepalive = keepalive
+        self._streams: Dict[str, SharedStream] = {}
+        # 广播流: 共享键 -> 流ID，以及反向索引
+        self._broadcasts: Dict[str, str] = {}
+        self._broadcast_keys: Dict[str, str] = {}
+        self._stats = {
+            "started": 0,
+            "resumed": 0,
+            "resume_misses": 0,
+            "replayed_frames": 0,
+            "resume_gaps": 0,
+            "broadcast_started": 0,
+            "broadcast_joined": 0
+        }
+
+    def start(self, frames: AsyncIterator[Any], resumable: bool = True) -> str:
+        """开始一个新的流，返回流ID"""
+        stream_id = uuid.uuid4().hex
+        self._streams[stream_id] = SharedStream(
+            stream_id, frames, self._on_done, max_events=self._buffer_size,
+            linger=self._linger if resumable else 0
+        )
+        self._stats["started"] += 1
+        return stream_id
+
+    def open(self, factory: Callable[[], AsyncIterator[Any]], share_key: Optional[str] = None,
+             resumable: bool = True) -> str:
+        """打开流，返回流ID
+
+        指定share_key时作为广播流：相同键的流正在进行时直接加入，不再调用factory，
+        订阅者从第一帧开始重放再接收实时帧；流结束后新的请求重新生成。
+        resumable为False时客户端不会凭Last-Event-ID重连，断开后不等待；支持续传的订阅者加入广播流时启用等待。
+        """
+        if share_key:
+            stream_id = self._broadcasts.get(share_key)
+            stream = self._streams.get(stream_id) if stream_id else None
+            if stream is not None and not stream.done:
+                if resumable:
+                    stream.linger = self._linger
+                self._stats["broadcast_joined"] += 1
+                logger.info(f"加入进行中的广播流 - 流ID: {stream_id}, 订阅数: {stream.subscribers + 1}")
+                return stream_id
+        stream_id = self.start(factory(), resumable)
+        if share_key:
+            self._broadcasts[share_key] = stream_id
+            self._broadcast_keys[stream_id] = share_key
+            self._stats["broadcast_started"] += 1
+        return stream_id
+
+    def _on_done(self, stream: SharedStream):
+        share_key = self._broadcast_keys.pop(stream.key, None)
+        if share_key and self._broadcasts.get(share_key) == stream.key:
+            del self._broadcasts[share_key]
+        # 结束后保留一段时间，供断线的客户端重连取回剩余部分
+        asyncio.get_running_loop().call_later(stream.linger, self._streams.pop, stream.key, None)
+
+    def resolve(self, last_event_id: Optional[str]) -> Optional[Tuple[str, int]]:
+        """解析Last-Event-ID，流仍可续传时返回(流ID, 序号)"""
+        if not last_event_id:
+            return None
+        stream_id, _, seq = last_event_id.strip().rpartition("-")
+        if stream_id in self._streams and seq.isdigit():
+            return stream_id, int(seq)
+        self._stats["resume_misses"] += 1
+        logger.info(f"无法续传的Last-Event-ID: {last_event_id}")
+        return None
+
+    async def serve(self, stream_id: str, after: int = 0) -> AsyncIterator[bytes]:
+        """输出带事件ID的SSE帧，从序号after之后开始；长时间无数据时发送保活注释"""
+        stream = self._streams[stream_id]
+        if after:
+            self._stats["resumed"] += 1
+            if after + 1 < stream.first_seq:
+                self._stats["resume_gaps"] += 1
+                logger.warning(f"续传位置已超出缓冲 - 流ID: {stream_id}, 请求序号: {after}, 最早序号: {stream.first_seq}")
+            logger.info(f"客户端重连续传 - 流ID: {stream_id}, 从序号 {after} 之后开始, 已产生 {stream.last_seq} 帧")
+        # 重连时已产生的帧属于重放部分
+        replay_until = stream.last_seq if after else 0
+        async for seq, frame in stream.subscribe_from(after, heartbeat=self._keepalive):
+            if frame is None:
+                yield b": keepalive\n\n"
+                continue
+            if seq <= replay_until:
+                self._stats["replayed_frames"] += 1
+            if isinstance(frame, str):
+                frame = frame.encode("utf-8")
+            yield b"id: " + f"{stream_id}-{seq}".encode() + b"\n" + frame
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取续传指标"""
+        return {
+            **self._stats,
+            "active": sum(1 for stream in self._streams.values() if not stream.done),
+            "retained": len(self._streams),
+            "broadcasts": len(self._broadcasts),
+            "subscribers": sum(stream.subscribers for stream in self._streams.values()),
+            "buffer_size": self._buffer_size
+        }
+
+# 创建全局实例
+resumable_streams = ResumableStreamRegistry(
+    buffer_size=settings.SSE_REPLAY_BUFFER_SIZE,
+    linger=settings.SSE_RESUME_LINGER_SECONDS,
+    keepalive=settings.SSE_KEEPALIVE_SECONDS
+)
@@ -0,0 +1,146 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.asset_risk import (
+    RISK_LEVEL_DEFAULT_SCORES, importance_weight, network_weight, exposure_weight
+)
+
+logger = logging.getLogger(__name__)
+
+# 技术风险在VPR中的最低占比，其余部分由资产系数决定
+TECHNICAL_BASE_RATIO = 0.55
+
+def priority_for_vpr(vpr_score: float) -> Optional[str]:
+    """根据配置的VPR优先级映射确定优先级
+
+    映射区间之间存在0.1的间隙（如8.4-8.5），落在间隙中的评分归入下限不超过该评分的最高区间。
+    """
+    best_priority = None
+    best_min = None
+    for priority, score_range in settings.VPR_PRIORITY_MAPPING.items():
+        min_score, max_score = score_range
+        if min_score <= vpr_score <= max_score:
+            return priority
+        if min_score <= vpr_score and (best_min is None or min_score > best_min):
+            best_priority, best_min = priority, min_score
+    return best_priority
+
+class VPRScoringEngine:
+    """本地确定性VPR评分引擎
+
+    使用与风险评估提示词相同的因素：CVSS评分、漏洞类型、资产等级、网络属性和暴露面。
+    VPR = min(10, CVSS × 漏洞类型系数) × (0.55 + 0.45 × 资产系数)
+    其中资产系数为关联资产中 资产等级权重 × 网络属性权重 × 暴露面权重 的最大值。
+    单个评分和批量评分使用相同的资产规则：资产库中有的资产以资产库记录为准，
+    资产库中没有的资产使用漏洞记录上携带的属性。
+    """
+
+    @staticmethod
+    def _base_score(vulnerability: Dict[str, Any]) -> float:
+        cvss_score = vulnerability.get("cvss_score")
+        if cvss_score is not None:
+            return float(cvss_score)
+        return RISK_LEVEL_DEFAULT_SCORES.get(vulnerability.get("risk_level"), 5.0)
+
+    @staticmethod
+    def _type_weight(vulnerability: Dict[str, Any]) -> float:
+        return settings.VULNERABILITY_TYPE_WEIGHTS.get(vulnerability.get("vulnerability_type") or "", 1.0)
+
+    @staticmethod
+    def _asset_weight(asset: Dict[str, Any]) -> float:
+        return importance_weight(asset.get("importance_level")) \
+            * network_weight(asset.get("network_type")) \
+            * exposure_weight(asset.get("exposure"))
+
+    @staticmethod
+    def _resolve_assets(vulnerability: Dict[str, Any],
+                        assets_by_id: Optional[Dict[int, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """确定关联资产属性：资产库中有的资产使用资产库记录，否则使用漏洞上携带的属性"""
+        resolved = []
+        for asset in vulnerability.get("affected_assets", []) or []:
+            if not isinstance(asset, dict):
+                asset = {"id": asset}
+            stored = assets_by_id.get(asset.get("id")) if assets_by_id else None
+            resolved.append(stored or asset)
+        return resolved
+
+    @staticmethod
+    def _combine(base: float, type_weight: float, asset_factor: float) -> float:
+        technical = min(10.0, base * type_weight)
+        vpr = technical * (TECHNICAL_BASE_RATIO + (1 - TECHNICAL_BASE_RATIO) * asset_factor)
+        return round(max(0.0, min(10.0, vpr)), 1)
+
+    def score(self, vulnerability: Dict[str, Any],
+              assets_by_id: Optional[Dict[int, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """为单个漏洞计算VPR评分和优先级，并给出评估依据"""
+        assets = self._resolve_assets(vulnerability, assets_by_id)
+        base = self._base_score(vulnerability)
+        type_weight = self._type_weight(vulnerability)
+
+        # 取风险最高的资产作为业务风险依据，无关联资产时按属性未知处理
+        key_asset: Dict[str, Any] = max(assets, key=self._asset_weight) if assets else {}
+        asset_factor = self._asset_weight(key_asset)
+        vpr_score = self._combine(base, type_weight, asset_factor)
+        priority = priority_for_vpr(vpr_score)
+
+        technical = min(10.0, base * type_weight)
+        vulnerability_type = vulnerability.get("vulnerability_type") or "未知"
+        base_source = "CVSS评分" if vulnerability.get("cvss_score") is not None else "风险等级估算分"
+        reasoning = (
+            f"{base_source} {base} × 漏洞类型系数 {type_weight}（{vulnerability_type}）= 技术风险 {technical:.2f}；"
+            f"资产系数 {asset_factor:.3f}（资产等级: {key_asset.get('importance_level') or '未知'}，"
+            f"网络属性: {key_asset.get('network_type') or '未知'}，暴露面: {key_asset.get('exposure') or '未知'}）；"
+            f"VPR = 技术风险 × ({TECHNICAL_BASE_RATIO} + {1 - TECHNICAL_BASE_RATIO:.2f} × 资产系数) = {vpr_score}，"
+            f"对应优先级: {priority}。"
+        )
+
+        return {
+            "vpr_score": vpr_score,
+            "priority": priority,
+            "assessment_reasoning": reasoning,
+            "technical_risk_factors": [
+                f"{base_source}: {base}",
+                f"漏洞类型: {vulnerability_type}（系数 {type_weight}）"
+            ],
+            "business_risk_factors": [
+                f"关联资产数量: {len(assets)}",
+                f"最高风险资产: {key_asset.get('name') or '无关联资产'}（资产系数 {asset_factor:.3f}）"
+            ],
+            "remediation_priority": f"根据本地规则评分，建议按“{priority}”优先级安排修复。",
+            "asset_assessment": {
+                "asset_level": key_asset.get("importance_level") or "未知",
+                "network_property": key_asset.get("network_type") or "未知",
+                "exposure": key_asset.get("exposure") or "未知",
+                "business_system": key_asset.get("business_system") or "未知",
+                "business_impact": key_asset.get("business_impact") or "未知"
+            }
+        }
+
+    def score_batch(self, vulnerabilities: List[Dict[str, Any]],
+                    assets_by_id: Dict[int, Dict[str, Any]]) -> List[Tuple[float, Optional[str]]]:
+        """批量计算VPR评分和优先级，返回与输入顺序一致的(VPR评分, 优先级)列表
+
+        按列计算：资产系数只按资产计算一次，每个漏洞只做查表和一次组合运算。
+        """
+        unknown_factor = self._asset_weight({})
+        asset_weights = {asset_id: self._asset_weight(asset) for asset_id, asset in assets_by_id.items()}
+
+        def asset_factor(asset: Any) -> float:
+            # 与_resolve_assets相同：资产库中没有的资产使用漏洞上携带的属性
+            if not isinstance(asset, dict):
+                asset = {"id": asset}
+            weight = asset_weights.get(asset.get("id"))
+            return weight if weight is not None else self._asset_weight(asset)
+
+        bases = [self._base_score(v) for v in vulnerabilities]
+        type_weights = [self._type_weight(v) for v in vulnerabilities]
+        asset_factors = [
+            max((asset_factor(a) for a in v.get("affected_assets", []) or []), default=unknown_factor)
+            for v in vulnerabilities
+        ]
+        vpr_scores = [self._combine(b, t, f) for b, t, f in zip(bases, type_weights, asset_factors)]
+        return [(score, priority_for_vpr(score)) for score in vpr_scores]
+
+# 创建全局实例
+vpr_scoring_engine = VPRScoringEngine()
@@ -0,0 +1,533 @@
+import bisect
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from app.services.data_version import data_version
+
+logger = logging.getLogger(__name__)
+
+# 查询表达式中的逻辑节点键
+LOGICAL_KEYS = ("and", "or", "not")
+
+# 建立哈希索引的字段（等值/集合查询）
+HASH_INDEX_FIELDS = (
+    "id", "risk_level", "status", "vulnerability_type", "priority",
+    "department", "responsible_person", "cve_id", "affected_asset_id"
+)
+# 建立有序索引的数值字段（范围查询）
+RANGE_INDEX_FIELDS = ("cvss_score", "vpr_score", "fix_time_hours")
+# 建立有序索引的时间字段（范围查询）
+DATE_INDEX_FIELDS = ("discovery_date", "first_found_date", "latest_found_date")
+# 只能通过顺序扫描匹配的文本字段
+SCAN_FIELDS = (
+    "name", "description", "vulnerability_url", "remediation_steps",
+    "impact_details", "affected_components", "impact_scope", "references",
+    "fix_impact", "reproduction_steps"
+)
+# 可在查询表达式中使用的全部字段
+QUERY_FIELDS = HASH_INDEX_FIELDS + RANGE_INDEX_FIELDS + DATE_INDEX_FIELDS + SCAN_FIELDS
+
+SUPPORTED_OPS = ("eq", "ne", "in", "not_in", "gt", "gte", "lt", "lte", "contains", "exists")
+RANGE_OPS = ("gt", "gte", "lt", "lte")
+
+def _parse_datetime(value: Any) -> Optional[datetime.datetime]:
+    """解析时间值，统一转换为不带时区的datetime以便比较"""
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        parsed = value
+    else:
+        parsed = None
+        try:
+            parsed = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%Y-%m-%dT%H:%M:%S'):
+                try:
+                    parsed = datetime.datetime.strptime(str(value), fmt)
+                    break
+                except ValueError:
+                    continue
+        if parsed is None:
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _field_values(record: Dict[str, Any], field: str) -> List[Any]:
+    """获取记录中某个字段的值列表（关联资产ID为多值字段）"""
+    if field == "affected_asset_id":
+        return [a.get("id") for a in record.get("affected_assets", []) or []]
+    return [record.get(field)]
+
+class VulnerabilityIndex:
+    """漏洞数据的内存索引
+
+    哈希索引: 字段值 -> 记录位置集合
+    有序索引: [(字段值, 记录位置)] 按值排序，用于范围查询
+    """
+
+    def __init__(self, records: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        self.records = records
+        self.universe: Set[int] = set(range(len(records)))
+        self.hash_indexes: Dict[str, Dict[Any, Set[int]]] = {f: {} for f in HASH_INDEX_FIELDS}
+        self.range_indexes: Dict[str, List[Tuple[Any, int]]] = {}
+        self.range_keys: Dict[str, List[Any]] = {}
+
+        for pos, record in enumerate(records):
+            for field in HASH_INDEX_FIELDS:
+                for value in _field_values(record, field):
+                    self.hash_indexes[field].setdefault(value, set()).add(pos)
+
+        for field in RANGE_INDEX_FIELDS:
+            entries = [(r.get(field), pos) for pos, r in enumerate(records) if r.get(field) is not None]
+            entries.sort(key=lambda item: item[0])
+            self.range_indexes[field] = entries
+            self.range_keys[field] = [item[0] for item in entries]
+
+        for field in DATE_INDEX_FIELDS:
+            entries = []
+            for pos, record in enumerate(records):
+                parsed = _parse_datetime(record.get(field))
+                if parsed is not None:
+                    entries.append((parsed, pos))
+            entries.sort(key=lambda item: item[0])
+            self.range_indexes[field] = entries
+            self.range_keys[field] = [item[0] for item in entries]
+
+        self.build_ms = (time.perf_counter() - started) * 1000
+
+    def lookup(self, field: str, values: List[Any]) -> Set[int]:
+        """哈希索引查找，返回匹配任一值的记录位置"""
+        index = self.hash_indexes[field]
+        if len(values) == 1:
+            return index.get(values[0], set())
+        result: Set[int] = set()
+        for value in values:
+            result |= index.get(value, set())
+        return result
+
+    def estimate(self, field: str, values: List[Any]) -> int:
+        """估算哈希索引查找的结果行数"""
+        index = self.hash_indexes[field]
+        return sum(len(index.get(value, ())) for value in values)
+
+    def range_bounds(self, field: str, op: str, value: Any) -> Tuple[int, int]:
+        """有序索引二分查找，返回匹配区间[start, end)"""
+        keys = self.range_keys[field]
+        if op == "gt":
+            return bisect.bisect_right(keys, value), len(keys)
+        if op == "gte":
+            return bisect.bisect_left(keys, value), len(keys)
+        if op == "lt":
+            return 0, bisect.bisect_left(keys, value)
+        return 0, bisect.bisect_right(keys, value)
+
+    def range(self, field: str, op: str, value: Any) -> Set[int]:
+        """有序索引范围查找"""
+        start, end = self.range_bounds(field, op, value)
+        return {pos for _, pos in self.range_indexes[field][start:end]}
+
+class _ExecutionContext:
+    """单次查询执行的上下文，记录explain阶段信息"""
+
+    def __init__(self, index: VulnerabilityIndex, explain: bool):
+        self.index = index
+        self.explain = explain
+        self.stages: List[Dict[str, Any]] = []
+
+    def record(self, node: "PlanNode", strategy: str, input_rows: int, output_rows: int, started: float):
+        if self.explain:
+            self.stages.append({
+                "node": node.describe(),
+                "strategy": strategy,
+                "input_rows": input_rows,
+                "output_rows": output_rows,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 4)
+            })
+
+class PlanNode:
+    """编译后的谓词计划节点"""
+
+    def uses_index(self) -> bool:
+        return False
+
+    def estimate(self, ctx: _ExecutionContext) -> int:
+        return len(ctx.index.universe)
+
+    def evaluate(self, ctx: _ExecutionContext, candidates: Optional[Set[int]]) -> Set[int]:
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        raise NotImplementedError
+
+class HashLookupNode(PlanNode):
+    """使用哈希索引的等值/集合匹配"""
+
+    def __init__(self, field: str, values: List[Any]):
+        self.field = field
+        self.values = values
+
+    def uses_index(self) -> bool:
+        return True
+
+    def estimate(self, ctx: _ExecutionContext) -> int:
+        return ctx.index.estimate(self.field, self.values)
+
+    def evaluate(self, ctx, candidates):
+        started = time.perf_counter()
+        matched = ctx.index.lookup(self.field, self.values)
+        result = matched if candidates is None else matched & candidates
+        ctx.record(self, f"hash_index({self.field})", len(matched), len(result), started)
+        return result
+
+    def describe(self) -> str:
+        if len(self.values) == 1:
+            return f"{self.field} = {self.values[0]!r}"
+        return f"{self.field} IN {self.values!r}"
+
+class RangeLookupNode(PlanNode):
+    """使用有序索引的范围匹配"""
+
+    _SYMBOLS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+    def __init__(self, field: str, op: str, value: Any, raw_value: Any):
+        self.field = field
+        self.op = op
+        self.value = value
+        self.raw_value = raw_value
+
+    def uses_index(self) -> bool:
+        return True
+
+    def estimate(self, ctx: _ExecutionContext) -> int:
+        start, end = ctx.index.range_bounds(self.field, self.op, self.value)
+        return end - start
+
+    def evaluate(self, ctx, candidates):
+        started = time.perf_counter()
+        matched = ctx.index.range(self.field, self.op, self.value)
+        result = matched if candidates is None else matched & candidates
+        ctx.record(self, f"range_index({self.field})", len(matched), len(result), started)
+        return result
+
+    def describe(self) -> str:
+        return f"{self.field} {self._SYMBOLS[self.op]} {self.raw_value!r}"
+
+class ScanNode(PlanNode):
+    """无法使用索引时的顺序扫描谓词"""
+
+    def __init__(self, field: str, op: str, value: Any, predicate: Callable[[Dict[str, Any]], bool]):
+        self.field = field
+        self.op = op
+        self.value = value
+        self.predicate = predicate
+
+    def evaluate(self, ctx, candidates):
+        started = time.perf_counter()
+        scope = ctx.index.universe if candidates is None else candidates
+        records = ctx.index.records
+        predicate = self.predicate
+        result = {pos for pos in scope if predicate(records[pos])}
+        ctx.record(self, "scan", len(scope), len(result), started)
+        return result
+
+    def describe(self) -> str:
+        if self.op == "exists":
+            return f"{self.field} EXISTS {bool(self.value)}"
+        return f"{self.field} {self.op.upper()} {self.value!r}"
+
+class AndNode(PlanNode):
+    """逻辑与：按预估结果行数从小到大执行索引节点，再用扫描节点过滤候选集"""
+
+    def __init__(self, children: List[PlanNode]):
+        self.children = children
+
+    def uses_index(self) -> bool:
+        return any(child.uses_index() for child in self.children)
+
+    def estimate(self, ctx):
+        return min(child.estimate(ctx) for child in self.children)
+
+    def evaluate(self, ctx, candidates):
+        started = time.perf_counter()
+        indexed = sorted((c for c in self.children if c.uses_index()), key=lambda c: c.estimate(ctx))
+        scans = [c for c in self.children if not c.uses_index()]
+        result = candidates
+        for child in indexed + scans:
+            result = child.evaluate(ctx, result)
+            if not result:
+                break
+        result = set() if result is None else result
+        ctx.record(self, "intersect", len(ctx.index.universe if candidates is None else candidates), len(result), started)
+        return result
+
+    def describe(self) -> str:
+        return "AND(" + ", ".join(child.describe() for child in self.children) + ")"
+
+class OrNode(PlanNode):
+    """逻辑或：合并各子节点结果"""
+
+    def __init__(self, children: List[PlanNode]):
+        self.children = children
+
+    def uses_index(self) -> bool:
+        return all(child.uses_index() for child in self.children)
+
+    def estimate(self, ctx):
+        return min(len(ctx.index.universe), sum(child.estimate(ctx) for child in self.children))
+
+    def evaluate(self, ctx, candidates):
+        started = time.perf_counter()
+        result: Set[int] = set()
+        for child in self.children:
+            result |= child.evaluate(ctx, candidates)
+        ctx.record(self, "union", len(ctx.index.universe if candidates is None else candidates), len(result), started)
+        return result
+
+    def describe(self) -> str:
+        return "OR(" + ", ".join(child.describe() for child in self.children) + ")"
+
+class NotNode(PlanNode):
+    """逻辑非：从候选集中排除子节点结果"""
+
+    def __init__(self, child: PlanNode):
+        self.child = child
+
+    def uses_index(self) -> bool:
+        return self.child.uses_index()
+
+    def evaluate(self, ctx, candidates):
+        started = time.perf_counter()
+        scope = ctx.index.universe if candidates is None else candidates
+        result = scope - self.child.evaluate(ctx, candidates)
+        ctx.record(self, "complement", len(scope), len(result), started)
+        return result
+
+    def describe(self) -> str:
+        return f"NOT({self.child.describe()})"
+
+class CompiledQuery:
+    """编译后的查询计划"""
+
+    def __init__(self, plan_hash: str, root: PlanNode, compile_ms: float):
+        self.plan_hash = plan_hash
+        self.root = root
+        self.compile_ms = compile_ms
+
+def check_logical_node(node: Dict[str, Any]):
+    """逻辑节点（and/or/not）只能包含一个键，混用时其余条件会被忽略，直接拒绝"""
+    logical = [key for key in LOGICAL_KEYS if key in node]
+    if logical and len(node) > 1:
+        raise ValueError(f"逻辑节点只能包含一个键，'{logical[0]}' 不能与 {', '.join(repr(k) for k in node if k != logical[0])} 同时出现")
+
+class VulnerabilityQueryEngine:
+    """漏洞布尔表达式查询引擎
+
+    表达式树格式：
+    - {"and": [表达式, ...]} / {"or": [表达式, ...]} / {"not": 表达式}
+    - {"field": "risk_level", "op": "in", "value": ["高", "紧急"]}
+    表达式按哈希缓存编译结果，索引在数据版本变化后惰性重建。
+    """
+
+    def __init__(self, max_cached_plans: int = 256):
+        self._plan_cache: "OrderedDict[str, CompiledQuery]" = OrderedDict()
+        self._max_cached_plans = max_cached_plans
+        self._index: Optional[VulnerabilityIndex] = None
+        self._index_version = -1
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def expression_hash(expression: Dict[str, Any]) -> str:
+        """计算表达式的规范化哈希"""
+        canonical = json.dumps(expression, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def compile(self, expression: Dict[str, Any]) -> Tuple[CompiledQuery, bool]:
+        """编译表达式，返回(编译结果, 是否命中缓存)"""
+        plan_hash = self.expression_hash(expression)
+        with self._lock:
+            cached = self._plan_cache.get(plan_hash)
+            if cached is not None:
+                self._plan_cache.move_to_end(plan_hash)
+                return cached, True
+
+        started = time.perf_counter()
+        root = self._compile_node(expression)
+        compiled = CompiledQuery(plan_hash, root, (time.perf_counter() - started) * 1000)
+
+        with self._lock:
+            self._plan_cache[plan_hash] = compiled
+            if len(self._plan_cache) > self._max_cached_plans:
+                self._plan_cache.popitem(last=False)
+        logger.info(f"编译查询计划 - 哈希: {plan_hash[:12]}, 计划: {root.describe()}")
+        return compiled, False
+
+    def _compile_node(self, node: Any) -> PlanNode:
+        if not isinstance(node, dict):
+            raise ValueError(f"表达式节点必须是对象: {node!r}")
+        check_logical_node(node)
+
+        if "and" in node or "or" in node:
+            key = "and" if "and" in node else "or"
+            children = node[key]
+            if not isinstance(children, list) or not children:
+                raise ValueError(f"'{key}' 节点必须是非空数组")
+            compiled = [self._compile_node(child) for child in children]
+            # 展平同类嵌套节点
+            node_cls = AndNode if key == "and" else OrNode
+            flattened: List[PlanNode] = []
+            for child in compiled:
+                if isinstance(child, node_cls):
+                    flattened.extend(child.children)
+                else:
+                    flattened.append(child)
+            if key == "or":
+                flattened = self._merge_hash_lookups(flattened)
+            return flattened[0] if len(flattened) == 1 else node_cls(flattened)
+
+        if "not" in node:
+            child = self._compile_node(node["not"])
+            if isinstance(child, NotNode):
+                return child.child
+            return NotNode(child)
+
+        return self._compile_leaf(node)
+
+    @staticmethod
+    def _merge_hash_lookups(children: List[PlanNode]) -> List[PlanNode]:
+        """将OR下同一字段的多个等值查找合并为一次IN查找"""
+        merged: List[PlanNode] = []
+        by_field: Dict[str, HashLookupNode] = {}
+        for child in children:
+            if isinstance(child, HashLookupNode):
+                existing = by_field.get(child.field)
+                if existing is not None:
+                    existing.values = list(dict.fromkeys(existing.values + child.values))
+                    continue
+                child = HashLookupNode(child.field, list(child.values))
+                by_field[child.field] = child
+            merged.append(child)
+        return merged
+
+    def _compile_leaf(self, node: Dict[str, Any]) -> PlanNode:
+        field = node.get("field")
+        op = node.get("op", "eq")
+        value = node.get("value")
+
+        if field not in QUERY_FIELDS:
+            raise ValueError(f"不支持的查询字段: {field}")
+        if op not in SUPPORTED_OPS:
+            raise ValueError(f"不支持的操作符: {op}，可选值: {', '.join(SUPPORTED_OPS)}")
+
+        if op in ("in", "not_in"):
+            if not isinstance(value, list):
+                raise ValueError(f"操作符 '{op}' 的值必须是数组")
+        elif op == "ne":
+            return NotNode(self._compile_leaf({"field": field, "op": "eq", "value": value}))
+
+        if op == "not_in":
+            return NotNode(self._compile_leaf({"field": field, "op": "in", "value": value}))
+
+        if field in HASH_INDEX_FIELDS and op in ("eq", "in"):
+            values = value if op == "in" else [value]
+            try:
+                values = list(dict.fromkeys(values))
+            except TypeError:
+                raise ValueError(f"字段 {field} 的查询值必须是标量")
+            return HashLookupNode(field, values)
+
+        if op in RANGE_OPS and field in RANGE_INDEX_FIELDS:
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise ValueError(f"字段 {field} 的范围查询值必须是数字")
+            return RangeLookupNode(field, op, value, value)
+
+        if op in RANGE_OPS and field in DATE_INDEX_FIELDS:
+            parsed = _parse_datetime(value)
+            if parsed is None:
+                raise ValueError(f"无法解析日期: {value}")
+            return RangeLookupNode(field, op, parsed, value)
+
+        return ScanNode(field, op, value, self._build_predicate(field, op, value))
+
+    @staticmethod
+    def _build_predicate(field: str, op: str, value: Any) -> Callable[[Dict[str, Any]], bool]:
+        """为无法使用索引的条件构建扫描谓词"""
+        if op == "exists":
+            expected = bool(value) if value is not None else True
+            return lambda r: any(v not in (None, "") for v in _field_values(r, field)) == expected
+        if op == "contains":
+            needle = str(value).lower()
+            return lambda r: any(v is not None and needle in str(v).lower() for v in _field_values(r, field))
+        if op == "eq":
+            return lambda r: value in _field_values(r, field)
+        if op == "in":
+            return lambda r: any(v in value for v in _field_values(r, field))
+        if op in RANGE_OPS:
+            compare = {
+                "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+                "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b
+            }[op]
+
+            def predicate(record):
+                for v in _field_values(record, field):
+                    if v is None:
+                        continue
+                    try:
+                        if compare(v, value):
+                            return True
+                    except TypeError:
+                        continue
+                return False
+            return predicate
+        raise ValueError(f"字段 {field} 不支持操作符 {op}")
+
+    def _get_index(self, records: List[Dict[str, Any]]) -> Tuple[VulnerabilityIndex, bool]:
+        """获取索引，数据版本变化或数据源变化时重建"""
+        version = data_version.get("vulnerabilities")
+        with self._lock:
+            index = self._index
+            if index is not None and self._index_version == version and index.records is records \
+                    and len(index.universe) == len(records):
+                return index, False
+        index = VulnerabilityIndex(records)
+        with self._lock:
+            self._index = index
+            self._index_version = version
+        logger.info(f"重建漏洞索引 - 记录数: {len(records)}, 耗时: {index.build_ms:.2f}ms, 数据版本: {version}")
+        return index, True
+
+    def execute(self, expression: Dict[str, Any], records: List[Dict[str, Any]],
+                explain: bool = False) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """执行查询，返回(匹配记录, explain信息)"""
+        started = time.perf_counter()
+        compiled, cache_hit = self.compile(expression)
+        index, rebuilt = self._get_index(records)
+
+        ctx = _ExecutionContext(index, explain)
+        positions = compiled.root.evaluate(ctx, None)
+        matched = [index.records[pos] for pos in sorted(positions)]
+
+        if not explain:
+            return matched, None
+
+        return matched, {
+            "plan_hash": compiled.plan_hash,
+            "plan_cache_hit": cache_hit,
+            "plan": compiled.root.describe(),
+            "compile_ms": round(compiled.compile_ms, 4) if not cache_hit else 0.0,
+            "index_rebuilt": rebuilt,
+            "index_build_ms": round(index.build_ms, 4) if rebuilt else 0.0,
+            "data_version": self._index_version,
+            "stages": ctx.stages,
+            "total_ms": round((time.perf_counter() - started) * 1000, 4)
+        }
+
+# 创建全局实例
+vulnerability_query_engine = VulnerabilityQueryEngine()
@@ -0,0 +1,52 @@
+"""图表提示词数据部分的体积对比
+
+对比旧方式（前10条漏洞和资产的完整JSON）与 app.services.chart_summary 的本地汇总
+在不同数据量下放入提示词的字符数和汇总耗时。旧方式体积固定，但图表只反映前10条记录；
+汇总覆盖全部记录，体积只随分类取值数增长。
+
+用法（在 backend 目录下）:
+    PYTHONPATH=. python benchmarks/chart_prompt_benchmark.py
+"""
+import copy
+import datetime
+import json
+import logging
+import random
+import time
+
+logging.disable(logging.CRITICAL)
+
+from app.api.endpoints.assets import mock_assets
+from app.api.endpoints.vulnerabilities import mock_vulnerabilities
+from app.services.chart_summary import compact_json, summarize_assets, summarize_vulnerabilities
+
+DATASET_SIZES = [10, 1_000, 100_000]
+
+def build_records(templates, size, rng):
+    """以模拟数据为模板生成指定数量的记录，打散评分和发现时间"""
+    now = datetime.datetime.now()
+    records = []
+    for i in range(size):
+        record = copy.copy(templates[i % len(templates)])
+        record["id"] = i + 1
+        if "cvss_score" in record:
+            record["cvss_score"] = round(rng.uniform(0, 10), 1)
+            record["vpr_score"] = round(rng.uniform(0, 10), 1)
+        record["discovery_date"] = (now - datetime.timedelta(days=rng.randint(0, 365))).isoformat()
+        records.append(record)
+    return records
+
+def main():
+    rng = random.Random(42)
+    print(f"{'记录数':>8} {'旧方式(字符)':>14} {'汇总(字符)':>12} {'汇总耗时(ms)':>14}")
+    for size in DATASET_SIZES:
+        vulnerabilities = build_records(mock_vulnerabilities, size, rng)
+        assets = build_records(mock_assets, size, rng)
+        legacy = len(json.dumps(vulnerabilities[:10], ensure_ascii=False)) + len(json.dumps(assets[:10], ensure_ascii=False))
+        started = time.perf_counter()
+        summary = compact_json(summarize_vulnerabilities(vulnerabilities)) + compact_json(summarize_assets(assets))
+        elapsed = time.perf_counter() - started
+        print(f"{size:>8} {legacy:>14} {len(summary):>12} {elapsed * 1000:>14.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""SSE编码性能对比
+
+模拟一次中文回答的流式输出（每个message事件携带几个字符），对比旧的
+"data: " + json.dumps(...) + "\\n\\n" 写法与 app.core.sse.SSEEncoder 的输出字节数和CPU耗时。
+
+用法（在 backend 目录下）:
+    PYTHONPATH=. python benchmarks/sse_encoder_benchmark.py
+"""
+import json
+import time
+import uuid
+
+from app.core import sse
+from app.core.sse import SSEEncoder
+
+ANSWER = ("该漏洞允许远程攻击者通过构造恶意的JNDI查找字符串执行任意代码，"
+          "建议立即将log4j升级到2.17.1及以上版本，并在升级前临时移除JndiLookup类。") * 40
+TOKEN_SIZE = 3
+REPEAT = 20
+
+def tokens():
+    return [ANSWER[i:i + TOKEN_SIZE] for i in range(0, len(ANSWER), TOKEN_SIZE)]
+
+META = {
+    "conversation_id": str(uuid.uuid4()),
+    "user_id": str(uuid.uuid4()),
+    "message_id": str(uuid.uuid4()),
+    "task_id": str(uuid.uuid4())
+}
+
+def legacy_stream(parts):
+    """旧实现：每个token重新序列化完整字典，默认ASCII转义，由StreamingResponse编码为UTF-8"""
+    frames = []
+    for part in parts:
+        frame = "data: " + json.dumps({"event": "message", "answer": part, **META}) + "\n\n"
+        frames.append(frame.encode("utf-8"))
+    frames.append(("data: " + json.dumps({"event": "message_end", "answer": "", **META}) + "\n\n").encode("utf-8"))
+    return frames
+
+def encoder_stream(parts):
+    encoder = SSEEncoder()
+    frames = [encoder.message(part, **META) for part in parts]
+    frames.append(encoder.end("", **META))
+    return frames
+
+def measure(build, parts):
+    best = float("inf")
+    frames = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        frames = build(parts)
+        best = min(best, time.perf_counter() - started)
+    return best, sum(len(frame) for frame in frames), len(frames)
+
+def check_equivalent(parts):
+    for old, new in zip(legacy_stream(parts), encoder_stream(parts)):
+        assert json.loads(old[6:]) == json.loads(new[6:])
+
+def main():
+    parts = tokens()
+    check_equivalent(parts)
+    print(f"回答长度: {len(ANSWER)} 字符, 每帧 {TOKEN_SIZE} 字符, 共 {len(parts) + 1} 帧")
+    print(f"{'实现':<24} {'总字节':>10} {'每帧字节':>8} {'总耗时(ms)':>11} {'每帧(us)':>9}")
+
+    results = [("json.dumps (旧实现)", measure(legacy_stream, parts))]
+    backend = sse.orjson
+    if backend is not None:
+        results.append(("SSEEncoder + orjson", measure(encoder_stream, parts)))
+    sse.orjson = None
+    try:
+        results.append(("SSEEncoder + json", measure(encoder_stream, parts)))
+    finally:
+        sse.orjson = backend
+
+    for name, (seconds, size, count) in results:
+        print(f"{name:<24} {size:>10} {size / count:>8.1f} {seconds * 1000:>11.2f} {seconds / count * 1e6:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""熔断器状态流转测试
+
+用aiohttp启动一个桩Dify服务，通过DifyService的幂等请求（_with_retries + _pooled_session）
+驱动熔断器完成 关闭 -> 打开 -> 半开 -> 关闭/重新打开 的全部状态转换。
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from app.core.config import settings
+from app.exceptions.dify_error import DifyCircuitOpenError
+from app.services.circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+from app.services.dify_service import DifyService
+
+OPEN_SECONDS = 0.2
+
+class StubDify:
+    """桩Dify服务：按预设的状态码序列响应会话列表请求，序列用完后返回200"""
+
+    def __init__(self):
+        self.statuses = []
+        self.delay = 0.0
+        self.calls = 0
+
+    async def conversations(self, request):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        status = self.statuses.pop(0) if self.statuses else 200
+        if status != 200:
+            return web.Response(status=status, text="stub error")
+        return web.json_response({"data": [{"id": "c1"}], "has_more": False})
+
+@asynccontextmanager
+async def running_service():
+    """启动桩服务，返回指向它的DifyService"""
+    stub = StubDify()
+    app = web.Application()
+    app.add_routes([web.get("/v1/conversations", stub.conversations)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    service = DifyService()
+    service.base_url = f"http://127.0.0.1:{port}/v1"
+    try:
+        yield service, stub
+    finally:
+        await service.shutdown()
+        await runner.cleanup()
+
+async def fetch(service):
+    return await service.fetch_conversations("tester")
+
+@pytest.fixture(autouse=True)
+def breaker_settings(monkeypatch):
+    monkeypatch.setattr(settings, "DIFY_BREAKER_ENABLED", True)
+    monkeypatch.setattr(settings, "DIFY_BREAKER_WINDOW_SIZE", 4)
+    monkeypatch.setattr(settings, "DIFY_BREAKER_MIN_CALLS", 2)
+    monkeypatch.setattr(settings, "DIFY_BREAKER_FAILURE_RATE", 0.5)
+    monkeypatch.setattr(settings, "DIFY_BREAKER_SLOW_CALL_SECONDS", 5)
+    monkeypatch.setattr(settings, "DIFY_BREAKER_SLOW_RATE", 0.5)
+    monkeypatch.setattr(settings, "DIFY_BREAKER_OPEN_SECONDS", OPEN_SECONDS)
+    monkeypatch.setattr(settings, "DIFY_BREAKER_HALF_OPEN_CALLS", 2)
+    monkeypatch.setattr(settings, "DIFY_RETRY_MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(settings, "DIFY_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(settings, "DIFY_RETRY_MAX_DELAY", 0)
+
+async def open_breaker(service, stub):
+    stub.statuses = [500, 500]
+    for _ in range(2):
+        with pytest.raises(aiohttp.ClientResponseError):
+            await fetch(service)
+    assert service.circuit_breaker.state == STATE_OPEN
+
+def test_failures_open_breaker_and_reject_without_calling_upstream():
+    async def scenario():
+        async with running_service() as (service, stub):
+            assert service.circuit_breaker.state == STATE_CLOSED
+            await open_breaker(service, stub)
+
+            with pytest.raises(DifyCircuitOpenError) as excinfo:
+                await fetch(service)
+            assert excinfo.value.retry_after >= 1
+            assert stub.calls == 2
+            metrics = service.circuit_breaker.get_metrics()
+            assert metrics["opened"] == 1
+            assert metrics["rejected"] == 1
+    asyncio.run(scenario())
+
+def test_client_errors_do_not_open_breaker():
+    async def scenario():
+        async with running_service() as (service, stub):
+            stub.statuses = [404, 404, 404]
+            for _ in range(3):
+                with pytest.raises(aiohttp.ClientResponseError):
+                    await fetch(service)
+            assert service.circuit_breaker.state == STATE_CLOSED
+            assert service.circuit_breaker.get_metrics()["failures"] == 0
+    asyncio.run(scenario())
+
+def test_slow_calls_open_breaker(monkeypatch):
+    monkeypatch.setattr(settings, "DIFY_BREAKER_SLOW_CALL_SECONDS", 0.05)
+
+    async def scenario():
+        async with running_service() as (service, stub):
+            stub.delay = 0.1
+            await fetch(service)
+            await fetch(service)
+            assert service.circuit_breaker.state == STATE_OPEN
+            assert service.circuit_breaker.get_metrics()["slow_calls"] == 2
+    asyncio.run(scenario())
+
+def test_successful_probes_close_breaker():
+    async def scenario():
+        async with running_service() as (service, stub):
+            await open_breaker(service, stub)
+            await asyncio.sleep(OPEN_SECONDS)
+            assert service.circuit_breaker.state == STATE_HALF_OPEN
+
+            assert await fetch(service) == {"data": [{"id": "c1"}], "has_more": False}
+            assert service.circuit_breaker.state == STATE_HALF_OPEN
+            await fetch(service)
+            assert service.circuit_breaker.state == STATE_CLOSED
+            assert stub.calls == 4
+    asyncio.run(scenario())
+
+def test_failed_probe_reopens_breaker():
+    async def scenario():
+        async with running_service() as (service, stub):
+            await open_breaker(service, stub)
+            await asyncio.sleep(OPEN_SECONDS)
+            assert service.circuit_breaker.state == STATE_HALF_OPEN
+
+            stub.statuses = [503]
+            with pytest.raises(aiohttp.ClientResponseError):
+                await fetch(service)
+            assert service.circuit_breaker.state == STATE_OPEN
+            assert service.circuit_breaker.get_metrics()["opened"] == 2
+            with pytest.raises(DifyCircuitOpenError):
+                await fetch(service)
+            assert stub.calls == 3
+    asyncio.run(scenario())
+
+def test_half_open_limits_concurrent_probes():
+    async def scenario():
+        async with running_service() as (service, stub):
+            await open_breaker(service, stub)
+            await asyncio.sleep(OPEN_SECONDS)
+            stub.delay = 0.1
+
+            results = await asyncio.gather(*(fetch(service) for _ in range(3)), return_exceptions=True)
+            rejected = [r for r in results if isinstance(r, DifyCircuitOpenError)]
+            assert len(rejected) == 1
+            assert stub.calls == 4
+            assert service.circuit_breaker.state == STATE_CLOSED
+    asyncio.run(scenario())
+
+def test_retries_recover_from_transient_failures(monkeypatch):
+    monkeypatch.setattr(settings, "DIFY_RETRY_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "DIFY_BREAKER_MIN_CALLS", 4)
+
+    async def scenario():
+        async with running_service() as (service, stub):
+            stub.statuses = [502, 502]
+            assert await fetch(service) == {"data": [{"id": "c1"}], "has_more": False}
+            assert stub.calls == 3
+            assert service.get_retry_metrics()["retries"] == 2
+            # 每次重试都单独计入熔断统计
+            metrics = service.circuit_breaker.get_metrics()
+            assert metrics["calls"] == 3
+            assert metrics["failures"] == 2
+            assert metrics["state"] == STATE_CLOSED
+    asyncio.run(scenario())
+
+def test_retries_stop_once_breaker_opens(monkeypatch):
+    monkeypatch.setattr(settings, "DIFY_RETRY_MAX_ATTEMPTS", 5)
+
+    async def scenario():
+        async with running_service() as (service, stub):
+            stub.statuses = [500] * 5
+            with pytest.raises(DifyCircuitOpenError):
+                await fetch(service)
+            # 第二次失败后熔断打开，剩余重试被直接拒绝，不再访问上游
+            assert stub.calls == 2
+            assert service.get_retry_metrics() == {"max_attempts": 5, "retries": 2, "exhausted": 0}
+            assert service.circuit_breaker.state == STATE_OPEN
+    asyncio.run(scenario())
+
+def test_client_errors_are_not_retried(monkeypatch):
+    monkeypatch.setattr(settings, "DIFY_RETRY_MAX_ATTEMPTS", 3)
+
+    async def scenario():
+        async with running_service() as (service, stub):
+            stub.statuses = [404]
+            with pytest.raises(aiohttp.ClientResponseError):
+                await fetch(service)
+            assert stub.calls == 1
+            assert service.get_retry_metrics()["retries"] == 0
+    asyncio.run(scenario())